@@ -1,141 +1,620 @@
-import google.generativeai as genai
-from openai import OpenAI
+import asyncio
+import contextvars
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from config import (
-    GEMINI_API_KEY, 
-    OPENAI_API_KEY,
-    GEMINI_CONFIG,
-    GEMINI_SAFETY_SETTINGS,
-    OPENAI_CONFIG,
     LOGGING_ENABLED,
     LOG_FILE_PATH,
-    REQUEST_TIMEOUT,
-    MAX_RETRIES,
     OUTPUT_DIR
 )
+from chunking import needs_chunking, process_in_chunks
+from incremental import block_cache_scope, process_regions
+from logging_setup import configure_logging, request_context
+from metrics import get_default_metrics
+from patching import EDIT_MODE_DIFF, EDIT_MODE_FULL, SEARCH_REPLACE_INSTRUCTIONS, PatchError, apply_patch
+from prompt_cache import PROMPT_CACHE_ENABLED, get_default_prompt_cache
+from providers import create_provider, iterate_in_thread
+from response_cache import CACHE_ENABLED, get_default_cache, make_cache_key
+from retry_policy import CircuitOpenError, RetryPolicy, get_circuit_breaker, get_rate_limiter
+from token_budget import count_tokens, prepare_prompt
 
-# Setup logging
+# Entry points set up the handlers once, see logging_setup.configure_logging
 if LOGGING_ENABLED:
-    logging.basicConfig(
-        filename=LOG_FILE_PATH,
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
     logger = logging.getLogger(__name__)
 
+class RequestCancelled(Exception):
+    """Raised when a request is cancelled before it completes"""
+
 class AIServiceProcessor:
-    def __init__(self, service="gemini"):
+    def __init__(self, service="gemini", cache=None, retry_policy=None, lazy=False, provider=None, metrics=None,
+                 prompt_cache=None):
         self.service = service.lower()
-        self.retries = 0
-        self._setup_client()
+        self.provider = provider
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or get_default_metrics()
+        self.rate_limiter = get_rate_limiter(self.service)
+        self.circuit_breaker = get_circuit_breaker(self.service)
+        if cache is None and CACHE_ENABLED:
+            cache = get_default_cache()
+        # cache=False disables caching for this processor
+        self.cache = cache or None
+        if prompt_cache is None and PROMPT_CACHE_ENABLED:
+            prompt_cache = get_default_prompt_cache()
+        # prompt_cache=False sends prompts without prefix caching
+        self.prompt_cache = prompt_cache or None
+        # (prompt, code, edit mode) and the PreparedPrompt last built for them
+        self._prepared = None
+        # With lazy=True the provider SDK is imported and configured on first use (or ensure_client)
+        self._client_ready = False
+        if not lazy:
+            self._setup_client()
         
     def _setup_client(self):
         try:
-            if self.service == "gemini":
-                genai.configure(api_key=GEMINI_API_KEY)
-                self.model = self._setup_gemini()
-            elif self.service == "openai":
-                self.client = OpenAI(
-                    api_key=OPENAI_API_KEY,
-                    timeout=REQUEST_TIMEOUT
-                )
-            else:
-                raise ValueError("Unsupported AI service. Choose 'gemini' or 'openai'")
-                
+            if self.provider is None:
+                self.provider = create_provider(self.service)
+            # Clients are shared process-wide, so only the first processor per provider pays for setup
+            self.provider.setup()
+            self._client_ready = True
             if LOGGING_ENABLED:
-                logger.info(f"Successfully initialized {self.service} client")
+                logger.info("Successfully initialized %s client", self.service)
                 
         except Exception as e:
             error_msg = f"Error setting up {self.service} client: {str(e)}"
             if LOGGING_ENABLED:
                 logger.error(error_msg)
             raise Exception(error_msg)
+
+    @property
+    def display_name(self):
+        return self.provider.display_name if self.provider is not None else self.service
     
-    def _setup_gemini(self):
-        return genai.GenerativeModel(
-            model_name=GEMINI_CONFIG["model"],
-            generation_config={
-                "temperature": GEMINI_CONFIG["temperature"],
-                "top_p": GEMINI_CONFIG["top_p"],
-                "top_k": GEMINI_CONFIG["top_k"],
-                "max_output_tokens": GEMINI_CONFIG["max_output_tokens"],
-            },
-            safety_settings=GEMINI_SAFETY_SETTINGS
+    def ensure_client(self):
+        """Set up the provider client if that was deferred"""
+        if not self._client_ready:
+            self._setup_client()
+
+    def _build_prompt(self, prompt_input, file_content, edit_mode=EDIT_MODE_FULL, note=""):
+        return self._build_prefix(file_content, edit_mode, note) + self._build_suffix(prompt_input)
+
+    @staticmethod
+    def _build_prefix(file_content, edit_mode=EDIT_MODE_FULL, note=""):
+        """Instructions and code: the same for every prompt on this code, so providers can cache it"""
+        # Flush left: indentation inside the template was sent (and billed) with every request
+        if edit_mode == EDIT_MODE_DIFF:
+            instructions = SEARCH_REPLACE_INSTRUCTIONS
+        else:
+            instructions = "Return the updated code (as text, not as markdown block)."
+        prefix = (
+            "Update the following code according to the suggestions after it.\n"
+            f"{instructions}\n"
         )
+        if note:
+            prefix += f"{note}\n"
+        return prefix + f"Code:\n{file_content}\n"
 
-    def _process_with_gemini(self, prompt_input, file_content):
+    @staticmethod
+    def _build_suffix(prompt_input):
+        return f"Suggestions: {prompt_input}\n"
+
+    def _prepare_prompt(self, prompt_input, file_content, edit_mode=EDIT_MODE_FULL, usage=None):
+        """Build the prompt and size the output limit for this provider's model.
+
+        Over-budget code is compacted (see token_budget.prepare_prompt); the plan
+        is stored in usage["budget"].
+        """
+        if self.provider is None:
+            self.provider = create_provider(self.service)
+        key = (prompt_input, file_content, edit_mode)
+        last = self._prepared
+        if last is not None and last[0] == key:
+            # Tokenized ahead of time by warm_prompt, or a retry of the same request
+            if usage is not None:
+                usage["budget"] = last[1].plan.as_dict()
+            return last[1]
+        prepared = prepare_prompt(
+            prompt_input,
+            file_content,
+            lambda prompt, code, note: self._build_prompt(prompt, code, edit_mode, note),
+            model=self.provider.model_name,
+            edit_mode=edit_mode,
+            max_output_tokens=self.provider.max_output_tokens
+        )
+        plan = prepared.plan
+        suffix = self._build_suffix(prompt_input)
+        if self.prompt_cache is not None and prepared.prompt.endswith(suffix):
+            prepared.prefix = prepared.prompt[:-len(suffix)]
+            prepared.prefix_tokens = max(0, plan.input_tokens - count_tokens(suffix, plan.model))
+        self._prepared = (key, prepared)
+        if usage is not None:
+            usage["budget"] = plan.as_dict()
+        if LOGGING_ENABLED:
+            if plan.compaction:
+                logger.info(
+                    "Compacted %s prompt to %s tokens: %s",
+                    self.service, plan.input_tokens, ", ".join(plan.compaction)
+                )
+            if plan.over_budget:
+                logger.warning(
+                    "%s prompt needs %s input + %s output tokens, over the %s token context of %s",
+                    self.service, plan.input_tokens, plan.max_output_tokens, plan.context_window, plan.model
+                )
+            elif plan.output_may_truncate:
+                logger.warning(
+                    "%s output is limited to %s tokens for %s tokens of code; "
+                    "use diff mode or chunking to avoid truncation",
+                    self.service, plan.max_output_tokens, plan.code_tokens
+                )
+        return prepared
+
+    def warm_prompt(self, prompt_input, file_content, edit_mode=EDIT_MODE_FULL):
+        """Build and tokenize a prompt ahead of time; returns its BudgetPlan.
+
+        The next request for the same input reuses the work.
+        """
+        return self._prepare_prompt(prompt_input, file_content, edit_mode).plan
+
+    def _before_attempt(self, cancel_event, tokens):
+        """Gate an attempt on cancellation, the circuit breaker and the rate limiter.
+
+        Returns the circuit breaker's probe token (or None); the caller ends the
+        probe with circuit_breaker.end_probe() however the attempt finishes.
+        """
+        self._check_cancelled(cancel_event)
+        self.ensure_client()
+        probe = self.circuit_breaker.before_call()
         try:
-            prompt = f"""
-            Update the following code: {file_content} 
-            according to the following suggestions: {prompt_input} 
-            and return the code (as text, not as markdown block)
-            """
-            prompt_parts = [prompt]
-            response = self.model.generate_content(prompt_parts)
-            
-            if LOGGING_ENABLED:
-                logger.info("Successfully processed request with Gemini")
-                
-            return response.text
-            
-        except Exception as e:
-            error_msg = f"Error processing with Gemini: {str(e)}"
+            if not self.rate_limiter.acquire(tokens, cancel_event):
+                self._check_cancelled(cancel_event)
+        except BaseException:
+            self.circuit_breaker.end_probe(probe)
+            raise
+        return probe
+
+    def _record_outcome(self, error=None):
+        """Only transient provider failures count towards opening the circuit"""
+        if error is not None and self.retry_policy.classify(error):
+            self.circuit_breaker.record_failure()
+        elif not isinstance(error, (RequestCancelled, CircuitOpenError)):
+            self.circuit_breaker.record_success()
+
+    def _prompt_prefix(self, prepared):
+        """The prompt_cache.CachedPrefix to send the prompt with, or None without prefix caching"""
+        if self.prompt_cache is None or not prepared.prefix:
+            return None
+        return self.prompt_cache.prefix_for(self.provider, prepared.prefix, prepared.prefix_tokens)
+
+    def _cache_rejected(self, prefix, handle, error):
+        """Forget a provider cache that a request referring to it failed with for good.
+
+        Returns True when the request should be sent again, then with the whole prompt.
+        """
+        if handle is None or self.retry_policy.classify(error):
+            return False
+        if LOGGING_ENABLED:
+            logger.warning("%s request using a prompt cache failed (%s), sending the whole prompt", self.service, error)
+        self.prompt_cache.invalidate(prefix)
+        return True
+
+    def prompt_cache_stats(self):
+        return self.prompt_cache.stats() if self.prompt_cache is not None else {}
+
+    def _call_provider(self, prompt_input, file_content, cancel_event, edit_mode, usage, span):
+        prepared = self._prepare_prompt(prompt_input, file_content, edit_mode, usage)
+        plan = prepared.plan
+        span.mark_prompt_built(prepared.prompt)
+
+        def attempt():
+            # Providers count the requested output limit against tokens-per-minute too
+            probe = self._before_attempt(cancel_event, plan.input_tokens + plan.max_output_tokens)
+            try:
+                span.mark_attempt()
+                prefix = self._prompt_prefix(prepared)
+                handle = prefix.handle if prefix is not None else None
+                try:
+                    try:
+                        result = self.provider.generate(prepared.prompt, usage, plan.max_output_tokens, prefix)
+                    except Exception as e:
+                        if not self._cache_rejected(prefix, handle, e):
+                            raise
+                        result = self.provider.generate(prepared.prompt, usage, plan.max_output_tokens, prefix)
+                except Exception as e:
+                    if LOGGING_ENABLED:
+                        logger.error("Error processing with %s: %s", self.display_name, e)
+                    self._record_outcome(e)
+                    raise
+                self._record_outcome()
+            finally:
+                self.circuit_breaker.end_probe(probe)
+            if prefix is not None:
+                self.prompt_cache.record(prefix, usage)
+            return prepared.restore(result)
+
+        return self.retry_policy.call(attempt, cancel_event=cancel_event)
+
+    def start_span(self, kind="request", queued_at=None):
+        """New metrics span for a request to this processor's service"""
+        return self.metrics.start_span(self.service, kind, queued_at)
+
+    def _log_span(self, span):
+        if LOGGING_ENABLED:
+            ttft = f", first token {span.time_to_first_token:.2f}s" if span.first_token_at is not None else ""
+            logger.info(
+                "Processed %s with %s in %.2fs%s (queued %.2fs, retries %s, tokens %s in (%s from prompt cache) / %s out, "
+                "cached %s)",
+                span.kind, self.display_name, span.total, ttft, span.queue_wait, span.retries,
+                span.input_tokens, span.cached_input_tokens or 0, span.output_tokens, span.cached
+            )
+
+    def stream_text(self, prompt_input, file_content, cancel_event=None, use_cache=True, usage=None, span=None):
+        """Yield the modified code in chunks as the provider streams it back.
+
+        Failures before the first chunk are retried like process_text; once output
+        has started a failure is raised, since the partial text cannot be replayed.
+        A cached response is yielded as a single chunk. If given, the usage dict is
+        filled with input_tokens/output_tokens as reported by the provider.
+        """
+        span = span or self.start_span("stream")
+        span.start()
+        usage = usage if usage is not None else {}
+        chunks = []
+        try:
+            for text in self._stream_text(prompt_input, file_content, cancel_event, use_cache, usage, span):
+                span.mark_first_token()
+                chunks.append(text)
+                yield text
+        except BaseException as e:
+            span.finish("".join(chunks), usage, error=e)
+            raise
+        span.finish("".join(chunks), usage)
+        self._log_span(span)
+
+    def _stream_text(self, prompt_input, file_content, cancel_event, use_cache, usage, span):
+        self._check_cancelled(cancel_event)
+        cache_key = self._cache_key(prompt_input, file_content, use_cache)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            usage["cached"] = True
+            yield cached
+            return
+
+        prepared = self._prepare_prompt(prompt_input, file_content, usage=usage)
+        plan = prepared.plan
+        span.mark_prompt_built(prepared.prompt)
+        attempt = 0
+        while True:
+            probe = self._before_attempt(cancel_event, plan.input_tokens + plan.max_output_tokens)
+            # Cancellation, a consumer closing the generator or any other exit without an
+            # outcome must not leave the circuit half-open
+            try:
+                span.mark_attempt()
+                chunks = []
+                prefix = self._prompt_prefix(prepared)
+                handle = prefix.handle if prefix is not None else None
+                stream = self.provider.stream(prepared.prompt, usage, plan.max_output_tokens, prefix)
+                try:
+                    for text in prepared.restore_stream(stream):
+                        self._check_cancelled(cancel_event)
+                        chunks.append(text)
+                        yield text
+                except RequestCancelled:
+                    raise
+                except Exception as e:
+                    if not chunks and self._cache_rejected(prefix, handle, e):
+                        # Says nothing about the provider's health; sent again with the whole prompt as a retry
+                        attempt += 1
+                        continue
+                    error_msg = f"Error streaming from {self.service}: {str(e)}"
+                    if LOGGING_ENABLED:
+                        logger.error(error_msg)
+                    self._record_outcome(e)
+                    if chunks or not self.retry_policy.should_retry(e, attempt):
+                        raise Exception(error_msg) from e
+                    self.retry_policy.wait(attempt, e, cancel_event)
+                    attempt += 1
+                    continue
+                finally:
+                    stream.close()
+
+                self._record_outcome()
+            finally:
+                self.circuit_breaker.end_probe(probe)
+            if prefix is not None:
+                self.prompt_cache.record(prefix, usage)
+            if cache_key is not None:
+                self.cache.put(cache_key, "".join(chunks))
+            return
+
+    def _cache_key(self, prompt_input, file_content, use_cache, edit_mode=EDIT_MODE_FULL):
+        """Return the cache key for this request, or None when it must not be cached"""
+        if not use_cache or self.cache is None:
+            return None
+        if self.provider is None:
+            self.provider = create_provider(self.service)
+        config = self.provider.cache_config()
+        sampling = config.get("generation", config)
+        if not self.cache.is_cacheable(sampling):
+            self.cache.note_bypass()
+            return None
+        extra = {"edit_mode": edit_mode} if edit_mode != EDIT_MODE_FULL else None
+        return make_cache_key(self.service, config, prompt_input, file_content, extra)
+
+    def _cache_get(self, key):
+        if key is None:
+            return None
+        cached = self.cache.get(key)
+        if cached is not None and LOGGING_ENABLED:
+            logger.info("Response cache hit for %s request (%s)", self.service, self.cache.stats())
+        return cached
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else {}
+
+    def _check_cancelled(self, cancel_event):
+        if cancel_event is not None and cancel_event.is_set():
             if LOGGING_ENABLED:
-                logger.error(error_msg)
-            
-            if self.retries < MAX_RETRIES:
-                self.retries += 1
-                if LOGGING_ENABLED:
-                    logger.info(f"Retrying request ({self.retries}/{MAX_RETRIES})")
-                return self._process_with_gemini(prompt_input, file_content)
-            else:
-                raise Exception(error_msg)
-
-    def _process_with_openai(self, prompt_input, file_content):
+                logger.info("Request to %s cancelled", self.service)
+            raise RequestCancelled(f"Request to {self.service} was cancelled")
+
+    def process_text(self, prompt_input, file_content, cancel_event=None, use_cache=True, edit_mode=EDIT_MODE_FULL,
+                     usage=None, span=None):
+        """Process the code; cancel_event (a threading.Event) aborts pending attempts.
+
+        Pass use_cache=False to always send the request to the provider. With
+        edit_mode=EDIT_MODE_DIFF the raw SEARCH/REPLACE response is returned.
+        Timings are recorded on span (a metrics.RequestSpan), or on a new one.
+        """
+        span = span or self.start_span()
+        span.start()
+        usage = usage if usage is not None else {}
+        with request_context():
+            try:
+                result = self._process_text(prompt_input, file_content, cancel_event, use_cache, edit_mode, usage, span)
+            except BaseException as e:
+                span.finish(usage=usage, error=e)
+                raise
+            span.finish(result, usage)
+            self._log_span(span)
+        return result
+
+    def _process_text(self, prompt_input, file_content, cancel_event, use_cache, edit_mode, usage, span):
+        self._check_cancelled(cancel_event)
+        cache_key = self._cache_key(prompt_input, file_content, use_cache, edit_mode)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            usage["cached"] = True
+            return cached
+
         try:
-            prompt = f"""
-            Update the following code: {file_content} 
-            according to the following suggestions: {prompt_input} 
-            and return the code (as text, not as markdown block)
-            """
-            
-            response = self.client.chat.completions.create(
-                model=OPENAI_CONFIG["model"],
-                messages=[
-                    {"role": "system", "content": "You are a helpful code assistant. Provide code updates as plain text without markdown formatting."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=OPENAI_CONFIG["temperature"],
-                max_tokens=OPENAI_CONFIG["max_tokens"],
-                top_p=OPENAI_CONFIG["top_p"],
-                frequency_penalty=OPENAI_CONFIG["frequency_penalty"],
-                presence_penalty=OPENAI_CONFIG["presence_penalty"]
+            result = self._call_provider(prompt_input, file_content, cancel_event, edit_mode, usage, span)
+        except (RequestCancelled, CircuitOpenError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error processing with {self.display_name}: {str(e)}") from e
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        return result
+
+    def process_text_chunked(self, prompt_input, file_content, filename=None, cancel_event=None, use_cache=True,
+                             progress=None, span=None):
+        """Like process_text, but large files are split at function/class boundaries
+        and the pieces are processed concurrently, then stitched back in order.
+        """
+        if not needs_chunking(file_content):
+            return self.process_text(prompt_input, file_content, cancel_event=cancel_event, use_cache=use_cache, span=span)
+
+        # Each chunk is its own span; queue wait counts from when the whole request was queued
+        queued_at = span.queued_at if span is not None else None
+
+        def process_chunk(chunk_prompt, chunk_content):
+            return self.process_text(
+                chunk_prompt, chunk_content, cancel_event=cancel_event, use_cache=use_cache,
+                span=self.start_span("chunk", queued_at)
+            )
+
+        # One request id for all chunks
+        with request_context():
+            return process_in_chunks(process_chunk, prompt_input, file_content, filename=filename, progress=progress)
+
+    def block_scope(self, prompt_input):
+        """BlockCache scope for answers this processor gives to prompt_input"""
+        if self.provider is None:
+            self.provider = create_provider(self.service)
+        return block_cache_scope(self.service, self.provider.cache_config(), prompt_input)
+
+    def incremental_plan(self, block_cache, prompt_input, file_content):
+        """The IncrementalPlan for rerunning prompt_input on edited code, or None to send it whole"""
+        return block_cache.plan(self.block_scope(prompt_input), file_content)
+
+    def remember_blocks(self, block_cache, prompt_input, file_content, output_text):
+        """Keep the blocks of an accepted answer so a rerun on edited code can reuse them"""
+        return block_cache.record(self.block_scope(prompt_input), file_content, output_text)
+
+    def process_text_incremental(self, prompt_input, file_content, plan, filename=None, cancel_event=None,
+                                 use_cache=True, progress=None, span=None):
+        """Send only the regions of plan that changed and merge them with the remembered blocks.
+
+        Large regions are chunked like any other request.
+        """
+        queued_at = span.queued_at if span is not None else None
+
+        def process_region(region_prompt, region_content):
+            self._check_cancelled(cancel_event)
+            if needs_chunking(region_content):
+                return self.process_text_chunked(
+                    region_prompt, region_content, filename=filename, cancel_event=cancel_event, use_cache=use_cache
+                )
+            return self.process_text(
+                region_prompt, region_content, cancel_event=cancel_event, use_cache=use_cache,
+                span=self.start_span("region", queued_at)
             )
-            
+
+        # One request id for all regions
+        with request_context():
+            return process_regions(process_region, prompt_input, plan, progress=progress)
+
+    def process_text_diff(self, prompt_input, file_content, cancel_event=None, use_cache=True, span=None):
+        """Ask the model for patches instead of the whole file and apply them locally.
+
+        Falls back to a full-file request when the patch does not apply.
+        """
+        response = self.process_text(
+            prompt_input, file_content, cancel_event=cancel_event, use_cache=use_cache, edit_mode=EDIT_MODE_DIFF,
+            span=span
+        )
+        try:
+            result = apply_patch(file_content, response)
             if LOGGING_ENABLED:
-                logger.info("Successfully processed request with OpenAI")
-                
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            error_msg = f"Error processing with OpenAI: {str(e)}"
+                logger.info(
+                    "Applied %s patch (%s chars for a %s char file)",
+                    self.service, len(response), len(file_content)
+                )
+            return result
+        except PatchError as e:
             if LOGGING_ENABLED:
-                logger.error(error_msg)
-            
-            if self.retries < MAX_RETRIES:
-                self.retries += 1
-                if LOGGING_ENABLED:
-                    logger.info(f"Retrying request ({self.retries}/{MAX_RETRIES})")
-                return self._process_with_openai(prompt_input, file_content)
-            else:
-                raise Exception(error_msg)
-
-    def process_text(self, prompt_input, file_content):
-        self.retries = 0  # Reset retry counter
-        if self.service == "gemini":
-            return self._process_with_gemini(prompt_input, file_content)
-        else:
-            return self._process_with_openai(prompt_input, file_content)
+                logger.warning("Patch from %s did not apply (%s), requesting the full file", self.service, e)
+            return self.process_text(prompt_input, file_content, cancel_event=cancel_event, use_cache=use_cache)
+
+    async def aprocess_text(self, prompt_input, file_content, cancel_event=None, use_cache=True, usage=None):
+        """Async variant of process_text; the blocking work runs on a thread"""
+        return await asyncio.to_thread(
+            self.process_text, prompt_input, file_content, cancel_event=cancel_event, use_cache=use_cache, usage=usage
+        )
+
+    async def astream_text(self, prompt_input, file_content, cancel_event=None, use_cache=True, usage=None):
+        """Async iterator over stream_text chunks"""
+        async for text in iterate_in_thread(
+            lambda: self.stream_text(prompt_input, file_content, cancel_event=cancel_event, use_cache=use_cache, usage=usage)
+        ):
+            yield text
+
+
+class ProviderResult:
+    """Outcome of one provider's attempt in a multi-provider dispatch"""
+
+    def __init__(self, service, text=None, error=None, latency=0.0, usage=None):
+        self.service = service
+        self.text = text
+        self.error = error
+        self.latency = latency
+        self.usage = usage or {}
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def input_tokens(self):
+        return self.usage.get("input_tokens")
+
+    @property
+    def output_tokens(self):
+        return self.usage.get("output_tokens")
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"ProviderResult({self.service}, {status}, {self.latency:.2f}s)"
+
+
+class MultiProviderDispatcher:
+    """Send the same request to several providers concurrently.
+
+    race() returns the first successful response and cancels the rest (hedging);
+    compare() waits for every provider and returns all results.
+    """
+
+    def __init__(self, services=("gemini", "openai"), processors=None):
+        processors = processors or {}
+        self.services = list(services)
+        self.processors = {
+            service: processors.get(service) or AIServiceProcessor(service=service, lazy=True)
+            for service in self.services
+        }
+        self._executor = ThreadPoolExecutor(max_workers=len(self.services) * 2, thread_name_prefix="dispatch")
+        # Cancel events of the requests in flight, so shutdown() can stop them
+        self._events = set()
+        self._events_lock = threading.Lock()
+
+    def _run_one(self, service, prompt_input, file_content, cancel_event, use_cache, results):
+        usage = {}
+        started = time.perf_counter()
+        try:
+            # Streaming lets a cancelled loser stop between chunks instead of running to completion
+            text = "".join(self.processors[service].stream_text(
+                prompt_input, file_content, cancel_event=cancel_event, use_cache=use_cache, usage=usage
+            ))
+            result = ProviderResult(service, text=text, latency=time.perf_counter() - started, usage=usage)
+        except Exception as e:
+            result = ProviderResult(service, error=str(e), latency=time.perf_counter() - started, usage=usage)
+        results.put(result)
+
+    def _dispatch(self, prompt_input, file_content, use_cache):
+        results = queue.Queue()
+        events = {service: threading.Event() for service in self.services}
+        with self._events_lock:
+            self._events.update(events.values())
+        for service in self.services:
+            # Each provider's thread logs under the caller's request id
+            self._executor.submit(
+                contextvars.copy_context().run,
+                self._run_one, service, prompt_input, file_content, events[service], use_cache, results
+            )
+        return results, events
+
+    def _finish(self, events):
+        for event in events.values():
+            event.set()
+        with self._events_lock:
+            self._events.difference_update(events.values())
+
+    def shutdown(self):
+        """Cancel the requests in flight and stop the threads; the dispatcher cannot be used afterwards"""
+        with self._events_lock:
+            events, self._events = self._events, set()
+        for event in events:
+            event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def race(self, prompt_input, file_content, cancel_event=None, use_cache=True):
+        """Return the first successful ProviderResult, cancelling the slower providers"""
+        results, events = self._dispatch(prompt_input, file_content, use_cache)
+        errors = []
+        try:
+            while len(errors) < len(self.services):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RequestCancelled("Race was cancelled")
+                try:
+                    result = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if result.ok:
+                    if LOGGING_ENABLED:
+                        logger.info("%s won the race in %.2fs", result.service, result.latency)
+                    return result
+                errors.append(result)
+        finally:
+            self._finish(events)
+        raise Exception("All providers failed: " + "; ".join(f"{r.service}: {r.error}" for r in errors))
+
+    def compare(self, prompt_input, file_content, cancel_event=None, use_cache=True):
+        """Return a ProviderResult for every provider, in the configured order"""
+        results, events = self._dispatch(prompt_input, file_content, use_cache)
+        collected = {}
+        try:
+            while len(collected) < len(self.services):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RequestCancelled("Comparison was cancelled")
+                try:
+                    result = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                collected[result.service] = result
+        finally:
+            self._finish(events)
+        return [collected[service] for service in self.services]
 
 def create_output_directories():
     """Create necessary directories for logs and output"""
@@ -146,6 +625,7 @@ def create_output_directories():
 if __name__ == "__main__":
     # Create necessary directories
     create_output_directories()
+    configure_logging()
     
     # Example usage with error handling
     try:
@@ -168,4 +648,4 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         if LOGGING_ENABLED:
-            logger.error(f"Error in main execution: {str(e)}")
\ No newline at end of file
+            logger.error("Error in main execution: %s", e)
\ No newline at end of file
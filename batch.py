@@ -0,0 +1,408 @@
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from ai_service import AIServiceProcessor, create_output_directories
+from client_registry import clear_clients
+from config import LOGGING_ENABLED, OUTPUT_DIR
+from file_io import read_text, write_text_atomic
+from job_queue import DONE, JobQueue, JobRunner, new_batch_id
+from logging_setup import configure_logging
+from metrics import get_default_metrics, percentile
+from project_index import attach_context, get_project_index
+from providers import available_providers
+from response_cache import hold_cache_writes
+from validation import VALIDATION_ENABLED, VALIDATION_TEST_COMMAND, Validator, validated
+
+DEFAULT_INCLUDE = ["*.py"]
+DEFAULT_EXCLUDE = [".git", "__pycache__", ".venv", "venv", "node_modules", "*.egg-info"]
+DEFAULT_CONCURRENCY = 4
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+def _matches(rel_path, patterns):
+    name = os.path.basename(rel_path)
+    return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def find_files(root, include=None, exclude=None):
+    """Walk root and return relative paths matching include but not exclude, sorted"""
+    include = include or DEFAULT_INCLUDE
+    exclude = DEFAULT_EXCLUDE + (exclude or [])
+    matches = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        rel_dir = "" if rel_dir == "." else rel_dir.replace(os.sep, "/")
+        # Prune excluded directories so their contents are never walked
+        dirnames[:] = [
+            d for d in dirnames
+            if not _matches(f"{rel_dir}/{d}" if rel_dir else d, exclude)
+        ]
+        for filename in filenames:
+            rel_path = f"{rel_dir}/{filename}" if rel_dir else filename
+            if _matches(rel_path, include) and not _matches(rel_path, exclude):
+                matches.append(rel_path)
+    return sorted(matches)
+
+
+def process_file(processor, root, rel_path, prompt, output_root, use_cache=True, patch_mode=False, cancel_event=None,
+                 project_index=None, validator=None):
+    """Process one file and return a result record.
+
+    With a project_index, definitions the file uses are attached to the prompt.
+    With a validator, output that still fails validation after a retry is not written.
+    """
+    source_path = os.path.join(root, rel_path)
+    started = time.perf_counter()
+    record = {"path": rel_path, "ok": False, "bytes_in": 0, "bytes_out": 0}
+    try:
+        content, info = read_text(source_path)
+        record["bytes_in"] = info.size
+        if not content.strip():
+            record.update(ok=True, skipped=True)
+            return record
+        if project_index is not None:
+            prompt = attach_context(prompt, project_index.context_for(content, prompt, source_path))
+
+        def request(request_prompt, request_content):
+            if patch_mode:
+                return processor.process_text_diff(
+                    request_prompt, request_content, cancel_event=cancel_event, use_cache=use_cache
+                )
+            return processor.process_text_chunked(
+                request_prompt, request_content, filename=rel_path, cancel_event=cancel_event, use_cache=use_cache
+            )
+
+        # Answers only go into the response cache once they pass validation
+        with hold_cache_writes() as held:
+            output = request(prompt, content)
+            if validator is not None:
+                output, report = validated(request, prompt, content, output, validator, source_path)
+                record["validation"] = report.summary()
+                if not report.ok:
+                    raise Exception(f"output {report.summary()}")
+            held.commit()
+        target_path = source_path if output_root is None else os.path.join(output_root, rel_path)
+        # Keep the source file's encoding and line endings
+        write_text_atomic(target_path, output, encoding=info.encoding, newline=info.newline)
+        record.update(ok=True, bytes_out=os.path.getsize(target_path), output=target_path)
+    except Exception as e:
+        record["error"] = str(e)
+        if LOGGING_ENABLED:
+            logger.error("Batch processing failed for %s: %s", rel_path, e)
+    finally:
+        record["latency"] = time.perf_counter() - started
+    return record
+
+
+def run_batch(root, prompt, service="gemini", include=None, exclude=None, concurrency=DEFAULT_CONCURRENCY,
+              in_place=False, output_dir=None, use_cache=True, progress=None, patch_mode=False, job_queue=None,
+              batch_id=None, priority=0, project_context=False, validate=VALIDATION_ENABLED,
+              test_command=VALIDATION_TEST_COMMAND):
+    """Process every matching file with a bounded worker pool and return a summary dict.
+
+    With a job_queue every file is recorded as a job of batch_id (a new one by
+    default), so an interrupted run can be finished with resume_batch(). With
+    project_context, root is indexed and each prompt gets the definitions its
+    file uses from other files. With validate, every answer is checked (and
+    test_command run against it) before it is written.
+    """
+    files = find_files(root, include, exclude)
+    if in_place:
+        output_root = None
+    else:
+        output_root = output_dir or os.path.join(OUTPUT_DIR, f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    if job_queue is not None:
+        batch_id = batch_id or new_batch_id()
+        for rel_path in files:
+            job_queue.submit(
+                service,
+                {
+                    "root": os.path.abspath(root),
+                    "path": rel_path,
+                    "prompt": prompt,
+                    "output_root": output_root and os.path.abspath(output_root),
+                    "use_cache": use_cache,
+                    "patch_mode": patch_mode,
+                    "project_context": project_context,
+                    "validate": validate,
+                    "test_command": test_command,
+                },
+                kind="file",
+                priority=priority,
+                batch_id=batch_id
+            )
+        return resume_batch(job_queue, batch_id, concurrency, progress)
+
+    processor = AIServiceProcessor(service=service)
+    project_index = open_project_index(root) if project_context else None
+    validator = Validator(test_command=test_command, project_root=root) if validate else None
+    if LOGGING_ENABLED:
+        logger.info("Batch run over %s file(s) in %s with %s, concurrency %s", len(files), root, service, concurrency)
+
+    results = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [
+            executor.submit(
+                process_file, processor, root, rel_path, prompt, output_root, use_cache, patch_mode, None, project_index,
+                validator
+            )
+            for rel_path in files
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            results.append(record)
+            if progress:
+                progress(len(results), len(files), record)
+    elapsed = time.perf_counter() - started
+    return summarize(root, service, output_root, results, elapsed, processor)
+
+
+def open_project_index(root):
+    """The shared index of root, brought up to date before any file is processed"""
+    project_index = get_project_index(root)
+    project_index.update()
+    return project_index
+
+
+def _job_record(job):
+    """Result record of a finished file job"""
+    if job.state == DONE:
+        return json.loads(job.result)
+    try:
+        bytes_in = os.path.getsize(os.path.join(job.payload["root"], job.payload["path"]))
+    except OSError:
+        bytes_in = 0
+    return {
+        "path": job.payload["path"],
+        "ok": False,
+        "bytes_in": bytes_in,
+        "bytes_out": 0,
+        "error": job.error or job.state,
+        "latency": job.latency,
+    }
+
+
+def resume_batch(job_queue, batch_id, concurrency=DEFAULT_CONCURRENCY, progress=None):
+    """Run the unfinished (including failed) jobs of a batch and summarise the whole batch.
+
+    Files finished in earlier runs are not sent again.
+    """
+    job_queue.recover()
+    job_queue.retry_failed(batch_id)
+    jobs = job_queue.jobs(batch_id=batch_id)
+    if not jobs:
+        raise ValueError(f"No jobs in batch {batch_id}")
+    payload = jobs[0].payload
+    service = jobs[0].service
+    processor = AIServiceProcessor(service=service)
+    project_index = open_project_index(payload["root"]) if payload.get("project_context") else None
+    validator = Validator(test_command=payload.get("test_command"), project_root=payload["root"]) \
+        if payload.get("validate") else None
+    finished = sum(1 for job in jobs if job.finished_state)
+    lock = threading.Lock()
+    if LOGGING_ENABLED:
+        logger.info(
+            "Batch %s: %s of %s file(s) to process with %s, concurrency %s",
+            batch_id, len(jobs) - finished, len(jobs), service, concurrency
+        )
+
+    def handle(job, cancel_event):
+        record = process_file(
+            processor,
+            job.payload["root"],
+            job.payload["path"],
+            job.payload["prompt"],
+            job.payload["output_root"],
+            job.payload["use_cache"],
+            job.payload["patch_mode"],
+            cancel_event,
+            project_index,
+            validator
+        )
+        if not record["ok"]:
+            raise Exception(record["error"])
+        return json.dumps(record)
+
+    def report(job):
+        nonlocal finished
+        with lock:
+            finished += 1
+            if progress:
+                progress(finished, len(jobs), _job_record(job))
+
+    started = time.perf_counter()
+    JobRunner(job_queue, handle, batch_id, concurrency={service: concurrency}, on_finished=report).run()
+    elapsed = time.perf_counter() - started
+
+    results = [_job_record(job) for job in job_queue.jobs(batch_id=batch_id) if job.finished_state]
+    summary = summarize(payload["root"], service, payload["output_root"], results, elapsed, processor)
+    summary["batch_id"] = batch_id
+    return summary
+
+
+def summarize(root, service, output_root, results, elapsed, processor):
+    """Summary dict over the per-file result records"""
+    results.sort(key=lambda record: record["path"])
+    latencies = [record["latency"] for record in results if record["ok"] and not record.get("skipped")]
+    failures = [record for record in results if not record["ok"]]
+    return {
+        "root": root,
+        "service": service,
+        "output_root": output_root or root,
+        "files": len(results),
+        "succeeded": len(results) - len(failures),
+        "failed": len(failures),
+        "skipped": sum(1 for record in results if record.get("skipped")),
+        "elapsed": elapsed,
+        "files_per_second": len(results) / elapsed if elapsed else 0.0,
+        "bytes_in": sum(record["bytes_in"] for record in results),
+        "bytes_out": sum(record["bytes_out"] for record in results),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies) if latencies else 0.0,
+        "cache": processor.cache_stats(),
+        "provider": processor.metrics.summary().get(processor.service, {}),
+        "results": results,
+    }
+
+
+def format_summary(summary):
+    lines = [
+        f"Processed {summary['files']} file(s) from {summary['root']} with {summary['service']} "
+        f"in {summary['elapsed']:.2f}s ({summary['files_per_second']:.2f} files/s)",
+        f"  succeeded: {summary['succeeded']}  failed: {summary['failed']}  skipped: {summary['skipped']}",
+        f"  latency p50: {summary['latency_p50']:.2f}s  p95: {summary['latency_p95']:.2f}s  max: {summary['latency_max']:.2f}s",
+        f"  bytes in: {summary['bytes_in']}  bytes out: {summary['bytes_out']}",
+        f"  output: {summary['output_root']}",
+    ]
+    if summary.get("batch_id"):
+        lines.append(f"  batch: {summary['batch_id']} (re-run unfinished or failed files with --resume)")
+    provider = summary.get("provider")
+    if provider:
+        lines.insert(3, (
+            f"  provider requests: {provider['requests']}  retries: {provider['retries']}  "
+            f"tokens: {provider['input_tokens']} in / {provider['output_tokens']} out  "
+            f"tokens/s p50: {provider['tokens_per_second']:.1f}"
+        ))
+    for record in summary["results"]:
+        if not record["ok"]:
+            lines.append(f"  FAILED {record['path']}: {record['error']}")
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Apply a modification prompt to every matching file under a directory")
+    parser.add_argument("root", nargs="?", help="Directory to process")
+    parser.add_argument("prompt", nargs="?", help="Modification prompt (or use --prompt-file)")
+    parser.add_argument("--prompt-file", help="Read the prompt from a file")
+    parser.add_argument("--service", choices=available_providers(), default="gemini")
+    parser.add_argument("--include", action="append", help="Glob of files to process (repeatable, default *.py)")
+    parser.add_argument("--exclude", action="append", help="Glob of files or directories to skip (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Number of concurrent requests")
+    destination = parser.add_mutually_exclusive_group()
+    destination.add_argument("--in-place", action="store_true", help="Overwrite the source files")
+    destination.add_argument("--output-dir", help="Directory for results (default: a new folder in OUTPUT_DIR)")
+    parser.add_argument("--patch", action="store_true", help="Ask for SEARCH/REPLACE edits instead of whole files")
+    parser.add_argument("--no-cache", action="store_true", help="Always send requests to the provider")
+    parser.add_argument(
+        "--project-context", action="store_true",
+        help="Index the root and attach definitions each file uses from other files"
+    )
+    parser.add_argument(
+        "--validate", action=argparse.BooleanOptionalAction, default=VALIDATION_ENABLED,
+        help="Check answers before writing them (default from VALIDATION_ENABLED)"
+    )
+    parser.add_argument(
+        "--test-command", default=VALIDATION_TEST_COMMAND,
+        help="Run this in a copy of the root with each answer in place, e.g. \"python -m pytest -x -q\""
+    )
+    parser.add_argument("--summary-json", help="Also write the summary as JSON to this path")
+    parser.add_argument("--metrics-file", help="Write request metrics here (Prometheus text for .prom, else JSON)")
+    parser.add_argument("--quiet", action="store_true", help="Only print the final summary")
+    parser.add_argument("--resume", metavar="BATCH_ID", help="Finish an interrupted batch (root and prompt are not needed)")
+    parser.add_argument("--priority", type=int, default=0, help="Queue priority of this batch's jobs (higher runs first)")
+    parser.add_argument("--no-queue", action="store_true", help="Do not record jobs in the persistent queue")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.resume and args.no_queue:
+        print("--resume needs the job queue", file=sys.stderr)
+        return 2
+
+    configure_logging()
+
+    def report(done, total, record):
+        if not args.quiet:
+            status = "ok" if record["ok"] else "FAILED"
+            print(f"[{done}/{total}] {record['path']} {status} ({record['latency']:.2f}s)", flush=True)
+
+    job_queue = None if args.no_queue else JobQueue()
+    if args.resume:
+        create_output_directories()
+        try:
+            summary = resume_batch(job_queue, args.resume, args.concurrency, progress=report)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        return finish_run(args, summary)
+
+    if args.prompt_file:
+        with open(args.prompt_file, "r", encoding="utf-8") as file:
+            prompt = file.read().strip()
+    else:
+        prompt = (args.prompt or "").strip()
+    if not prompt:
+        print("A prompt is required (positional argument or --prompt-file)", file=sys.stderr)
+        return 2
+    if not args.root or not os.path.isdir(args.root):
+        print(f"Not a directory: {args.root}", file=sys.stderr)
+        return 2
+
+    create_output_directories()
+    summary = run_batch(
+        args.root,
+        prompt,
+        service=args.service,
+        include=args.include,
+        exclude=args.exclude,
+        concurrency=args.concurrency,
+        in_place=args.in_place,
+        output_dir=args.output_dir,
+        use_cache=not args.no_cache,
+        progress=report,
+        patch_mode=args.patch,
+        job_queue=job_queue,
+        priority=args.priority,
+        project_context=args.project_context,
+        validate=args.validate,
+        test_command=args.test_command
+    )
+    return finish_run(args, summary)
+
+
+def finish_run(args, summary):
+    """Print and write out the summary and close the shared clients; returns the exit status"""
+    clear_clients()
+    print(format_summary(summary))
+    if args.summary_json:
+        write_text_atomic(args.summary_json, json.dumps(summary, indent=2))
+    if args.metrics_file:
+        get_default_metrics().write(args.metrics_file)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LINES = 100000
+DEFAULT_SCROLL_STEPS = 200
+WIDGETS = ("code_editor", "qtextedit")
+# A metric that gets this much slower than the baseline counts as a regression
+REGRESSION_THRESHOLD = 0.20
+
+# Runs once per widget in a fresh offscreen interpreter (so max_rss is per widget); prints one JSON object
+EDITOR_SNIPPET = """
+import json, resource, sys, time
+from PyQt6.QtWidgets import QApplication, QTextEdit
+sys.path.insert(0, "benchmarks")
+from code_editor import CodeEditor
+from pipeline import synthetic_source
+
+widget_kind, line_count, scroll_steps = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+text = "\\n".join(synthetic_source(str(line_count * 60)).splitlines()[:line_count])
+app = QApplication(sys.argv[:1])
+
+
+def create():
+    widget = CodeEditor() if widget_kind == "code_editor" else QTextEdit()
+    widget.resize(1000, 700)
+    widget.show()
+    app.processEvents()
+    return widget
+
+
+def timed(action):
+    started = time.perf_counter()
+    action()
+    app.processEvents()
+    return time.perf_counter() - started
+
+
+source = create()
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+load = timed(lambda: source.setPlainText(text))
+first_paint = timed(source.viewport().repaint)
+
+bar = source.verticalScrollBar()
+steps = []
+for step in range(1, scroll_steps + 1):
+    value = bar.maximum() * step // scroll_steps
+    steps.append(timed(lambda: (bar.setValue(value), source.viewport().repaint())))
+
+target = create()
+if widget_kind == "code_editor":
+    copy = timed(lambda: target.copy_from(source))
+else:
+    copy = timed(lambda: target.setPlainText(source.toPlainText()))
+if target.document().blockCount() != source.document().blockCount():
+    raise SystemExit("copy lost lines")
+
+print(json.dumps({
+    "lines": line_count,
+    "load": load,
+    "first_paint": first_paint,
+    "scroll_total": sum(steps),
+    "scroll_max_step": max(steps),
+    "copy": copy,
+    "rss_growth": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024,
+}))
+"""
+
+
+def run_widget(widget, lines, scroll_steps):
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    completed = subprocess.run(
+        [sys.executable, "-c", EDITOR_SNIPPET, widget, str(lines), str(scroll_steps)],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=1800
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip() or f"exit status {completed.returncode}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Return a list of human-readable regressions against a baseline result"""
+    regressions = []
+    for widget, values in results.items():
+        for key, value in values.items():
+            old = baseline.get(widget, {}).get(key)
+            if key == "lines" or not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old <= 0:
+                continue
+            if value > old * (1 + threshold):
+                regressions.append(f"{widget}.{key}: {old:.4g} -> {value:.4g} (+{(value / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure load, scroll and copy time of the code panes on a large file")
+    parser.add_argument("--lines", type=int, default=DEFAULT_LINES)
+    parser.add_argument("--scroll-steps", type=int, default=DEFAULT_SCROLL_STEPS)
+    parser.add_argument("--widgets", default=",".join(WIDGETS), help="code_editor and/or qtextedit (the old widget)")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous --output file and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for widget in [name.strip() for name in args.widgets.split(",") if name.strip()]:
+        results[widget] = run_widget(widget, args.lines, args.scroll_steps)
+        values = results[widget]
+        print(
+            f"{widget:>12}: load {values['load'] * 1000:8.1f} ms  first paint {values['first_paint'] * 1000:7.1f} ms  "
+            f"scroll {values['scroll_total'] * 1000:8.1f} ms (max step {values['scroll_max_step'] * 1000:6.1f} ms)  "
+            f"copy {values['copy'] * 1000:8.1f} ms  rss +{values['rss_growth'] / (1024 * 1024):.0f} MB"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from metrics import percentile
+
+DEFAULT_SIZES = ["1KB", "10KB", "100KB", "1MB", "5MB"]
+DEFAULT_RUNS = 5
+BENCHMARK_PROMPT = "Add a docstring to every function"
+# A metric that gets this much worse than the baseline counts as a regression
+REGRESSION_THRESHOLD = 0.20
+# Lower-is-better metrics compared against the baseline
+COMPARED_METRICS = ("latency_p50", "latency_p95", "peak_memory", "set_text", "max_stall")
+UNITS = {"KB": 1024, "MB": 1024 * 1024}
+
+# Runs in a fresh interpreter with an offscreen Qt platform; prints one JSON object.
+# A heartbeat timer measures how long the event loop is blocked by the update.
+GUI_SNIPPET = """
+import json, resource, statistics, sys, time
+from PyQt6.QtCore import QEventLoop, QTimer
+from PyQt6.QtWidgets import QApplication
+import main
+
+HEARTBEAT_MS = 5
+sizes = json.loads(sys.argv[1])
+runs = int(sys.argv[2])
+sys.path.insert(0, "benchmarks")
+from pipeline import synthetic_source
+
+app = QApplication(sys.argv[:1])
+window = main.AIGUI(headless=True)
+window.show()
+box = window.output_textbox
+
+
+def measure(text):
+    ticks = []
+    result = {}
+    heartbeat = QTimer()
+    heartbeat.setInterval(HEARTBEAT_MS)
+    heartbeat.timeout.connect(lambda: ticks.append(time.perf_counter()))
+    loop = QEventLoop()
+
+    def update():
+        started = time.perf_counter()
+        box.setPlainText(text)
+        result["set_text"] = time.perf_counter() - started
+        # Let layout and painting of the new document happen before stopping
+        QTimer.singleShot(200, loop.quit)
+
+    heartbeat.start()
+    QTimer.singleShot(50, update)
+    loop.exec()
+    heartbeat.stop()
+    gaps = [later - earlier for earlier, later in zip(ticks, ticks[1:])]
+    result["max_stall"] = max(0.0, max(gaps, default=0.0) - HEARTBEAT_MS / 1000.0)
+    box.clear()
+    return result
+
+
+output = {}
+for label in sizes:
+    text = synthetic_source(label)
+    samples = [measure(text) for _ in range(runs)]
+    output[label] = {
+        "set_text": statistics.median(s["set_text"] for s in samples),
+        "max_stall": statistics.median(s["max_stall"] for s in samples),
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+print(json.dumps(output))
+"""
+
+
+def parse_size(label):
+    """'100KB' -> 102400"""
+    for suffix, factor in UNITS.items():
+        if label.upper().endswith(suffix):
+            return int(float(label[:-len(suffix)]) * factor)
+    return int(label)
+
+
+def synthetic_source(label):
+    """Deterministic Python source of (about) the given size"""
+    size = parse_size(label)
+    parts = []
+    total = 0
+    index = 0
+    while total < size:
+        block = (
+            f"def function_{index}(value, factor={index % 13}):\n"
+            f"    result = []\n"
+            f"    for item in range(value):\n"
+            f"        result.append(item * factor + {index})\n"
+            f"    return sum(result) % {index + 7}\n\n\n"
+        )
+        parts.append(block)
+        total += len(block)
+        index += 1
+    return "".join(parts)
+
+
+def start_fake_server(latency, tokens_per_second):
+    """Run fake_server.py in its own process so its allocations stay out of the measurements"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "fake_server.py"), "--port", "0",
+         "--latency", str(latency), "--tokens-per-second", str(tokens_per_second)],
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    line = process.stdout.readline()
+    url = next((word for word in line.split() if word.startswith("http://")), None)
+    if url is None:
+        process.kill()
+        raise RuntimeError(f"Fake model server did not start: {line.strip()}")
+    return process, url
+
+
+def bench_pipeline(sizes, runs, latency, tokens_per_second):
+    """Latency, throughput and peak Python memory of process_text per input size"""
+    from ai_service import AIServiceProcessor
+    from metrics import Metrics
+    from providers import LocalOpenAIProvider
+
+    server, url = start_fake_server(latency, tokens_per_second)
+    try:
+        processor = AIServiceProcessor(
+            service="local",
+            provider=LocalOpenAIProvider(base_url=url, timeout=600),
+            cache=False,
+            metrics=Metrics()
+        )
+        results = {}
+        for label in sizes:
+            content = synthetic_source(label)
+            # Warm-up request so connection setup is not charged to the first sample
+            processor.process_text(BENCHMARK_PROMPT, content, use_cache=False)
+            latencies = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                output = processor.process_text(BENCHMARK_PROMPT, content, use_cache=False)
+                latencies.append(time.perf_counter() - started)
+                if output != content.strip():
+                    raise RuntimeError(f"Unexpected output for {label} input ({len(output)} chars)")
+
+            # Separate run for memory; tracemalloc slows allocation-heavy code down
+            tracemalloc.start()
+            processor.process_text(BENCHMARK_PROMPT, content, use_cache=False)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            median = statistics.median(latencies)
+            results[label] = {
+                "bytes": len(content.encode("utf-8")),
+                "latency_p50": median,
+                "latency_p95": percentile(latencies, 95),
+                "latency_max": max(latencies),
+                "throughput_mb_s": len(content) / median / (1024 * 1024) if median else 0.0,
+                "peak_memory": peak,
+                "peak_memory_ratio": peak / len(content),
+            }
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_gui(sizes, runs):
+    """Time output_textbox.setPlainText and the longest event-loop stall it causes"""
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    completed = subprocess.run(
+        [sys.executable, "-c", GUI_SNIPPET, json.dumps(sizes), str(runs)],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=1800
+    )
+    if completed.returncode != 0:
+        return {"skipped": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """{'pipeline': {'1KB': {'latency_p50': x}}} -> {'pipeline.1KB.latency_p50': x}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Return a list of human-readable regressions against a baseline result"""
+    current = flatten({"pipeline": results.get("pipeline", {}), "gui": results.get("gui", {})})
+    previous = flatten({"pipeline": baseline.get("pipeline", {}), "gui": baseline.get("gui", {})})
+    regressions = []
+    for key, value in sorted(current.items()):
+        if key.rsplit(".", 1)[-1] not in COMPARED_METRICS:
+            continue
+        old = previous.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old <= 0:
+            continue
+        if value > old * (1 + threshold):
+            regressions.append(f"{key}: {old:.4g} -> {value:.4g} (+{(value / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark process_text and the output pane against a local fake provider")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES), help="Comma-separated input sizes, e.g. 1KB,1MB")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated time to first token of the fake server")
+    parser.add_argument("--tokens-per-second", type=float, default=1e9, help="Simulated generation rate")
+    parser.add_argument("--no-gui", action="store_true", help="Skip the GUI update benchmark")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous --output file and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "runs": args.runs,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+        },
+        "pipeline": bench_pipeline(sizes, args.runs, args.latency, args.tokens_per_second),
+    }
+    if not args.no_gui:
+        results["gui"] = bench_gui(sizes, args.runs)
+
+    for label, values in results["pipeline"].items():
+        print(
+            f"process_text {label:>6}: p50 {values['latency_p50'] * 1000:9.1f} ms  "
+            f"p95 {values['latency_p95'] * 1000:9.1f} ms  {values['throughput_mb_s']:7.2f} MB/s  "
+            f"peak {values['peak_memory'] / (1024 * 1024):7.1f} MB ({values['peak_memory_ratio']:.1f}x input)"
+        )
+    gui = results.get("gui", {})
+    if "skipped" in gui:
+        print(f"GUI benchmark skipped: {gui['skipped']}")
+    else:
+        for label, values in gui.items():
+            print(
+                f"setPlainText {label:>6}: {values['set_text'] * 1000:9.1f} ms  "
+                f"max stall {values['max_stall'] * 1000:9.1f} ms  rss {values['max_rss'] / (1024 * 1024):7.1f} MB"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import percentile
+from pipeline import git_revision, start_fake_server, synthetic_source
+
+DEFAULT_CLIENTS = 8
+DEFAULT_DURATION = 20.0
+DEFAULT_SIZE = "4KB"
+BENCHMARK_PROMPT = "Add a docstring to every function"
+REGRESSION_THRESHOLD = 0.20
+
+
+def start_prompt_server(fake_url, concurrency, client_concurrency):
+    """Run server.py against the fake provider in its own process; returns (process, base url)"""
+    env = dict(os.environ, PROMPTIDE_LOCAL_URL=fake_url)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "server.py"), "--port", "0", "--service", "local",
+         "--concurrency", str(concurrency), "--client-concurrency", str(client_concurrency)],
+        stdout=subprocess.PIPE,
+        env=env,
+        text=True
+    )
+    line = process.stdout.readline()
+    url = next((word for word in line.split() if word.startswith("http://")), None)
+    if url is None:
+        process.kill()
+        raise RuntimeError(f"promptIDE server did not start: {line.strip()}")
+    return process, url
+
+
+async def post_json(reader, writer, path, payload, client_id):
+    """One request over a keep-alive connection; returns (status, body)"""
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"X-Client-Id: {client_id}\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    status = int(head[0].split(" ")[1])
+    length = next(int(line.split(":", 1)[1]) for line in head if line.lower().startswith("content-length:"))
+    return status, await reader.readexactly(length)
+
+
+async def run_client(host, port, index, deadline, code, shared_code, results):
+    reader, writer = await asyncio.open_connection(host, port, limit=64 * 1024 * 1024)
+    sent = 0
+    try:
+        while time.perf_counter() < deadline:
+            sent += 1
+            # Unique code per request keeps the response cache and request sharing out of the numbers
+            source = code if shared_code else f"# client {index} request {sent}\n{code}"
+            payload = {"prompt": BENCHMARK_PROMPT, "code": source, "service": "local", "validate": False,
+                       "incremental": False}
+            started = time.perf_counter()
+            status, body = await post_json(reader, writer, "/v1/process", payload, f"load-{index}")
+            results.append((status, time.perf_counter() - started, len(body)))
+            if status == 429:
+                await asyncio.sleep(0.05)
+    finally:
+        writer.close()
+
+
+async def run_load(url, clients, duration, code, shared_code):
+    host, port = url.removeprefix("http://").split(":")
+    results = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        run_client(host, int(port), index, deadline, code, shared_code, results) for index in range(clients)
+    ))
+    return results, time.perf_counter() - started
+
+
+def fetch_stats(url):
+    from urllib.request import urlopen
+    with urlopen(f"{url}/v1/stats", timeout=10) as response:
+        return json.load(response)
+
+
+def summarise(results, elapsed):
+    ok = [latency for status, latency, _ in results if status == 200]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "statuses": statuses,
+        "seconds": elapsed,
+        "requests_per_second": len(ok) / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(ok, 50),
+        "latency_p95": percentile(ok, 95),
+        "latency_max": max(ok, default=0.0),
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Human-readable regressions: throughput lower or p95 latency higher than the baseline by threshold"""
+    regressions = []
+    old, new = baseline.get("load", {}), results.get("load", {})
+    if old.get("requests_per_second") and new["requests_per_second"] < old["requests_per_second"] * (1 - threshold):
+        regressions.append(f"requests_per_second: {old['requests_per_second']:.1f} -> {new['requests_per_second']:.1f}")
+    if old.get("latency_p95") and new["latency_p95"] > old["latency_p95"] * (1 + threshold):
+        regressions.append(f"latency_p95: {old['latency_p95']:.4g} -> {new['latency_p95']:.4g}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test server.py against a local fake provider")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS, help="Concurrent keep-alive clients")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Seconds of sustained load")
+    parser.add_argument("--size", default=DEFAULT_SIZE, help="Code size per request, e.g. 4KB")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated time to first token of the fake server")
+    parser.add_argument("--tokens-per-second", type=float, default=5000.0, help="Simulated generation rate")
+    parser.add_argument("--concurrency", type=int, default=64, help="Server --concurrency")
+    parser.add_argument("--client-concurrency", type=int, default=4, help="Server --client-concurrency")
+    parser.add_argument("--shared-code", action="store_true",
+                        help="Every client sends the same code, so requests are shared and cached")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous --output file and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    code = synthetic_source(args.size)
+    fake, fake_url = start_fake_server(args.latency, args.tokens_per_second)
+    try:
+        server, url = start_prompt_server(fake_url, args.concurrency, args.client_concurrency)
+        try:
+            results, elapsed = asyncio.run(run_load(url, args.clients, args.duration, code, args.shared_code))
+            stats = fetch_stats(url)
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "clients": args.clients,
+            "duration": args.duration,
+            "size": args.size,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "shared_code": args.shared_code,
+        },
+        "load": summarise(results, elapsed),
+        "server": {key: stats[key] for key in ("requests", "coalesced", "cancelled", "connections")},
+    }
+    load = output["load"]
+    print(
+        f"{args.clients} clients, {load['seconds']:.1f}s: {load['requests_per_second']:.1f} req/s sustained, "
+        f"p50 {load['latency_p50'] * 1000:.0f} ms, p95 {load['latency_p95'] * 1000:.0f} ms, statuses {load['statuses']}, "
+        f"{output['server']['coalesced']} shared"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(output, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(output, json.load(file), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 5
+# A metric that gets this much slower than the baseline counts as a regression
+REGRESSION_THRESHOLD = 0.20
+
+# Each snippet runs in a fresh interpreter and prints one JSON object
+IMPORT_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+heavy = [name for name in ("google.generativeai", "openai") if name in sys.modules]
+print(json.dumps({"import_main": elapsed, "eager_sdk_imports": heavy}))
+"""
+
+FIRST_PAINT_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+from PyQt6.QtCore import QEvent, QObject, QTimer
+from PyQt6.QtWidgets import QApplication
+import main
+imported = time.perf_counter()
+
+timings = {}
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and "first_paint" not in timings:
+            timings["first_paint"] = time.perf_counter() - started
+            QTimer.singleShot(0, app.quit)
+        return False
+
+app = QApplication(sys.argv)
+window = main.AIGUI(headless=True)
+constructed = time.perf_counter()
+paint_filter = FirstPaint(window)
+window.installEventFilter(paint_filter)
+window.centralWidget().installEventFilter(paint_filter)
+window.show()
+QTimer.singleShot(5000, app.quit)
+app.exec()
+print(json.dumps({
+    "import_gui": imported - started,
+    "construct_window": constructed - imported,
+    "first_paint": timings.get("first_paint"),
+}))
+"""
+
+
+def run_snippet(snippet):
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    completed = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip() or f"exit status {completed.returncode}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure(runs=DEFAULT_RUNS):
+    """Median of each startup metric over several fresh interpreters"""
+    samples = {}
+    extra = {}
+    for _ in range(runs):
+        for snippet in (IMPORT_SNIPPET, FIRST_PAINT_SNIPPET):
+            for key, value in run_snippet(snippet).items():
+                if isinstance(value, (int, float)):
+                    samples.setdefault(key, []).append(value)
+                else:
+                    extra[key] = value
+    results = {key: statistics.median(values) for key, values in samples.items()}
+    results.update(extra)
+    results["runs"] = runs
+    results["python"] = sys.version.split()[0]
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Return a list of human-readable regressions against a baseline result"""
+    regressions = []
+    for key, value in results.items():
+        old = baseline.get(key)
+        if not isinstance(value, float) or not isinstance(old, float) or old <= 0:
+            continue
+        if value > old * (1 + threshold):
+            regressions.append(f"{key}: {old * 1000:.1f} ms -> {value * 1000:.1f} ms (+{(value / old - 1) * 100:.0f}%)")
+    if results.get("eager_sdk_imports"):
+        regressions.append(f"provider SDKs imported at startup: {', '.join(results['eager_sdk_imports'])}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure promptIDE import time and time to first paint")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous --output file and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    for key, value in sorted(results.items()):
+        if isinstance(value, float):
+            print(f"{key:>20}: {value * 1000:8.1f} ms")
+        else:
+            print(f"{key:>20}: {value}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
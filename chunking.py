@@ -0,0 +1,275 @@
+import ast
+import contextvars
+import logging
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from config import LOGGING_ENABLED
+from validation import strip_fences
+
+# Files larger than this are split; smaller files go out as a single request
+CHUNK_THRESHOLD_CHARS = 12000
+CHUNK_MAX_CHARS = 8000
+CHUNK_WINDOW_LINES = 200
+CHUNK_MAX_WORKERS = 4
+CONTEXT_MAX_CHARS = 4000
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+class Chunk:
+    """A contiguous run of source lines; stitching all chunks in order gives back the file"""
+
+    def __init__(self, text, start_line, end_line, names=None):
+        self.text = text
+        self.start_line = start_line
+        self.end_line = end_line
+        self.names = names or []
+        # Methods of a split class keep the class's indentation, which is taken off before sending
+        self.indent = _common_indent(text)
+
+    @property
+    def code(self):
+        """The text to send: without its shared indentation and the blank lines around it"""
+        return _dedent(_strip_blank_lines(self.text))
+
+    def restore(self, output):
+        """An answer for code put back in the chunk's place, with its indentation and surrounding blank lines"""
+        # Whitespace-only lines are indented too, so they come back as they were sent
+        body = textwrap.indent(_dedent(_strip_blank_lines(strip_fences(output))), self.indent,
+                               lambda line: line.strip("\r\n"))
+        return keep_spacing(self.text, body)
+
+    def __repr__(self):
+        return f"Chunk(lines {self.start_line}-{self.end_line}, names={self.names})"
+
+
+def _common_indent(text):
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return ""
+    dedented = textwrap.dedent("\n".join(lines))
+    return lines[0][:len(lines[0]) - len(dedented.split("\n", 1)[0])]
+
+
+def _dedent(text):
+    """text without its common indentation; unlike textwrap.dedent, whitespace-only lines are kept"""
+    indent = _common_indent(text)
+    return "".join(line[len(indent):] if line.startswith(indent) else line
+                   for line in text.splitlines(keepends=True))
+
+
+def _strip_blank_lines(text):
+    """text without the blank lines before and after it"""
+    lines = text.splitlines(keepends=True)
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    if not filled:
+        return ""
+    return "".join(lines[filled[0]:filled[-1] + 1]).rstrip("\r\n")
+
+
+def keep_spacing(original, text):
+    """text with the blank lines that original had around it; answers usually come back stripped"""
+    lines = original.splitlines(keepends=True)
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    if not filled:
+        return text
+    last = lines[filled[-1]]
+    ending = last[len(last.rstrip("\r\n")):]
+    return "".join(lines[:filled[0]]) + _strip_blank_lines(text) + ending + "".join(lines[filled[-1] + 1:])
+
+
+def needs_chunking(content):
+    return len(content) > CHUNK_THRESHOLD_CHARS
+
+
+def _is_filler(line):
+    stripped = line.strip()
+    return not stripped or stripped.startswith("#")
+
+
+def _node_units(lines, nodes, lo, hi):
+    """Turn statements into (start, end, node) line ranges covering lines[lo:hi] exactly.
+
+    Comments and blank lines directly above a statement travel with it.
+    """
+    starts = []
+    previous_end = lo
+    for node in nodes:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+        while start > previous_end and _is_filler(lines[start - 1]):
+            start -= 1
+        starts.append(max(start, lo))
+        previous_end = node.end_lineno
+    if starts:
+        starts[0] = lo
+    units = []
+    for i, node in enumerate(nodes):
+        end = starts[i + 1] if i + 1 < len(nodes) else hi
+        units.append((starts[i], end, node))
+    return units
+
+
+def _node_name(node):
+    return getattr(node, "name", None)
+
+
+def _group_units(lines, units, max_chars):
+    """Greedily pack consecutive units into chunks no larger than max_chars"""
+    chunks = []
+    current = []
+    size = 0
+    for start, end, node in units:
+        unit_size = sum(len(line) for line in lines[start:end])
+        if unit_size > max_chars and isinstance(node, ast.ClassDef) and len(node.body) > 1:
+            # Split an oversized class at its method boundaries
+            if current:
+                chunks.append(current)
+                current, size = [], 0
+            body_units = _node_units(lines, node.body, start, end)
+            for group in _group_units(lines, body_units, max_chars):
+                chunks.append([(group.start_line - 1, group.end_line, node)])
+            continue
+        if current and size + unit_size > max_chars:
+            chunks.append(current)
+            current, size = [], 0
+        current.append((start, end, node))
+        size += unit_size
+    if current:
+        chunks.append(current)
+
+    result = []
+    for group in chunks:
+        start, end = group[0][0], group[-1][1]
+        names = [name for name in (_node_name(node) for _, _, node in group) if name]
+        result.append(Chunk("".join(lines[start:end]), start + 1, end, names))
+    return result
+
+
+def split_python(source, max_chars=CHUNK_MAX_CHARS):
+    """Split Python source at top-level function and class boundaries"""
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    if not tree.body:
+        return [Chunk(source, 1, len(lines))]
+    units = _node_units(lines, tree.body, 0, len(lines))
+    return _group_units(lines, units, max_chars)
+
+
+def split_lines(text, max_lines=CHUNK_WINDOW_LINES):
+    """Split arbitrary text into windows of about max_lines, preferring blank-line breaks"""
+    lines = text.splitlines(keepends=True)
+    chunks = []
+    start = 0
+    while start < len(lines):
+        end = min(start + max_lines, len(lines))
+        if end < len(lines):
+            # Look back up to a quarter window for a paragraph break
+            for candidate in range(end, end - max_lines // 4, -1):
+                if not lines[candidate - 1].strip():
+                    end = candidate
+                    break
+        chunks.append(Chunk("".join(lines[start:end]), start + 1, end))
+        start = end
+    return chunks or [Chunk(text, 1, 1)]
+
+
+def split_source(content, filename=None, max_chars=CHUNK_MAX_CHARS):
+    """Split by AST for Python sources, falling back to line windows for anything else"""
+    is_python = filename is None or filename.endswith((".py", ".pyw"))
+    if is_python:
+        try:
+            return split_python(content, max_chars)
+        except SyntaxError:
+            if LOGGING_ENABLED:
+                logger.info("Could not parse %s as Python, splitting by lines", filename or "buffer")
+    average_line = max(1, len(content) // max(1, content.count("\n") + 1))
+    return split_lines(content, max(20, min(CHUNK_WINDOW_LINES, max_chars // average_line)))
+
+
+def build_context(content, max_chars=CONTEXT_MAX_CHARS):
+    """Summarise a Python module as its imports plus top-level signatures"""
+    try:
+        tree = ast.parse(content)
+    except SyntaxError:
+        return ""
+    lines = content.splitlines()
+    parts = []
+
+    def signature(node):
+        first = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+        last = max(node.body[0].lineno - 1, node.lineno)
+        return "\n".join(line.rstrip() for line in lines[first:last]) + " ..."
+
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            parts.append(ast.get_source_segment(content, node))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            parts.append(signature(node))
+        elif isinstance(node, ast.ClassDef):
+            parts.append(signature(node))
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    parts.append(signature(child))
+    context = "\n".join(part for part in parts if part)
+    if len(context) > max_chars:
+        context = context[:max_chars] + "\n# ... (truncated)"
+    return context
+
+
+def build_chunk_prompt(prompt_input, context, index, total):
+    """Wrap the user's prompt with instructions and shared context for one chunk"""
+    parts = [
+        prompt_input,
+        f"The code above is part {index} of {total} of a larger file. Apply only the changes "
+        "that concern this part and return only this part, complete, keeping its indentation.",
+    ]
+    if context:
+        parts.append(f"For reference, the whole file has these imports and definitions:\n{context}")
+    return "\n\n".join(parts)
+
+
+def stitch(outputs):
+    """Join chunk outputs in order, making sure each ends on a line boundary"""
+    return "".join(text if text.endswith("\n") else text + "\n" for text in outputs)
+
+
+def process_in_chunks(process_fn, prompt_input, content, filename=None, max_workers=CHUNK_MAX_WORKERS, progress=None):
+    """Send the chunks of content concurrently through process_fn(prompt, code) and stitch the results"""
+    chunks = split_source(content, filename)
+    if len(chunks) == 1:
+        return process_fn(prompt_input, content)
+
+    context = build_context(content) if filename is None or filename.endswith((".py", ".pyw")) else ""
+    if LOGGING_ENABLED:
+        logger.info("Processing %s in %s chunks", filename or "buffer", len(chunks))
+
+    outputs = [None] * len(chunks)
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(
+                # Chunks log under the request id of the whole file
+                contextvars.copy_context().run,
+                process_fn,
+                build_chunk_prompt(prompt_input, context, index + 1, len(chunks)),
+                chunk.code
+            ): index
+            for index, chunk in enumerate(chunks)
+        }
+        try:
+            for future in futures:
+                # Answers come back stripped and without the indentation that was taken off
+                index = futures[future]
+                outputs[index] = chunks[index].restore(future.result())
+                done += 1
+                if progress:
+                    progress(done, len(chunks))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    result = stitch(outputs)
+    if not content.endswith("\n"):
+        result = result[:-1]
+    return result
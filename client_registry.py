@@ -0,0 +1,165 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import sys
+import threading
+import time
+from config import (
+    GEMINI_API_KEY,
+    OPENAI_API_KEY,
+    GEMINI_CONFIG,
+    GEMINI_SAFETY_SETTINGS,
+    LOGGING_ENABLED,
+    REQUEST_TIMEOUT
+)
+
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+HTTP_KEEPALIVE_EXPIRY = 120.0
+# HTTP/2 needs the optional h2 package; without it httpx falls back to HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+_clients = {}
+_creation_locks = {}
+_registry_lock = threading.Lock()
+_gemini_configured = False
+
+
+def _registry_key(provider, config):
+    return (provider, json.dumps(config, sort_keys=True, default=str))
+
+
+def get_client(provider, factory, config=None):
+    """Return the shared client for (provider, config), creating it once with factory()"""
+    key = _registry_key(provider, config)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _registry_lock:
+        lock = _creation_locks.setdefault(key, threading.Lock())
+    # Creation happens outside the registry lock so one slow provider does not block the others
+    with lock:
+        client = _clients.get(key)
+        if client is None:
+            started = time.perf_counter()
+            client = factory()
+            _clients[key] = client
+            if LOGGING_ENABLED:
+                logger.info("Created shared %s client in %.3fs", provider, time.perf_counter() - started)
+    return client
+
+
+def gemini_generation_config(config=None):
+    config = config or GEMINI_CONFIG
+    return {
+        "temperature": config["temperature"],
+        "top_p": config["top_p"],
+        "top_k": config["top_k"],
+        "max_output_tokens": config["max_output_tokens"],
+    }
+
+
+def get_gemini_model(config=None):
+    """Shared GenerativeModel; genai keeps a single gRPC (HTTP/2) channel underneath"""
+    config = config or GEMINI_CONFIG
+
+    def create():
+        global _gemini_configured
+        import google.generativeai as genai
+        if not _gemini_configured:
+            genai.configure(api_key=GEMINI_API_KEY)
+            _gemini_configured = True
+        return genai.GenerativeModel(
+            model_name=config["model"],
+            generation_config=gemini_generation_config(config),
+            safety_settings=GEMINI_SAFETY_SETTINGS
+        )
+
+    return get_client("gemini", create, config)
+
+
+def get_openai_client(api_key=None, base_url=None):
+    """Shared OpenAI client backed by a pooled keep-alive httpx client"""
+
+    def create():
+        import httpx
+        from openai import OpenAI
+        http_client = httpx.Client(
+            http2=HTTP2_AVAILABLE,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
+        )
+        return OpenAI(
+            api_key=api_key or OPENAI_API_KEY,
+            base_url=base_url,
+            timeout=REQUEST_TIMEOUT,
+            http_client=http_client
+        )
+
+    # Keyed on the key itself (hashed), so callers with different keys never share credentials
+    key_hash = hashlib.sha256((api_key or OPENAI_API_KEY or "").encode("utf-8")).hexdigest()
+    return get_client("openai", create, {"base_url": base_url, "api_key": key_hash})
+
+
+def clear_clients():
+    """Close and forget every shared client (used on shutdown and by measure_latency)"""
+    global _gemini_configured
+    with _registry_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _creation_locks.clear()
+        _gemini_configured = False
+    for client in clients:
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                if LOGGING_ENABLED:
+                    logger.warning("Error closing client: %s", e)
+
+
+def measure_latency(service, prompt_input="Add a docstring", file_content="def example():\n    return True", repeats=3):
+    """Time one cold request (fresh client, new connection) against warm requests on the pooled client"""
+    from ai_service import AIServiceProcessor
+
+    clear_clients()
+    started = time.perf_counter()
+    processor = AIServiceProcessor(service=service, cache=False)
+    processor.process_text(prompt_input, file_content, use_cache=False)
+    cold = time.perf_counter() - started
+
+    warm = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        # A new processor per request, as the GUI does when switching services
+        AIServiceProcessor(service=service, cache=False).process_text(prompt_input, file_content, use_cache=False)
+        warm.append(time.perf_counter() - started)
+    return {
+        "service": service,
+        "http2": HTTP2_AVAILABLE,
+        "cold": cold,
+        "warm": warm,
+        "warm_mean": sum(warm) / len(warm) if warm else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    services = sys.argv[1:] or ["gemini", "openai"]
+    for service in services:
+        try:
+            result = measure_latency(service)
+            print(
+                f"{service}: cold {result['cold']:.3f}s, warm mean {result['warm_mean']:.3f}s "
+                f"({', '.join(f'{value:.3f}' for value in result['warm'])}), http2={result['http2']}"
+            )
+        except Exception as e:
+            print(f"{service}: measurement failed: {str(e)}")
@@ -0,0 +1,174 @@
+import keyword
+import re
+from PyQt6.QtWidgets import QPlainTextEdit, QWidget
+from PyQt6.QtCore import QRect, QSize, Qt
+from PyQt6.QtGui import QColor, QFont, QFontDatabase, QPainter, QTextCharFormat, QTextLayout
+
+LINE_NUMBER_BACKGROUND = QColor(240, 240, 240)
+LINE_NUMBER_COLOR = QColor(130, 130, 130)
+
+
+def _char_format(color, bold=False, italic=False):
+    char_format = QTextCharFormat()
+    char_format.setForeground(QColor(color))
+    if bold:
+        char_format.setFontWeight(QFont.Weight.Bold)
+    if italic:
+        char_format.setFontItalic(True)
+    return char_format
+
+
+class PythonHighlighter:
+    """Line-by-line Python highlighting applied as layout formats.
+
+    Unlike QSyntaxHighlighter this never walks the whole document: CodeEditor
+    asks it to highlight blocks as they scroll into view. Formats live on the
+    block layout, so they do not touch the text, the undo stack or
+    toPlainText(). Multi-line strings are only highlighted on the lines
+    that contain the quotes.
+    """
+
+    RULES = [
+        (re.compile(r"\b(?:" + "|".join(keyword.kwlist) + r")\b"), _char_format("#0033b3", bold=True)),
+        (re.compile(r"\b(?:self|cls|None|True|False)\b"), _char_format("#94558d")),
+        (re.compile(r"\b\d+(?:\.\d+)?\b"), _char_format("#1750eb")),
+        (re.compile(r"^\s*@[\w.]+"), _char_format("#9e880d")),
+        (re.compile(r"(?<=\bdef\s)\w+|(?<=\bclass\s)\w+"), _char_format("#00627a", bold=True)),
+        # Strings and comments last so they win over keywords inside them
+        (re.compile(r"[rbfuRBFU]{0,2}(?:\"\"\"|'''|\"[^\"\\\n]*(?:\\.[^\"\\\n]*)*\"|'[^'\\\n]*(?:\\.[^'\\\n]*)*')"),
+         _char_format("#067d17")),
+        (re.compile(r"#[^\n]*"), _char_format("#8c8c8c", italic=True)),
+    ]
+
+    def formats_for(self, text):
+        ranges = []
+        for pattern, char_format in self.RULES:
+            for match in pattern.finditer(text):
+                format_range = QTextLayout.FormatRange()
+                format_range.start = match.start()
+                format_range.length = match.end() - match.start()
+                format_range.format = char_format
+                ranges.append(format_range)
+        return ranges
+
+    @staticmethod
+    def state_for(text):
+        """Marker stored in userState so unchanged blocks are not highlighted again.
+
+        block.revision() is not bumped by setPlainText, so the text itself is used.
+        """
+        return hash(text) & 0x7FFFFFFF
+
+    def highlight_blocks(self, blocks):
+        """Format the given blocks and relayout them in one go"""
+        for block in blocks:
+            text = block.text()
+            block.layout().setFormats(self.formats_for(text))
+            block.setUserState(self.state_for(text))
+        if blocks:
+            start = blocks[0].position()
+            end = blocks[-1].position() + blocks[-1].length()
+            blocks[0].document().markContentsDirty(start, end - start)
+
+
+class LineNumberArea(QWidget):
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+
+    def sizeHint(self):
+        return QSize(self.editor.line_number_area_width(), 0)
+
+    def paintEvent(self, event):
+        self.editor.paint_line_numbers(event)
+
+
+class CodeEditor(QPlainTextEdit):
+    """Plain-text code view for large files.
+
+    QPlainTextEdit lays out and paints only the visible blocks; line numbers
+    and syntax highlighting follow the same rule, so cost scales with the
+    viewport rather than the file.
+    """
+
+    def __init__(self, parent=None, highlight=True):
+        super().__init__(parent)
+        self.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        self.highlighter = PythonHighlighter() if highlight else None
+        self.highlighting = False
+        self.line_number_area = LineNumberArea(self)
+        self.line_number_width = 0
+
+        self.blockCountChanged.connect(self.update_line_number_area_width)
+        self.updateRequest.connect(self.on_update_request)
+        self.update_line_number_area_width()
+
+    def line_number_area_width(self):
+        digits = len(str(max(1, self.blockCount())))
+        return 10 + self.fontMetrics().horizontalAdvance("9") * digits
+
+    def update_line_number_area_width(self, _count=0):
+        # blockCountChanged fires for every line while a file loads; only relayout when the digit count changes
+        width = self.line_number_area_width()
+        if width != self.line_number_width:
+            self.line_number_width = width
+            self.setViewportMargins(width, 0, 0, 0)
+
+    def on_update_request(self, rect, dy):
+        if dy:
+            self.line_number_area.scroll(0, dy)
+        else:
+            self.line_number_area.update(0, rect.y(), self.line_number_area.width(), rect.height())
+        if rect.contains(self.viewport().rect()):
+            self.update_line_number_area_width()
+        self.highlight_visible_blocks()
+
+    def visible_blocks(self):
+        """Yield (block, top) for every block intersecting the viewport"""
+        block = self.firstVisibleBlock()
+        offset = self.contentOffset()
+        bottom = self.viewport().rect().bottom()
+        top = self.blockBoundingGeometry(block).translated(offset).top()
+        while block.isValid() and top <= bottom:
+            yield block, top
+            top += self.blockBoundingRect(block).height()
+            block = block.next()
+
+    def highlight_visible_blocks(self):
+        # The relayout after highlighting emits updateRequest again; ignore that round
+        if self.highlighter is None or self.highlighting:
+            return
+        state_for = self.highlighter.state_for
+        stale = [block for block, _ in self.visible_blocks() if block.userState() != state_for(block.text())]
+        self.highlighting = True
+        try:
+            self.highlighter.highlight_blocks(stale)
+        finally:
+            self.highlighting = False
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        rect = self.contentsRect()
+        self.line_number_area.setGeometry(QRect(rect.left(), rect.top(), self.line_number_area_width(), rect.height()))
+
+    def paint_line_numbers(self, event):
+        painter = QPainter(self.line_number_area)
+        painter.fillRect(event.rect(), LINE_NUMBER_BACKGROUND)
+        painter.setPen(LINE_NUMBER_COLOR)
+        width = self.line_number_area.width() - 5
+        height = self.fontMetrics().height()
+        for block, top in self.visible_blocks():
+            if block.isVisible() and top + height >= event.rect().top():
+                painter.drawText(
+                    0, int(top), width, height, Qt.AlignmentFlag.AlignRight, str(block.blockNumber() + 1)
+                )
+        painter.end()
+
+    def copy_from(self, other):
+        """Replace this editor's text with another editor's.
+
+        QTextDocument.clone() goes through a QTextDocumentFragment, copying the
+        text twice, so a single plain-text transfer is the cheaper path.
+        """
+        self.setPlainText(other.toPlainText())
@@ -0,0 +1,140 @@
+import difflib
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QTextEdit, QLabel, QDialogButtonBox, QPushButton
+from PyQt6.QtGui import QColor, QFontDatabase, QTextBlockFormat, QTextCursor
+
+REMOVED_COLOR = QColor(255, 220, 220)
+ADDED_COLOR = QColor(220, 255, 220)
+CHANGED_COLOR = QColor(255, 245, 200)
+FILLER_COLOR = QColor(235, 235, 235)
+
+
+def align_lines(original, modified):
+    """Pair up the lines of two texts for side-by-side display.
+
+    Returns (left, right) where each is a list of (text, kind); kind is one of
+    "equal", "removed", "added", "changed" or "filler" (padding for alignment).
+    """
+    a = original.splitlines()
+    b = modified.splitlines()
+    left, right = [], []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            left.extend((line, "equal") for line in a[i1:i2])
+            right.extend((line, "equal") for line in b[j1:j2])
+            continue
+        old = a[i1:i2]
+        new = b[j1:j2]
+        kind_left = "changed" if tag == "replace" else "removed"
+        kind_right = "changed" if tag == "replace" else "added"
+        for k in range(max(len(old), len(new))):
+            left.append((old[k], kind_left) if k < len(old) else ("", "filler"))
+            right.append((new[k], kind_right) if k < len(new) else ("", "filler"))
+    return left, right
+
+
+class DiffDialog(QDialog):
+    """Side-by-side view of the original and modified code"""
+
+    COLORS = {
+        "removed": REMOVED_COLOR,
+        "added": ADDED_COLOR,
+        "changed": CHANGED_COLOR,
+        "filler": FILLER_COLOR,
+    }
+
+    def __init__(self, original, modified, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Changes")
+        self.resize(1000, 700)
+
+        left, right = align_lines(original, modified)
+        added = sum(1 for _, kind in right if kind in ("added", "changed"))
+        removed = sum(1 for _, kind in left if kind in ("removed", "changed"))
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{added} line(s) added, {removed} line(s) removed"))
+
+        panes_layout = QHBoxLayout()
+        self.left_view = self.create_pane(left)
+        self.right_view = self.create_pane(right)
+        panes_layout.addWidget(self.left_view)
+        panes_layout.addWidget(self.right_view)
+        layout.addLayout(panes_layout)
+
+        # Keep both panes scrolled to the same line
+        left_bar = self.left_view.verticalScrollBar()
+        right_bar = self.right_view.verticalScrollBar()
+        left_bar.valueChanged.connect(right_bar.setValue)
+        right_bar.valueChanged.connect(left_bar.setValue)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def create_pane(self, lines):
+        view = QTextEdit()
+        view.setReadOnly(True)
+        view.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        view.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        view.setPlainText("\n".join(text for text, _ in lines))
+
+        cursor = QTextCursor(view.document())
+        block = view.document().firstBlock()
+        for _, kind in lines:
+            if not block.isValid():
+                break
+            color = self.COLORS.get(kind)
+            if color is not None:
+                block_format = QTextBlockFormat()
+                block_format.setBackground(color)
+                cursor.setPosition(block.position())
+                cursor.setBlockFormat(block_format)
+            block = block.next()
+        return view
+
+
+class CompareDialog(QDialog):
+    """Outputs of several providers for the same request, side by side"""
+
+    def __init__(self, results, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Compare Providers")
+        self.resize(1100, 700)
+        self.selected_text = None
+
+        layout = QVBoxLayout(self)
+        panes_layout = QHBoxLayout()
+        for result in results:
+            pane_layout = QVBoxLayout()
+            pane_layout.addWidget(QLabel(self.describe(result)))
+            view = QTextEdit()
+            view.setReadOnly(True)
+            view.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+            view.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+            view.setPlainText(result.text if result.ok else result.error)
+            pane_layout.addWidget(view)
+            use_button = QPushButton(f"Use {result.service}")
+            use_button.setMinimumHeight(30)
+            use_button.setEnabled(result.ok)
+            use_button.clicked.connect(lambda _checked, text=result.text: self.select(text))
+            pane_layout.addWidget(use_button)
+            panes_layout.addLayout(pane_layout)
+        layout.addLayout(panes_layout)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    @staticmethod
+    def describe(result):
+        if not result.ok:
+            return f"{result.service}: failed after {result.latency:.2f}s"
+        if result.usage.get("cached"):
+            tokens = "cached"
+        else:
+            tokens = f"{result.input_tokens or '?'} in / {result.output_tokens or '?'} out tokens"
+        return f"{result.service}: {result.latency:.2f}s, {tokens}"
+
+    def select(self, text):
+        self.selected_text = text
+        self.accept()
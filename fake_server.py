@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CODE_PATTERN = re.compile(r"\nCode:\n(.*?)\nSuggestions: ", re.DOTALL)
+
+
+def fake_completion(prompt):
+    """Deterministic 'model output': the code embedded in a promptIDE prompt, unchanged"""
+    match = CODE_PATTERN.search(prompt)
+    return match.group(1).strip() if match else prompt
+
+
+class FakeModelServer:
+    """Local OpenAI-compatible chat completions server for offline load tests and benchmarks.
+
+    Simulates a time to first token (latency, plus prompt tokens over
+    prefill_tokens_per_second when set), a generation rate (tokens_per_second)
+    and provider errors (error_rate of responses fail with one of error_codes,
+    optionally with a Retry-After header). Like OpenAI, it caches prompt
+    prefixes: every message but the last, for prefix_cache_ttl seconds; cached
+    tokens skip prefill and are reported in usage.prompt_tokens_details.
+    Randomness is seeded, so runs repeat.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, tokens_per_second=2000.0, error_rate=0.0,
+                 error_codes=(429, 503), retry_after=None, seed=0, chars_per_token=4, stream_batch_tokens=16,
+                 prefill_tokens_per_second=None, prefix_cache_ttl=300):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.prefix_cache_ttl = prefix_cache_ttl
+        # prefix hash -> expiry time
+        self._prefixes = {}
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.retry_after = retry_after
+        self.chars_per_token = chars_per_token
+        self.stream_batch_tokens = stream_batch_tokens
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-model-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _next_error(self):
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return self._random.choice(self.error_codes)
+        return None
+
+    def _tokens(self, text):
+        return max(1, len(text) // self.chars_per_token)
+
+    def _cached_tokens(self, messages):
+        """Tokens of the messages before the last one if they were seen recently; remembers them either way"""
+        if not self.prefix_cache_ttl or len(messages) < 2:
+            return 0
+        prefix = "\n".join(message.get("content", "") for message in messages[:-1])
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            hit = self._prefixes.get(key, 0) > now
+            self._prefixes[key] = now + self.prefix_cache_ttl
+        return self._tokens(prefix) if hit else 0
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") in ("/v1/models", "/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+                elif self.path == "/health":
+                    self._send_json(200, {"status": "ok", "requests": server.requests, "errors": server.errors})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+
+                error_code = server._next_error()
+                if error_code is not None:
+                    headers = {"Retry-After": str(server.retry_after)} if server.retry_after is not None else None
+                    self._send_json(error_code, {"error": {"message": f"simulated error {error_code}"}}, headers)
+                    return
+
+                messages = request.get("messages", [])
+                prompt = "\n".join(message.get("content", "") for message in messages)
+                user_prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user") or prompt
+                output = fake_completion(user_prompt)
+                cached_tokens = server._cached_tokens(messages)
+                usage = {
+                    "prompt_tokens": server._tokens(prompt),
+                    "completion_tokens": server._tokens(output),
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                model = request.get("model", "fake-model")
+
+                prefill = 0.0
+                if server.prefill_tokens_per_second:
+                    prefill = max(0, usage["prompt_tokens"] - cached_tokens) / server.prefill_tokens_per_second
+                time.sleep(server.latency + prefill)
+                if request.get("stream"):
+                    self._stream(model, output, usage)
+                else:
+                    time.sleep(usage["completion_tokens"] / server.tokens_per_second)
+                    self._send_json(200, {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": output}, "finish_reason": "stop"}],
+                        "usage": usage,
+                    })
+
+            def _stream(self, model, output, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                step = server.chars_per_token * server.stream_batch_tokens
+                delay = server.stream_batch_tokens / server.tokens_per_second
+                try:
+                    for start in range(0, len(output), step):
+                        chunk = {
+                            "id": "chatcmpl-fake",
+                            "object": "chat.completion.chunk",
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {"content": output[start:start + step]}}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(delay)
+                    final = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "model": model,
+                             "choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled the stream
+                    pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible model server for offline testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-codes", default="429,503", help="Comma-separated HTTP status codes to simulate")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with simulated errors")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prefill-tokens-per-second", type=float,
+                        help="Prompt processing rate; uncached prompt tokens add to the time to first token")
+    parser.add_argument("--prefix-cache-ttl", type=float, default=300, help="Seconds a prompt prefix stays cached; 0 to disable")
+    args = parser.parse_args(argv)
+
+    server = FakeModelServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        error_codes=[int(code) for code in args.error_codes.split(",") if code],
+        retry_after=args.retry_after,
+        seed=args.seed,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        prefix_cache_ttl=args.prefix_cache_ttl
+    )
+    print(f"Fake model server listening on {server.url} (use PROMPTIDE_LOCAL_URL={server.url})", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
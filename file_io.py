@@ -0,0 +1,172 @@
+import codecs
+import importlib.util
+import io
+import mmap
+import os
+import re
+import tempfile
+
+# Text is decoded and handed to the editor in pieces of about this many bytes
+LOAD_CHUNK_BYTES = 256 * 1024
+# Files at least this large are read through mmap instead of buffered reads
+MMAP_THRESHOLD_BYTES = 4 * 1024 * 1024
+SAVE_CHUNK_CHARS = 256 * 1024
+# Bytes inspected to guess the encoding and line endings
+DETECT_SAMPLE_BYTES = 64 * 1024
+# charset_normalizer is optional; without it non-UTF-8 text falls back to latin-1
+CHARSET_NORMALIZER_AVAILABLE = importlib.util.find_spec("charset_normalizer") is not None
+
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+CODING_COOKIE = re.compile(rb"^[ \t\f]*#.*?coding[:=][ \t]*([-\w.]+)")
+
+
+class FileInfo:
+    """What a load found out about a file, so it can be saved back the same way"""
+
+    def __init__(self, path, size, encoding="utf-8", newline="\n"):
+        self.path = path
+        self.size = size
+        self.encoding = encoding
+        self.newline = newline
+
+    def __repr__(self):
+        return f"FileInfo({self.path!r}, {self.size} bytes, {self.encoding}, newline={self.newline!r})"
+
+
+def _valid_utf8(sample, complete):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        # A multi-byte character cut off by the end of the sample is not an error
+        decoder.decode(sample, final=complete)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_encoding(sample, complete=False):
+    """Guess the encoding of a file from its first bytes.
+
+    Checks, in order: a byte order mark, a PEP 263 coding cookie, UTF-8
+    validity, charset_normalizer (if installed), and finally latin-1, which
+    decodes anything.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for line in sample.splitlines()[:2]:
+        match = CODING_COOKIE.match(line)
+        if match:
+            try:
+                return codecs.lookup(match.group(1).decode("ascii")).name
+            except LookupError:
+                break
+    if _valid_utf8(sample, complete):
+        return "utf-8"
+    if CHARSET_NORMALIZER_AVAILABLE:
+        from charset_normalizer import from_bytes
+        best = from_bytes(sample).best()
+        if best is not None:
+            return best.encoding
+    return "latin-1"
+
+
+def detect_newline(sample):
+    if b"\r\n" in sample:
+        return "\r\n"
+    if b"\r" in sample and b"\n" not in sample:
+        return "\r"
+    return "\n"
+
+
+def _read_blocks(path, size, chunk_bytes):
+    with open(path, "rb") as file:
+        if size >= MMAP_THRESHOLD_BYTES:
+            # The OS pages the file in on demand instead of copying it into one big buffer
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(0, size, chunk_bytes):
+                    yield mapped[start:start + chunk_bytes]
+        else:
+            while True:
+                block = file.read(chunk_bytes)
+                if not block:
+                    break
+                yield block
+
+
+def iter_text_chunks(path, chunk_bytes=LOAD_CHUNK_BYTES, encoding=None, cancel_event=None):
+    """Decode a file incrementally.
+
+    Yields the FileInfo first, then (text, bytes_read) pieces with newlines
+    normalised to "\\n", as open(path).read() would give them. Stops early
+    when cancel_event is set.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        sample = file.read(DETECT_SAMPLE_BYTES)
+    info = FileInfo(
+        path,
+        size,
+        encoding or detect_encoding(sample, complete=len(sample) == size),
+        detect_newline(sample)
+    )
+    yield info
+
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(info.encoding)(), translate=True)
+    bytes_read = 0
+    for block in _read_blocks(path, size, chunk_bytes):
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        bytes_read += len(block)
+        text = decoder.decode(block, final=bytes_read >= size)
+        if text:
+            yield text, bytes_read
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail, bytes_read
+
+
+def read_text(path, encoding=None):
+    """Read a whole file with encoding detection; returns (text, FileInfo)"""
+    chunks = iter_text_chunks(path, encoding=encoding)
+    info = next(chunks)
+    return "".join(text for text, _ in chunks), info
+
+
+def write_text_atomic(path, text, encoding="utf-8", newline=None, progress=None, chunk_chars=SAVE_CHUNK_CHARS):
+    """Write text to a temp file next to path and rename it into place.
+
+    The text is encoded piece by piece, so no second full-size bytes copy is
+    made. An existing file keeps its permissions. progress(done, total) is
+    called with character counts.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".promptide-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding, newline=newline if newline is not None else "") as file:
+            total = len(text)
+            for start in range(0, total, chunk_chars):
+                file.write(text[start:start + chunk_chars])
+                if progress is not None:
+                    progress(min(start + chunk_chars, total), total)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode & 0o7777
+        else:
+            # mkstemp creates the file as 0600; give new files the usual umask-based mode
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
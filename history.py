@@ -0,0 +1,382 @@
+import argparse
+import difflib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from config import LOGGING_ENABLED, OUTPUT_DIR
+
+HISTORY_DB_PATH = os.path.join(OUTPUT_DIR, "history.sqlite3")
+# A version is rebuilt from its keyframe with at most this many deltas, however long the history is
+HISTORY_MAX_CHAIN = 32
+# A delta at least this large relative to the compressed full text is stored as a keyframe instead
+HISTORY_DELTA_RATIO = 0.5
+# Earlier sessions kept when the store is opened; older ones, and the texts only they use, are deleted
+HISTORY_KEEP_SESSIONS = 50
+# Rebuilt texts kept in memory; neighbouring versions share most of their chain
+HISTORY_TEXT_CACHE = 16
+# The timeline shows this much of the prompt
+HISTORY_SUMMARY_CHARS = 200
+
+FULL = "full"
+DELTA = "delta"
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def new_session_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def make_delta(base, text):
+    """Line delta turning base into text.
+
+    A list of [start, count] ranges copied from base's lines and strings
+    inserted as they are; see apply_delta.
+    """
+    a = base.splitlines(keepends=True)
+    b = text.splitlines(keepends=True)
+    # Edits are usually local; matching only the middle keeps SequenceMatcher fast on long files
+    limit = min(len(a), len(b))
+    head = 0
+    while head < limit and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+
+    ops = []
+
+    def copy(start, count):
+        if ops and isinstance(ops[-1], list) and ops[-1][0] + ops[-1][1] == start:
+            ops[-1][1] += count
+        elif count:
+            ops.append([start, count])
+
+    def insert(lines):
+        if not lines:
+            return
+        if ops and isinstance(ops[-1], str):
+            ops[-1] += "".join(lines)
+        else:
+            ops.append("".join(lines))
+
+    copy(0, head)
+    middle_a, middle_b = a[head:len(a) - tail], b[head:len(b) - tail]
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, middle_a, middle_b).get_opcodes():
+        if tag == "equal":
+            copy(head + i1, i2 - i1)
+        else:
+            insert(middle_b[j1:j2])
+    copy(len(a) - tail, tail)
+    return ops
+
+
+def apply_delta(base, ops):
+    lines = base.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(lines[op[0]:op[0] + op[1]])
+    return "".join(parts)
+
+
+def changed_lines(base, text):
+    """(added, removed) line counts from base to text"""
+    ops = make_delta(base, text)
+    added = sum(len(op.splitlines()) for op in ops if isinstance(op, str))
+    removed = len(base.splitlines()) - sum(op[1] for op in ops if not isinstance(op, str))
+    return added, removed
+
+
+def _summary(prompt):
+    first_line = prompt.strip().split("\n", 1)[0]
+    return first_line[:HISTORY_SUMMARY_CHARS]
+
+
+class HistoryStep:
+    """One recorded request: what was asked, of which code, and the answer"""
+
+    COLUMNS = (
+        "id", "session", "created", "provider", "latency", "summary",
+        "prompt_hash", "input_hash", "output_hash", "filename"
+    )
+
+    def __init__(self, row):
+        for name, value in zip(self.COLUMNS, row):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"HistoryStep({self.id}, {self.provider}, {self.summary!r})"
+
+
+class HistoryStore:
+    """Session history of requests, stored as content-addressed, delta-compressed texts.
+
+    Every prompt, input and output is stored once under its hash, either
+    zlib-compressed in full (a keyframe) or as a compressed line delta
+    against a related text: an output against its input, an input against
+    the previous output, a prompt against the previous prompt. Chains are
+    cut at HISTORY_MAX_CHAIN deltas, so jumping to any step costs the same
+    however many steps there are. Several processes can share the file.
+    """
+
+    def __init__(self, db_path=HISTORY_DB_PATH, session=None, keep_sessions=HISTORY_KEEP_SESSIONS,
+                 max_chain=HISTORY_MAX_CHAIN):
+        self.db_path = db_path
+        self.session = session or new_session_id()
+        self.max_chain = max_chain
+        self._lock = threading.Lock()
+        self._texts = OrderedDict()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # Autocommit; multi-statement changes use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "hash TEXT PRIMARY KEY, kind TEXT NOT NULL, base TEXT, depth INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, data BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS steps ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session TEXT NOT NULL, created REAL NOT NULL, "
+            "provider TEXT, latency REAL, summary TEXT NOT NULL, prompt_hash TEXT NOT NULL, "
+            "input_hash TEXT NOT NULL, output_hash TEXT NOT NULL, filename TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS steps_session ON steps (session, id)")
+        if keep_sessions:
+            self.prune(keep_sessions)
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _blob(self, digest):
+        """(kind, base, depth, data) of a stored text, or None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT kind, base, depth, data FROM blobs WHERE hash = ?", (digest,)
+            ).fetchone()
+
+    def put_text(self, text, base=None):
+        """Store text, as a delta against the text with hash base when that is smaller; returns its hash"""
+        digest = text_hash(text)
+        if self._blob(digest) is not None:
+            return digest
+        full = zlib.compress(text.encode("utf-8", "surrogatepass"))
+        kind, base_hash, depth, data = FULL, None, 0, full
+        base_row = self._blob(base) if base is not None and base != digest else None
+        if base_row is not None and base_row[2] < self.max_chain:
+            delta = zlib.compress(json.dumps(make_delta(self.text(base), text), separators=(",", ":")).encode("utf-8"))
+            if len(delta) < len(full) * HISTORY_DELTA_RATIO:
+                kind, base_hash, depth, data = DELTA, base, base_row[2] + 1, delta
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, kind, base, depth, size, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, kind, base_hash, depth, len(text), data)
+            )
+        self._remember(digest, text)
+        return digest
+
+    def text(self, digest):
+        """The text stored under digest; rebuilt from its keyframe and at most max_chain deltas"""
+        with self._lock:
+            cached = self._texts.get(digest)
+            if cached is not None:
+                self._texts.move_to_end(digest)
+                return cached
+        # Walk back to a keyframe or a text already in memory, then apply the deltas forward
+        chain = []
+        current = digest
+        text = None
+        while True:
+            with self._lock:
+                text = self._texts.get(current)
+            if text is not None:
+                break
+            row = self._blob(current)
+            if row is None:
+                raise KeyError(f"No text {current} in the history")
+            kind, base, _, data = row
+            if kind == FULL:
+                text = zlib.decompress(data).decode("utf-8", "surrogatepass")
+                break
+            chain.append(data)
+            current = base
+        for data in reversed(chain):
+            text = apply_delta(text, json.loads(zlib.decompress(data)))
+        if text_hash(text) != digest:
+            raise Exception(f"History text {digest} is corrupt")
+        self._remember(digest, text)
+        return text
+
+    def _remember(self, digest, text):
+        with self._lock:
+            self._texts[digest] = text
+            self._texts.move_to_end(digest)
+            while len(self._texts) > HISTORY_TEXT_CACHE:
+                self._texts.popitem(last=False)
+
+    def last_step(self, session=None):
+        rows = self._select("WHERE session = ? ORDER BY id DESC LIMIT 1", (session or self.session,))
+        return rows[0] if rows else None
+
+    def record(self, prompt, input_text, output_text, provider=None, latency=None, filename=None):
+        """Add a step to this session; returns the HistoryStep"""
+        previous = self.last_step()
+        prompt_hash = self.put_text(prompt, previous.prompt_hash if previous else None)
+        # After Copy to Input the input is the previous output, and costs nothing
+        input_hash = self.put_text(input_text, previous.output_hash if previous else None)
+        output_hash = self.put_text(output_text, input_hash)
+        created = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO steps (session, created, provider, latency, summary, prompt_hash, input_hash, "
+                "output_hash, filename) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.session, created, provider, latency, _summary(prompt), prompt_hash, input_hash, output_hash,
+                 filename)
+            )
+            step_id = cursor.lastrowid
+        if LOGGING_ENABLED:
+            logger.info("Recorded history step %s (%s, %s)", step_id, provider, self.session)
+        return self.step(step_id)
+
+    def _select(self, where="", params=()):
+        query = f"SELECT {', '.join(HistoryStep.COLUMNS)} FROM steps {where}"
+        with self._lock:
+            return [HistoryStep(row) for row in self._conn.execute(query, params).fetchall()]
+
+    def step(self, step_id):
+        rows = self._select("WHERE id = ?", (step_id,))
+        return rows[0] if rows else None
+
+    def steps(self, session=None):
+        """Steps of a session (this one by default), oldest first"""
+        return self._select("WHERE session = ? ORDER BY id", (session or self.session,))
+
+    def sessions(self):
+        """(session, number of steps, first, last) for every session, newest first"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT session, COUNT(*), MIN(created), MAX(created) FROM steps "
+                "GROUP BY session ORDER BY MAX(id) DESC"
+            ).fetchall()
+
+    def checkout(self, step_id):
+        """(prompt, input, output) of a step"""
+        step = self.step(step_id)
+        if step is None:
+            raise KeyError(f"No history step {step_id}")
+        return self.text(step.prompt_hash), self.text(step.input_hash), self.text(step.output_hash)
+
+    def stats(self):
+        with self._lock:
+            blobs, stored, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0), COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+            keyframes = self._conn.execute("SELECT COUNT(*) FROM blobs WHERE kind = ?", (FULL,)).fetchone()[0]
+            steps = self._conn.execute("SELECT COUNT(*) FROM steps").fetchone()[0]
+        return {
+            "steps": steps,
+            "texts": blobs,
+            "keyframes": keyframes,
+            "stored_bytes": stored,
+            "text_bytes": size,
+        }
+
+    def prune(self, keep_sessions=HISTORY_KEEP_SESSIONS):
+        """Delete all but the newest keep_sessions sessions and the texts nothing needs any more"""
+
+        def work():
+            old = [row[0] for row in self._conn.execute(
+                "SELECT session FROM steps GROUP BY session ORDER BY MAX(id) DESC LIMIT -1 OFFSET ?",
+                (keep_sessions,)
+            ).fetchall()]
+            if not old:
+                return 0
+            self._conn.executemany("DELETE FROM steps WHERE session = ?", [(session,) for session in old])
+            # Texts still used by a step, plus the bases their deltas are built on
+            live = set()
+            for row in self._conn.execute("SELECT prompt_hash, input_hash, output_hash FROM steps"):
+                live.update(row)
+            bases = dict(self._conn.execute("SELECT hash, base FROM blobs WHERE base IS NOT NULL").fetchall())
+            pending = list(live)
+            while pending:
+                base = bases.get(pending.pop())
+                if base is not None and base not in live:
+                    live.add(base)
+                    pending.append(base)
+            dead = [(digest,) for (digest,) in self._conn.execute("SELECT hash FROM blobs") if digest not in live]
+            self._conn.executemany("DELETE FROM blobs WHERE hash = ?", dead)
+            return len(old)
+
+        removed = self._transaction(work)
+        if removed:
+            with self._lock:
+                self._texts.clear()
+            if LOGGING_ENABLED:
+                logger.info("Pruned %s old history session(s)", removed)
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the request history")
+    parser.add_argument("--db", default=HISTORY_DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sessions", help="List sessions")
+    list_parser = commands.add_parser("list", help="List the steps of a session")
+    list_parser.add_argument("session", nargs="?")
+    show_parser = commands.add_parser("show", help="Print the prompt, input or output of a step")
+    show_parser.add_argument("step", type=int)
+    show_parser.add_argument("--part", choices=("prompt", "input", "output"), default="output")
+    commands.add_parser("stats", help="Show how much the history takes up")
+    args = parser.parse_args(argv)
+
+    # Inspecting must not delete anything
+    store = HistoryStore(args.db, keep_sessions=None)
+    if args.command == "sessions":
+        for session, count, first, last in store.sessions():
+            started = time.strftime("%Y-%m-%d %H:%M", time.localtime(first))
+            print(f"{session:<22} {count:>5} step(s)  {started}  ({last - first:.0f}s)")
+    elif args.command == "list":
+        session = args.session or (store.sessions() or [[None]])[0][0]
+        for step in store.steps(session) if session else []:
+            latency = f"{step.latency:.2f}s" if step.latency is not None else "-"
+            print(f"{step.id:>6} {time.strftime('%H:%M:%S', time.localtime(step.created))} "
+                  f"{step.provider or '-':<8} {latency:>7}  {step.summary}")
+    elif args.command == "show":
+        prompt, input_text, output_text = store.checkout(args.step)
+        sys.stdout.write({"prompt": prompt, "input": input_text, "output": output_text}[args.part])
+    else:
+        for key, value in store.stats().items():
+            print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
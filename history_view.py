@@ -0,0 +1,145 @@
+import time
+from PyQt6.QtWidgets import (
+    QDialog, QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QTableWidget, QTableWidgetItem, QHeaderView,
+    QAbstractItemView, QTextEdit, QLabel, QDialogButtonBox, QPushButton, QSplitter
+)
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QFontDatabase
+from diff_view import DiffDialog
+from history import changed_lines
+
+# Prompts with project context attached can be long; the details line shows their start
+PROMPT_PREVIEW_CHARS = 1000
+
+
+class HistoryDialog(QDialog):
+    """Timeline of recorded requests; any step's input and output can be put back in the editors"""
+
+    COLUMNS = ["#", "Time", "Provider", "Latency", "Prompt"]
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("History")
+        self.resize(1000, 700)
+        self.store = store
+        self.steps = []
+        self.current = None
+        # (input, output) to put back; either is None when it should stay as it is
+        self.restored = None
+
+        layout = QVBoxLayout(self)
+        self.session_box = QComboBox()
+        for session, count, first, _ in self.session_choices():
+            started = time.strftime("%Y-%m-%d %H:%M", time.localtime(first)) if first else "now"
+            label = "This session" if session == store.session else session
+            self.session_box.addItem(f"{label} ({count} step(s), {started})", session)
+        self.session_box.currentIndexChanged.connect(self.load_session)
+        layout.addWidget(self.session_box)
+
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        header = self.table.horizontalHeader()
+        for column in range(len(self.COLUMNS) - 1):
+            header.setSectionResizeMode(column, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(len(self.COLUMNS) - 1, QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.table.itemSelectionChanged.connect(self.show_selected)
+        self.table.cellDoubleClicked.connect(lambda _row, _column: self.restore(True, True))
+        splitter.addWidget(self.table)
+
+        preview = QWidget()
+        preview_layout = QVBoxLayout(preview)
+        preview_layout.setContentsMargins(0, 0, 0, 0)
+        self.details = QLabel()
+        self.details.setWordWrap(True)
+        self.details.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        self.preview = QTextEdit()
+        self.preview.setReadOnly(True)
+        self.preview.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        self.preview.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        preview_layout.addWidget(self.details)
+        preview_layout.addWidget(self.preview)
+        splitter.addWidget(preview)
+        splitter.setSizes([250, 450])
+        layout.addWidget(splitter)
+
+        button_layout = QHBoxLayout()
+        self.action_buttons = []
+        for text, callback in (
+            ("Restore Input", lambda: self.restore(True, False)),
+            ("Restore Output", lambda: self.restore(False, True)),
+            ("Restore Both", lambda: self.restore(True, True)),
+            ("Show Diff", self.show_diff),
+        ):
+            button = QPushButton(text)
+            button.setMinimumHeight(30)
+            button.setEnabled(False)
+            button.clicked.connect(callback)
+            button_layout.addWidget(button)
+            self.action_buttons.append(button)
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        buttons.rejected.connect(self.reject)
+        button_layout.addWidget(buttons)
+        layout.addLayout(button_layout)
+
+        self.load_session()
+
+    def session_choices(self):
+        """Recorded sessions, with this one first even before it has steps"""
+        sessions = self.store.sessions()
+        current = [row for row in sessions if row[0] == self.store.session] or [(self.store.session, 0, None, None)]
+        return current + [row for row in sessions if row[0] != self.store.session]
+
+    def load_session(self):
+        session = self.session_box.currentData()
+        self.steps = self.store.steps(session) if session else []
+        self.table.setRowCount(len(self.steps))
+        # Newest first
+        for row, step in enumerate(reversed(self.steps)):
+            latency = f"{step.latency:.2f}s" if step.latency is not None else "-"
+            values = [str(step.id), time.strftime("%H:%M:%S", time.localtime(step.created)),
+                      step.provider or "-", latency, step.summary]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setData(Qt.ItemDataRole.UserRole, step.id)
+                self.table.setItem(row, column, item)
+        self.current = None
+        self.preview.clear()
+        self.details.setText("No requests recorded yet" if not self.steps else "")
+        for button in self.action_buttons:
+            button.setEnabled(False)
+        if self.steps:
+            self.table.selectRow(0)
+
+    def show_selected(self):
+        items = self.table.selectedItems()
+        if not items:
+            return
+        step_id = items[0].data(Qt.ItemDataRole.UserRole)
+        prompt, input_text, output_text = self.store.checkout(step_id)
+        self.current = (step_id, prompt, input_text, output_text)
+        added, removed = changed_lines(input_text, output_text)
+        step = next(step for step in self.steps if step.id == step_id)
+        file_label = f" on {step.filename}" if step.filename else ""
+        prompt = prompt.strip()
+        if len(prompt) > PROMPT_PREVIEW_CHARS:
+            prompt = prompt[:PROMPT_PREVIEW_CHARS] + "..."
+        self.details.setText(f"Step {step_id}{file_label}: {added} line(s) added, {removed} removed\n{prompt}")
+        self.preview.setPlainText(output_text)
+        for button in self.action_buttons:
+            button.setEnabled(True)
+
+    def restore(self, restore_input, restore_output):
+        if self.current is None:
+            return
+        _, _, input_text, output_text = self.current
+        self.restored = (input_text if restore_input else None, output_text if restore_output else None)
+        self.accept()
+
+    def show_diff(self):
+        if self.current is not None:
+            DiffDialog(self.current[2], self.current[3], self).exec()
@@ -0,0 +1,329 @@
+import ast
+import contextvars
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from config import LOGGING_ENABLED
+from chunking import CHUNK_MAX_WORKERS, build_context, keep_spacing
+from validation import strip_fences
+
+# Rerunning a prompt on edited code only sends the top-level blocks that changed since the last answer
+INCREMENTAL_ENABLED = True
+# Smaller files are always sent whole
+INCREMENTAL_MIN_CHARS = 2000
+# With more of the file changed than this, it is sent whole; one request is cheaper and more coherent
+INCREMENTAL_MAX_CHANGED_RATIO = 0.5
+# Block answers remembered, over all files, prompts and providers
+INCREMENTAL_MAX_BLOCKS = 4096
+INCREMENTAL_MAX_WORKERS = CHUNK_MAX_WORKERS
+
+HEADER = "<header>"
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+class Block:
+    """A top-level def or class with the statements after it, or the module header before the first one"""
+
+    def __init__(self, text, start_line, key):
+        self.text = text
+        self.start_line = start_line
+        self.key = key
+
+    def __repr__(self):
+        return f"Block({self.key}, line {self.start_line})"
+
+
+def _is_filler(line):
+    stripped = line.strip()
+    return not stripped or stripped.startswith("#")
+
+
+def split_blocks(source):
+    """Split Python source into Blocks that join back into it; None if it does not parse.
+
+    Comments and blank lines directly above a def or class belong to it. Keys
+    are the def/class names, numbered when a name repeats.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    lines = source.splitlines(keepends=True)
+    starts = []
+    seen = {}
+    previous_end = 0
+    for node in tree.body:
+        end_of_previous, previous_end = previous_end, node.end_lineno
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+        while start > end_of_previous and _is_filler(lines[start - 1]):
+            start -= 1
+        seen[node.name] = seen.get(node.name, 0) + 1
+        key = node.name if seen[node.name] == 1 else f"{node.name}#{seen[node.name]}"
+        starts.append((start, key))
+
+    blocks = []
+    if not starts or starts[0][0] > 0:
+        end = starts[0][0] if starts else len(lines)
+        blocks.append(Block("".join(lines[:end]), 1, HEADER))
+    for i, (start, key) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(lines)
+        blocks.append(Block("".join(lines[start:end]), start + 1, key))
+    return blocks
+
+
+def _joined(texts):
+    """Join block texts, each on its own lines"""
+    return "".join(text if not text or text.endswith("\n") else text + "\n" for text in texts)
+
+
+def align_outputs(blocks, output):
+    """The part of output that each input block became, or None when they cannot be matched.
+
+    Blocks are matched by name. New defs in the output go with the block
+    before them, a block missing from the output became nothing, and a run of
+    renamed blocks is matched in order when the counts agree.
+    """
+    output_blocks = split_blocks(output)
+    if output_blocks is None:
+        return None
+    owners = [None] * len(output_blocks)
+    removed = set()
+    matcher = SequenceMatcher(None, [b.key for b in blocks], [b.key for b in output_blocks], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal" or (tag == "replace" and i2 - i1 == j2 - j1):
+            for offset in range(j2 - j1):
+                owners[j1 + offset] = i1 + offset
+        elif tag == "delete":
+            removed.update(range(i1, i2))
+        elif tag == "insert":
+            for j in range(j1, j2):
+                owners[j] = max(i1 - 1, 0)
+        else:
+            return None
+    parts = [[] for _ in blocks]
+    for output_block, owner in zip(output_blocks, owners):
+        parts[owner].append(output_block.text)
+    if any(not part and i not in removed for i, part in enumerate(parts)):
+        return None
+    return ["".join(part) for part in parts]
+
+
+class IncrementalPlan:
+    """Which blocks of a file have a remembered answer and which runs of blocks must be sent"""
+
+    def __init__(self, source, blocks, outputs):
+        self.source = source
+        self.blocks = blocks
+        # Remembered answer per block, None for blocks to send
+        self.outputs = outputs
+        self.regions = []
+        start = None
+        for i, output in enumerate(outputs + [""]):
+            if output is None and start is None:
+                start = i
+            elif output is not None and start is not None:
+                self.regions.append((start, i))
+                start = None
+
+    def region_text(self, region):
+        start, end = region
+        return "".join(block.text for block in self.blocks[start:end])
+
+    @property
+    def changed_blocks(self):
+        return sum(end - start for start, end in self.regions)
+
+    @property
+    def changed_chars(self):
+        return sum(len(self.region_text(region)) for region in self.regions)
+
+    def merge(self, region_outputs):
+        """The whole answer: remembered blocks with the region answers in place of the changed ones"""
+        outputs = list(self.outputs)
+        for (start, end), text in zip(self.regions, region_outputs):
+            outputs[start] = text
+            for i in range(start + 1, end):
+                outputs[i] = ""
+        result = _joined(outputs)
+        if not self.source.endswith("\n") and result.endswith("\n"):
+            result = result[:-1]
+        return result
+
+
+def build_region_prompt(prompt_input, context, start_line, total_lines):
+    """Wrap the user's prompt for one changed region of a larger file"""
+    parts = [
+        prompt_input,
+        f"The code above is an excerpt (from line {start_line}) of a {total_lines}-line file; the rest of "
+        "the file already has these changes applied. Apply the changes that concern this excerpt and "
+        "return only this excerpt, complete, keeping its indentation.",
+    ]
+    if context:
+        parts.append(f"For reference, the whole file has these imports and definitions:\n{context}")
+    return "\n\n".join(parts)
+
+
+def block_cache_scope(service, config, prompt_input):
+    """Everything besides a block itself that shaped its answer"""
+    payload = json.dumps({"service": service, "config": config, "prompt": prompt_input}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class BlockCache:
+    """Answers for top-level blocks, keyed by the block's text and the request it was part of.
+
+    After a file has been answered, its blocks are matched with the blocks
+    of the answer (see align_outputs). When the same prompt is run on an
+    edited version, plan() finds the blocks that were not touched, so only
+    the changed ones need to be sent. In memory; bounded by max_blocks.
+    """
+
+    def __init__(self, max_blocks=INCREMENTAL_MAX_BLOCKS, min_chars=INCREMENTAL_MIN_CHARS,
+                 max_changed_ratio=INCREMENTAL_MAX_CHANGED_RATIO):
+        self.max_blocks = max_blocks
+        self.min_chars = min_chars
+        self.max_changed_ratio = max_changed_ratio
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.unaligned = 0
+        self.plans = 0
+        self.reused_blocks = 0
+        self.sent_blocks = 0
+        self.reused_chars = 0
+        self.sent_chars = 0
+
+    @staticmethod
+    def _key(scope, text):
+        return hashlib.sha256(f"{scope}\0{text}".encode("utf-8")).hexdigest()
+
+    def record(self, scope, source, output):
+        """Remember what each block of source became in output; returns the number of blocks stored"""
+        if len(source) < self.min_chars:
+            return 0
+        blocks = split_blocks(source)
+        outputs = align_outputs(blocks, output) if blocks is not None else None
+        if outputs is None:
+            with self._lock:
+                self.unaligned += 1
+            if LOGGING_ENABLED and blocks is not None:
+                logger.info("Could not match the blocks of the answer with its input; it is not reused")
+            return 0
+        with self._lock:
+            for block, block_output in zip(blocks, outputs):
+                key = self._key(scope, block.text)
+                self._blocks[key] = block_output
+                self._blocks.move_to_end(key)
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+            self.recorded += 1
+        return len(blocks)
+
+    def plan(self, scope, source):
+        """An IncrementalPlan when enough of source has remembered answers, else None"""
+        if len(source) < self.min_chars:
+            return None
+        blocks = split_blocks(source)
+        if blocks is None or len(blocks) < 2:
+            return None
+        with self._lock:
+            outputs = [self._blocks.get(self._key(scope, block.text)) for block in blocks]
+        if all(output is None for output in outputs):
+            return None
+        plan = IncrementalPlan(source, blocks, outputs)
+        if plan.changed_chars > len(source) * self.max_changed_ratio:
+            if LOGGING_ENABLED:
+                logger.info(
+                    "%s of %s chars changed since the last answer, sending the whole file",
+                    plan.changed_chars, len(source)
+                )
+            return None
+        with self._lock:
+            for block, output in zip(blocks, outputs):
+                if output is not None:
+                    self._blocks.move_to_end(self._key(scope, block.text))
+            self.plans += 1
+            self.reused_blocks += len(blocks) - plan.changed_blocks
+            self.sent_blocks += plan.changed_blocks
+            self.reused_chars += len(source) - plan.changed_chars
+            self.sent_chars += plan.changed_chars
+        return plan
+
+    def stats(self):
+        with self._lock:
+            return {
+                "blocks": len(self._blocks),
+                "recorded": self.recorded,
+                "unaligned": self.unaligned,
+                "plans": self.plans,
+                "reused_blocks": self.reused_blocks,
+                "sent_blocks": self.sent_blocks,
+                "reused_chars": self.reused_chars,
+                "sent_chars": self.sent_chars,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+def process_regions(process_fn, prompt_input, plan, max_workers=INCREMENTAL_MAX_WORKERS, progress=None):
+    """Send the plan's changed regions concurrently through process_fn(prompt, code) and merge the answers"""
+    if not plan.regions:
+        return plan.merge([])
+    context = build_context(plan.source)
+    total_lines = plan.source.count("\n") + 1
+    if LOGGING_ENABLED:
+        logger.info(
+            "Sending %s changed block(s) in %s region(s), %s of %s chars; reusing %s block(s)",
+            plan.changed_blocks, len(plan.regions), plan.changed_chars, len(plan.source),
+            len(plan.blocks) - plan.changed_blocks
+        )
+
+    outputs = [None] * len(plan.regions)
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(
+                # Regions log under the request id of the whole file
+                contextvars.copy_context().run,
+                process_fn,
+                build_region_prompt(prompt_input, context, plan.blocks[region[0]].start_line, total_lines),
+                plan.region_text(region)
+            ): index
+            for index, region in enumerate(plan.regions)
+        }
+        try:
+            for future in futures:
+                # The rest of the file is joined around the answer, so fences around it must go
+                index = futures[future]
+                outputs[index] = keep_spacing(plan.region_text(plan.regions[index]), strip_fences(future.result()))
+                done += 1
+                if progress:
+                    progress(done, len(plan.regions))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return plan.merge(outputs)
+
+
+_default_block_cache = None
+_default_block_cache_lock = threading.Lock()
+
+
+def get_default_block_cache():
+    """Process-wide block answers shared by every AIServiceProcessor"""
+    global _default_block_cache
+    with _default_block_cache_lock:
+        if _default_block_cache is None:
+            _default_block_cache = BlockCache()
+        return _default_block_cache
@@ -0,0 +1,455 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from config import LOGGING_ENABLED, OUTPUT_DIR
+from logging_setup import request_context
+
+JOB_QUEUE_DB_PATH = os.path.join(OUTPUT_DIR, "jobs.sqlite3")
+# Jobs of one provider running at the same time in a JobRunner
+JOB_CONCURRENCY = {"gemini": 2, "openai": 4, "local": 4}
+DEFAULT_JOB_CONCURRENCY = 2
+# A job interrupted this many times (crashes, kills) is failed instead of resumed again
+JOB_MAX_ATTEMPTS = 3
+# Finished jobs are deleted after this long
+JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60
+# GUI requests go ahead of batch jobs when both are waiting
+JOB_PRIORITY_INTERACTIVE = 10
+# How often a runner checks on jobs of its batch that another process is running
+JOB_WAIT_POLL_SECONDS = 0.5
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# A job belongs to its own batch and to the batches it was linked to as a duplicate
+IN_BATCH = "(batch_id = ? OR id IN (SELECT job_id FROM batch_jobs WHERE batch_id = ?))"
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+def _process_alive(pid):
+    if os.name == "nt":
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION; os.kill(pid, 0) would terminate the process on Windows
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def make_job_key(kind, service, payload):
+    """Identical requests share a key, so a second submit while the first is pending is a no-op"""
+    data = json.dumps({"kind": kind, "service": service, "payload": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def new_batch_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+class Job:
+    """One row of the job table"""
+
+    COLUMNS = (
+        "id", "kind", "service", "state", "priority", "payload", "result", "error", "attempts",
+        "batch_id", "owner", "created", "started", "finished"
+    )
+
+    def __init__(self, row):
+        for name, value in zip(self.COLUMNS, row):
+            setattr(self, name, value)
+        self.payload = json.loads(self.payload)
+
+    @property
+    def finished_state(self):
+        return self.state in FINISHED_STATES
+
+    @property
+    def latency(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.kind}, {self.service}, {self.state})"
+
+
+class JobQueue:
+    """Durable job queue in a sqlite file.
+
+    Jobs move pending -> running -> done/failed/cancelled. A running job
+    records the process that claimed it; when that process is gone (crash,
+    kill, lost power) recover() puts the job back to pending, so it is run
+    again on restart while finished jobs are not. Several processes (the GUI
+    and batch runs) can share one database.
+    """
+
+    def __init__(self, db_path=JOB_QUEUE_DB_PATH, retention=JOB_RETENTION_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.retention = retention
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # Autocommit; multi-statement changes use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, service TEXT NOT NULL, "
+            "state TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, payload TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, batch_id TEXT, owner TEXT, "
+            "created REAL NOT NULL, started REAL, finished REAL, job_key TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, service, priority DESC, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+        # Batches that submitted a job which was already queued by another batch
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_jobs (batch_id TEXT NOT NULL, job_id INTEGER NOT NULL, "
+            "PRIMARY KEY (batch_id, job_id))"
+        )
+        # At most one unfinished job per key
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS jobs_key ON jobs (job_key) WHERE state IN ('pending', 'running')"
+        )
+        self.recover()
+        self.prune()
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _select(self, where="", params=()):
+        query = f"SELECT {', '.join(Job.COLUMNS)} FROM jobs {where}"
+        with self._lock:
+            return [Job(row) for row in self._conn.execute(query, params).fetchall()]
+
+    def submit(self, service, payload, kind="edit", priority=0, batch_id=None):
+        """Add a job; returns (job_id, created).
+
+        If an identical job is already pending or running its id is returned
+        with created=False. The job stays in the batch that created it and is
+        linked to the given batch too; a pending one gets the higher priority.
+        """
+        key = make_job_key(kind, service, payload)
+
+        def work():
+            row = self._conn.execute(
+                "SELECT id, state, batch_id FROM jobs WHERE job_key = ? AND state IN (?, ?)", (key, PENDING, RUNNING)
+            ).fetchone()
+            if row is not None:
+                job_id, state, job_batch = row
+                if state == PENDING:
+                    self._conn.execute("UPDATE jobs SET priority = MAX(priority, ?) WHERE id = ?", (priority, job_id))
+                if batch_id is not None and batch_id != job_batch:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO batch_jobs (batch_id, job_id) VALUES (?, ?)", (batch_id, job_id)
+                    )
+                return job_id, False
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, service, state, priority, payload, batch_id, created, job_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, service, PENDING, priority, json.dumps(payload), batch_id, time.time(), key)
+            )
+            return cursor.lastrowid, True
+
+        job_id, created = self._transaction(work)
+        if LOGGING_ENABLED and not created:
+            logger.info("Job %s for %s is already queued; not adding a duplicate", job_id, service)
+        return job_id, created
+
+    def claim(self, service=None, batch_id=None):
+        """Mark the highest-priority pending job as running by this process and return it"""
+        conditions = ["state = ?"]
+        params = [PENDING]
+        if service is not None:
+            conditions.append("service = ?")
+            params.append(service)
+        if batch_id is not None:
+            conditions.append(IN_BATCH)
+            params.extend((batch_id, batch_id))
+
+        def work():
+            row = self._conn.execute(
+                f"SELECT id FROM jobs WHERE {' AND '.join(conditions)} ORDER BY priority DESC, id LIMIT 1", params
+            ).fetchone()
+            if row is None:
+                return None
+            self._mark_running(row[0])
+            return row[0]
+
+        job_id = self._transaction(work)
+        return self.get(job_id) if job_id is not None else None
+
+    def start(self, job_id):
+        """Claim a specific pending job; False if it is not pending any more"""
+        def work():
+            row = self._conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[0] != PENDING:
+                return False
+            self._mark_running(job_id)
+            return True
+
+        return self._transaction(work)
+
+    def _mark_running(self, job_id):
+        self._conn.execute(
+            "UPDATE jobs SET state = ?, owner = ?, started = ?, attempts = attempts + 1 WHERE id = ?",
+            (RUNNING, self.owner, time.time(), job_id)
+        )
+
+    def _finish(self, job_id, state, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, finished = ?, owner = NULL WHERE id = ?",
+                (state, result, error, time.time(), job_id)
+            )
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=error)
+
+    def cancel(self, job_id):
+        """Cancel a job that has not finished; a running job's worker has to be stopped separately"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, finished = ?, owner = NULL WHERE id = ? AND state IN (?, ?)",
+                (CANCELLED, time.time(), job_id, PENDING, RUNNING)
+            )
+
+    def release(self, job_id):
+        """Put an interrupted job back in the queue without counting the attempt"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, started = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE id = ? AND state = ?",
+                (PENDING, job_id, RUNNING)
+            )
+
+    def retry_failed(self, batch_id):
+        """Queue a batch's failed and cancelled jobs again; returns how many"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = ?, error = NULL, attempts = 0, started = NULL, finished = NULL "
+                f"WHERE {IN_BATCH} AND state IN (?, ?)",
+                (PENDING, batch_id, batch_id, FAILED, CANCELLED)
+            )
+            return cursor.rowcount
+
+    def recover(self):
+        """Requeue running jobs whose process has died; returns how many were requeued"""
+        host = socket.gethostname()
+        requeued = 0
+        for job in self._select("WHERE state = ?", (RUNNING,)):
+            owner_host, _, pid = (job.owner or "").rpartition(":")
+            if owner_host != host or not pid.isdigit() or _process_alive(int(pid)):
+                continue
+            if job.attempts >= self.max_attempts:
+                self._finish(job.id, FAILED, error=f"Interrupted {job.attempts} times")
+            else:
+                with self._lock:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = ?, owner = NULL, started = NULL WHERE id = ? AND state = ?",
+                        (PENDING, job.id, RUNNING)
+                    )
+                requeued += 1
+        if LOGGING_ENABLED and requeued:
+            logger.info("Requeued %s interrupted job(s) from %s", requeued, self.db_path)
+        return requeued
+
+    def prune(self):
+        if self.retention is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE state IN ({', '.join('?' * len(FINISHED_STATES))}) AND finished < ?",
+                (*FINISHED_STATES, time.time() - self.retention)
+            )
+            self._conn.execute("DELETE FROM batch_jobs WHERE job_id NOT IN (SELECT id FROM jobs)")
+
+    def get(self, job_id):
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def jobs(self, batch_id=None, state=None, kind=None):
+        conditions = []
+        params = []
+        if batch_id is not None:
+            conditions.append(IN_BATCH)
+            params.extend((batch_id, batch_id))
+        for column, value in (("state", state), ("kind", kind)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return self._select(where + "ORDER BY priority DESC, id", params)
+
+    def counts(self, batch_id=None):
+        """{state: number of jobs}, optionally for one batch"""
+        query = "SELECT state, COUNT(*) FROM jobs"
+        params = ()
+        if batch_id is not None:
+            query += f" WHERE {IN_BATCH}"
+            params = (batch_id, batch_id)
+        with self._lock:
+            return dict(self._conn.execute(query + " GROUP BY state", params).fetchall())
+
+    def batches(self):
+        """[(batch_id, {state: count})] with the most recent batch first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT batch_id, state, COUNT(*), MAX(created) FROM ("
+                "SELECT batch_id, state, created FROM jobs WHERE batch_id IS NOT NULL UNION ALL "
+                "SELECT links.batch_id, jobs.state, jobs.created FROM batch_jobs AS links "
+                "JOIN jobs ON jobs.id = links.job_id"
+                ") GROUP BY batch_id, state"
+            ).fetchall()
+        batches = {}
+        latest = {}
+        for batch_id, state, count, created in rows:
+            batches.setdefault(batch_id, {})[state] = count
+            latest[batch_id] = max(latest.get(batch_id, 0), created)
+        return sorted(batches.items(), key=lambda item: latest[item[0]], reverse=True)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobRunner:
+    """Run a batch's pending jobs on threads, with a concurrency limit per provider.
+
+    handler(job, cancel_event) does the work and returns the result text;
+    an exception fails the job. After stop() the jobs still running are put
+    back to pending, so the next run picks them up.
+    """
+
+    def __init__(self, job_queue, handler, batch_id, concurrency=None, on_finished=None):
+        self.job_queue = job_queue
+        self.handler = handler
+        self.batch_id = batch_id
+        self.concurrency = dict(JOB_CONCURRENCY, **(concurrency or {}))
+        self.on_finished = on_finished
+        self.cancel_event = threading.Event()
+
+    def stop(self):
+        self.cancel_event.set()
+
+    def _work(self, service):
+        while not self.cancel_event.is_set():
+            job = self.job_queue.claim(service, self.batch_id)
+            if job is None:
+                return
+            try:
+                with request_context(f"job-{job.id}"):
+                    result = self.handler(job, self.cancel_event)
+            except Exception as e:
+                if self.cancel_event.is_set():
+                    self.job_queue.release(job.id)
+                    return
+                self.job_queue.fail(job.id, str(e))
+            else:
+                self.job_queue.complete(job.id, result)
+            if self.on_finished is not None:
+                self.on_finished(self.job_queue.get(job.id))
+
+    def run(self):
+        """Block until every job of the batch has finished (or stop() is called).
+
+        Jobs the batch shares with another one (see JobQueue.submit) may be
+        running in another process; they are waited for, and run here if that
+        process dies.
+        """
+        while True:
+            self._run_pending()
+            if self.cancel_event.is_set():
+                return
+            self.job_queue.recover()
+            if self.job_queue.jobs(batch_id=self.batch_id, state=PENDING):
+                continue
+            if not self.job_queue.jobs(batch_id=self.batch_id, state=RUNNING):
+                return
+            try:
+                self.cancel_event.wait(JOB_WAIT_POLL_SECONDS)
+            except KeyboardInterrupt:
+                self.stop()
+                raise
+
+    def _run_pending(self):
+        services = sorted({job.service for job in self.job_queue.jobs(batch_id=self.batch_id, state=PENDING)})
+        threads = []
+        for service in services:
+            for index in range(max(1, self.concurrency.get(service, DEFAULT_JOB_CONCURRENCY))):
+                thread = threading.Thread(target=self._work, args=(service,), name=f"job-{service}-{index}", daemon=True)
+                thread.start()
+                threads.append(thread)
+        try:
+            for thread in threads:
+                # Short joins keep the main thread responsive to Ctrl+C
+                while thread.is_alive():
+                    thread.join(0.2)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the persistent job queue")
+    parser.add_argument("--db", default=JOB_QUEUE_DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="List jobs")
+    list_parser.add_argument("--batch")
+    list_parser.add_argument("--state", choices=(PENDING, RUNNING, DONE, FAILED, CANCELLED))
+    commands.add_parser("batches", help="List batches and their job counts")
+    cancel_parser = commands.add_parser("cancel", help="Cancel pending jobs of a batch")
+    cancel_parser.add_argument("batch")
+    args = parser.parse_args(argv)
+
+    job_queue = JobQueue(args.db)
+    if args.command == "list":
+        for job in job_queue.jobs(batch_id=args.batch, state=args.state):
+            label = job.payload.get("path") or job.payload.get("filename") or ""
+            error = f"  {job.error}" if job.error else ""
+            print(f"{job.id:>6} {job.state:<9} {job.service:<7} {job.kind:<5} {job.batch_id or '-':<22} {label}{error}")
+    elif args.command == "batches":
+        for batch_id, counts in job_queue.batches():
+            print(f"{batch_id:<22} " + "  ".join(f"{state}: {count}" for state, count in sorted(counts.items())))
+    else:
+        for job in job_queue.jobs(batch_id=args.batch, state=PENDING):
+            job_queue.cancel(job.id)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
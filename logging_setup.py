@@ -0,0 +1,131 @@
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from config import DEBUG_MODE, LOGGING_ENABLED, LOG_FILE_PATH
+
+# The log file is rotated at this size, keeping LOG_BACKUP_COUNT old files
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Ties every log line of one request together, from the GUI action to the provider call
+_request_id = contextvars.ContextVar("request_id", default=None)
+_request_counter = itertools.count(1)
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+# Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def new_request_id(prefix="req"):
+    return f"{prefix}-{os.getpid()}-{next(_request_counter)}"
+
+
+@contextmanager
+def request_context(request_id=None):
+    """Run a block with a request id; without one, keep the current id or make a new one"""
+    if request_id is None and _request_id.get() is not None:
+        yield _request_id.get()
+        return
+    token = _request_id.set(request_id or new_request_id())
+    try:
+        yield _request_id.get()
+    finally:
+        _request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the request id while still on the thread that logged them"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() merges args into the message and renders tracebacks
+    on the calling thread. The queue never leaves the process, so the record
+    can be passed on as it is.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, path=LOG_FILE_PATH):
+    """Send all logging through a queue to a rotating JSON-lines file; safe to call more than once.
+
+    Callers only enqueue records. A listener thread formats and writes them,
+    so file I/O and message formatting stay off the GUI and request threads.
+    """
+    global _listener, _queue_handler
+    if not LOGGING_ENABLED:
+        return
+    with _configure_lock:
+        if _listener is not None:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        records = queue.SimpleQueue()
+        _queue_handler = DeferredQueueHandler(records)
+        _queue_handler.addFilter(RequestIdFilter())
+
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(level if level is not None else logging.DEBUG if DEBUG_MODE else logging.INFO)
+        _listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out queued records and stop the listener thread"""
+    global _listener, _queue_handler
+    with _configure_lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _queue_handler = None
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
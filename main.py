@@ -1,22 +1,53 @@
 import sys
 import os
 import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QTextEdit, QPushButton, QRadioButton, QButtonGroup, QLabel,
-    QGroupBox, QMessageBox, QFileDialog, QStyleFactory
+    QGroupBox, QMessageBox, QFileDialog, QStyleFactory, QCheckBox, QProgressBar
 )
-from PyQt6.QtCore import Qt
-from ai_service import AIServiceProcessor
+from PyQt6.QtCore import Qt, QThreadPool, QTimer
+from PyQt6.QtGui import QTextCursor
+from ai_service import AIServiceProcessor, MultiProviderDispatcher
+from workers import (
+    ClientWarmUpWorker, FanOutWorker, FileLoadWorker, FileSaveWorker, ProcessWorker, ProjectIndexWorker
+)
+from chunking import needs_chunking
+from client_registry import clear_clients
+from code_editor import CodeEditor
+from diff_view import CompareDialog, DiffDialog
+from history import HistoryStore
+from history_view import HistoryDialog
+from incremental import INCREMENTAL_ENABLED, get_default_block_cache
+from metrics import get_default_metrics
+from metrics_panel import MetricsPanel
+from job_queue import JOB_PRIORITY_INTERACTIVE, PENDING, JobQueue
+from logging_setup import configure_logging
+from patching import EDIT_MODE_DIFF, EDIT_MODE_FULL
+from project_index import INDEX_EXTENSIONS, attach_context, get_project_index
+from prompt_cache import get_default_prompt_cache
+from providers import available_providers, get_provider_class
+from speculation import SPECULATION_DEBOUNCE_MS, SPECULATION_ENABLED, Speculator
+from validation import VALIDATION_ENABLED, VALIDATION_TEST_COMMAND, Validator
 import logging
+import sqlite3
 from config import (
     LOGGING_ENABLED,
-    LOG_FILE_PATH,
-    OUTPUT_DIR,
-    DEBUG_MODE
+    OUTPUT_DIR
 )
 from datetime import datetime
 
+# Requests are queued and run one at a time so results arrive in submission order
+MAX_CONCURRENT_REQUESTS = 1
+# Streamed chunks are buffered and appended to the output pane at most this often
+STREAM_FLUSH_INTERVAL_MS = 50
+# Characters of a loading file inserted per event loop turn, so the window stays responsive
+FILE_INSERT_CHARS = 64 * 1024
+# Services that Race and Compare send every request to
+RACE_SERVICES = ("gemini", "openai")
+
 # Environment check and setup
 def check_display():
     """Check if running in X11/Wayland environment and configure accordingly"""
@@ -38,11 +69,62 @@ class AIGUI(QMainWindow):
         self.headless = headless
         self.setWindowTitle("AI Code Assistant")
         
-        # Initialize AI Service
+        # Initialize AI Service; the SDK itself is set up in the background after the first paint
         self.current_service = "gemini"  # default service
-        self.ai_processor = AIServiceProcessor(service=self.current_service)
+        self.current_file_path = None
+        # Encoding and line endings of the loaded file, reused when saving
+        self.current_file_info = None
+        self.last_input_content = None
+        self.ai_processor = AIServiceProcessor(service=self.current_service, lazy=True)
+        self.processors = {self.current_service: self.ai_processor}
+        self.warm_up_started = False
+        # None for a single service, otherwise FanOutWorker.RACE or FanOutWorker.COMPARE
+        self.dispatch_mode = None
+        self.dispatcher = None
+        self.warm_up_workers = []
+        
+        # Background request pipeline
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(MAX_CONCURRENT_REQUESTS)
+        self.active_workers = {}
+        self.next_request_id = 1
+        
+        # Streaming output is batched so the output pane is not re-laid out per token
+        self.stream_request_id = None
+        self.stream_buffer = []
+        self.stream_flush_timer = QTimer(self)
+        self.stream_flush_timer.setInterval(STREAM_FLUSH_INTERVAL_MS)
+        self.stream_flush_timer.timeout.connect(self.flush_stream_buffer)
+        
+        # Files are read and written on pool threads; the editor fills in as chunks arrive
+        self.file_load_worker = None
+        self.file_load_pending = []
+        self.file_load_done = False
+        self.file_insert_timer = QTimer(self)
+        self.file_insert_timer.setInterval(0)
+        self.file_insert_timer.timeout.connect(self.insert_file_text)
+        self.file_save_workers = {}
+        self.next_file_job_id = 1
+        
+        # Project mode: definitions from other files of the workspace folder are attached to prompts
+        self.project_index = None
+        self.project_index_worker = None
+        self.last_validation = None
+        
+        # Optional: send the request in the background once the prompt stops changing
+        self.speculator = Speculator()
+        self.speculation_timer = QTimer(self)
+        self.speculation_timer.setSingleShot(True)
+        self.speculation_timer.setInterval(SPECULATION_DEBOUNCE_MS)
+        self.speculation_timer.timeout.connect(self.speculate)
         
         self.setup_logging()
+        # Requests are recorded in the persistent job queue so they can be resumed after a crash
+        self.job_queue = self.open_job_queue()
+        self.request_jobs = {}
+        # Every answer is kept in the session history; steps are written off the GUI thread, in order
+        self.history = self.open_history()
+        self.history_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
         self.setup_style()
         self.create_gui()
         
@@ -64,15 +146,52 @@ class AIGUI(QMainWindow):
     def setup_logging(self):
         """Setup logging configuration"""
         if LOGGING_ENABLED:
-            os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
             os.makedirs(OUTPUT_DIR, exist_ok=True)
-            logging.basicConfig(
-                filename=LOG_FILE_PATH,
-                level=logging.DEBUG if DEBUG_MODE else logging.INFO,
-                format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-            )
+            configure_logging()
             self.logger = logging.getLogger(__name__)
 
+    def open_job_queue(self):
+        try:
+            return JobQueue()
+        except (sqlite3.Error, OSError) as e:
+            # Requests still work, they are just not recorded
+            if LOGGING_ENABLED:
+                self.logger.warning("Job queue unavailable: %s", e)
+            return None
+
+    def open_history(self):
+        try:
+            return HistoryStore()
+        except (sqlite3.Error, OSError) as e:
+            if LOGGING_ENABLED:
+                self.logger.warning("History unavailable: %s", e)
+            return None
+
+    def record_history(self, prompt, input_content, output_text, provider, latency):
+        """Add a step to the session history in the background"""
+        if self.history is None:
+            return
+
+        def record():
+            try:
+                self.history.record(prompt, input_content, output_text, provider, latency, self.current_file_path)
+            except sqlite3.Error as e:
+                if LOGGING_ENABLED:
+                    self.logger.warning("Could not record history step: %s", e)
+
+        self.history_executor.submit(record)
+
+    def update_job(self, request_id, action, *args):
+        """Record a request's outcome on its job, if it has one"""
+        job_id = self.request_jobs.pop(request_id, None)
+        if job_id is None or self.job_queue is None:
+            return
+        try:
+            getattr(self.job_queue, action)(job_id, *args)
+        except sqlite3.Error as e:
+            if LOGGING_ENABLED:
+                self.logger.warning("Could not update job %s: %s", job_id, e)
+
     def create_gui(self):
         # Create central widget and main layout
         central_widget = QWidget()
@@ -85,20 +204,25 @@ class AIGUI(QMainWindow):
         service_layout = QHBoxLayout()
         
         self.service_button_group = QButtonGroup(self)
-        gemini_radio = QRadioButton("Gemini")
-        openai_radio = QRadioButton("OpenAI")
-        gemini_radio.setChecked(True)
-        
+        # One radio per registered provider; the service name rides along as a property
+        service_radios = []
+        for service in available_providers():
+            radio = QRadioButton(get_provider_class(service).display_name)
+            radio.setProperty("service", service)
+            radio.setChecked(service == self.current_service)
+            service_radios.append(radio)
+        race_radio = QRadioButton("Race")
+        race_radio.setToolTip("Send to both services and keep the first successful answer")
+        compare_radio = QRadioButton("Compare")
+        compare_radio.setToolTip("Send to both services and show the answers side by side")
+
         # Make radio buttons larger for easier remote interaction
-        for radio in (gemini_radio, openai_radio):
+        for button_id, radio in enumerate(service_radios + [race_radio, compare_radio], start=1):
             radio.setMinimumHeight(30)
-        
-        self.service_button_group.addButton(gemini_radio, 1)
-        self.service_button_group.addButton(openai_radio, 2)
+            self.service_button_group.addButton(radio, button_id)
+            service_layout.addWidget(radio)
         self.service_button_group.buttonClicked.connect(self.change_service)
-        
-        service_layout.addWidget(gemini_radio)
-        service_layout.addWidget(openai_radio)
+
         service_group.setLayout(service_layout)
         main_layout.addWidget(service_group)
         
@@ -106,7 +230,7 @@ class AIGUI(QMainWindow):
         code_group = QGroupBox("Original Code")
         code_layout = QVBoxLayout()
         
-        self.code_textbox = QTextEdit()
+        self.code_textbox = CodeEditor()
         self.code_textbox.setMinimumHeight(150)  # Ensure minimum height for remote viewing
         code_button_layout = QHBoxLayout()
         
@@ -114,8 +238,15 @@ class AIGUI(QMainWindow):
         load_button = self.create_button("Load Code", self.load_file)
         clear_code_button = self.create_button("Clear", self.code_textbox.clear)
         
+        open_project_button = self.create_button("Open Project", self.open_project)
+        self.project_context_checkbox = QCheckBox("Attach project context")
+        self.project_context_checkbox.setToolTip("Send definitions from other project files that the code uses")
+        self.project_context_checkbox.setEnabled(False)
+        
         code_button_layout.addWidget(load_button)
         code_button_layout.addWidget(clear_code_button)
+        code_button_layout.addWidget(open_project_button)
+        code_button_layout.addWidget(self.project_context_checkbox)
         
         code_layout.addWidget(self.code_textbox)
         code_layout.addLayout(code_button_layout)
@@ -128,35 +259,74 @@ class AIGUI(QMainWindow):
         self.prompt_textbox = QTextEdit()
         self.prompt_textbox.setMinimumHeight(80)
         self.prompt_textbox.setMaximumHeight(100)
+        self.prompt_textbox.textChanged.connect(self.on_input_changed)
+        self.code_textbox.textChanged.connect(self.on_input_changed)
         prompt_layout.addWidget(self.prompt_textbox)
+        self.speculation_checkbox = QCheckBox("Prefetch while typing (may send requests you do not use)")
+        self.speculation_checkbox.setChecked(SPECULATION_ENABLED)
+        self.speculation_checkbox.toggled.connect(self.on_speculation_toggled)
+        prompt_layout.addWidget(self.speculation_checkbox)
         prompt_group.setLayout(prompt_layout)
         main_layout.addWidget(prompt_group)
         
-        # Process button
+        # Process and cancel buttons
+        process_button_layout = QHBoxLayout()
         process_button = self.create_button("Process", self.process_code)
         process_button.setMinimumHeight(40)  # Make process button larger
-        main_layout.addWidget(process_button)
+        self.cancel_button = self.create_button("Cancel", self.cancel_requests)
+        self.cancel_button.setMinimumHeight(40)
+        self.cancel_button.setEnabled(False)
+        self.diff_mode_checkbox = QCheckBox("Patch mode (model returns edits only)")
+        self.validate_checkbox = QCheckBox("Validate output")
+        self.validate_checkbox.setToolTip("Check that the answer compiles and lints (and passes tests if configured); "
+                                          "ask once more with the errors if not")
+        self.validate_checkbox.setChecked(VALIDATION_ENABLED)
+        self.incremental_checkbox = QCheckBox("Only resend changed code")
+        self.incremental_checkbox.setToolTip("When the same prompt is run again on edited code, send only the "
+                                             "functions and classes that changed and reuse the last answer for the rest")
+        self.incremental_checkbox.setChecked(INCREMENTAL_ENABLED)
+        process_button_layout.addWidget(process_button, 3)
+        process_button_layout.addWidget(self.cancel_button, 1)
+        process_button_layout.addWidget(self.diff_mode_checkbox)
+        process_button_layout.addWidget(self.validate_checkbox)
+        process_button_layout.addWidget(self.incremental_checkbox)
+        main_layout.addLayout(process_button_layout)
         
         # Output section
         output_group = QGroupBox("Modified Code")
         output_layout = QVBoxLayout()
         
-        self.output_textbox = QTextEdit()
+        self.output_textbox = CodeEditor()
         self.output_textbox.setMinimumHeight(150)
         output_button_layout = QHBoxLayout()
         
         save_button = self.create_button("Save Code", self.save_file)
         clear_output_button = self.create_button("Clear", self.output_textbox.clear)
         copy_to_input_button = self.create_button("Copy to Input", self.copy_to_input)
+        show_diff_button = self.create_button("Show Diff", self.show_diff)
+        history_button = self.create_button("History", self.show_history)
+        history_button.setEnabled(self.history is not None)
         
         output_button_layout.addWidget(save_button)
         output_button_layout.addWidget(clear_output_button)
         output_button_layout.addWidget(copy_to_input_button)
+        output_button_layout.addWidget(show_diff_button)
+        output_button_layout.addWidget(history_button)
         
         output_layout.addWidget(self.output_textbox)
         output_layout.addLayout(output_button_layout)
         output_group.setLayout(output_layout)
         main_layout.addWidget(output_group)
+        
+        # Latency and throughput per provider, refreshed as requests finish
+        self.metrics_panel = MetricsPanel(get_default_metrics())
+        main_layout.addWidget(self.metrics_panel)
+        
+        self.file_progress = QProgressBar()
+        self.file_progress.setMaximumWidth(200)
+        self.file_progress.setRange(0, 100)
+        self.file_progress.hide()
+        self.statusBar().addPermanentWidget(self.file_progress)
 
     def create_button(self, text, callback):
         """Create a button with standard remote-friendly settings"""
@@ -165,6 +335,59 @@ class AIGUI(QMainWindow):
         button.clicked.connect(callback)
         return button
 
+    def showEvent(self, event):
+        """Start client setup once the window is on screen"""
+        super().showEvent(event)
+        if not self.warm_up_started:
+            self.warm_up_started = True
+            # Deferred to the next event loop turn so the first paint is not delayed
+            QTimer.singleShot(0, lambda: self.warm_up_client(self.ai_processor))
+            if not self.headless:
+                QTimer.singleShot(0, self.offer_job_resume)
+
+    def offer_job_resume(self):
+        """Offer to run again the requests that were cut off when the app last exited"""
+        if self.job_queue is None:
+            return
+        try:
+            jobs = self.job_queue.jobs(state=PENDING, kind="edit")
+        except sqlite3.Error as e:
+            if LOGGING_ENABLED:
+                self.logger.warning("Could not read the job queue: %s", e)
+            return
+        if not jobs:
+            return
+        answer = QMessageBox.question(
+            self,
+            "Resume Requests",
+            f"{len(jobs)} request(s) did not finish last time. Run them again?"
+        )
+        for job in jobs:
+            if answer == QMessageBox.StandardButton.Yes:
+                self.start_edit_request(job.service, job.payload, job.id)
+            else:
+                self.job_queue.cancel(job.id)
+
+    def warm_up_client(self, processor):
+        """Set up a provider client on a background thread"""
+        worker = ClientWarmUpWorker(processor)
+        worker.signals.finished.connect(self.on_client_ready)
+        worker.signals.error.connect(self.on_client_error)
+        self.warm_up_workers.append(worker)
+        QThreadPool.globalInstance().start(worker)
+
+    def on_client_ready(self, service):
+        self.warm_up_workers = [w for w in self.warm_up_workers if w.processor.service != service]
+        if LOGGING_ENABLED:
+            self.logger.info("%s client ready", service)
+
+    def on_client_error(self, service, message):
+        self.warm_up_workers = [w for w in self.warm_up_workers if w.processor.service != service]
+        # Not fatal: the setup is retried, and reported, when a request is made
+        if LOGGING_ENABLED:
+            self.logger.warning("Background setup of %s client failed: %s", service, message)
+        self.statusBar().showMessage(f"Could not set up {service} client: {message}", 10000)
+
     def center_window(self):
         """Center the window on the screen"""
         try:
@@ -174,17 +397,21 @@ class AIGUI(QMainWindow):
             self.move(frame_geometry.topLeft())
         except Exception as e:
             if LOGGING_ENABLED:
-                self.logger.warning(f"Could not center window: {str(e)}")
+                self.logger.warning("Could not center window: %s", e)
 
     def change_service(self, button):
         """Change the AI service"""
-        new_service = "gemini" if button.text() == "Gemini" else "openai"
+        if button.text() in ("Race", "Compare"):
+            self.set_dispatch_mode(FanOutWorker.RACE if button.text() == "Race" else FanOutWorker.COMPARE)
+            return
+        self.dispatch_mode = None
+        new_service = button.property("service")
         if new_service != self.current_service:
             try:
-                self.ai_processor = AIServiceProcessor(service=new_service)
+                self.ai_processor = self.processor_for(new_service)
                 self.current_service = new_service
                 if LOGGING_ENABLED:
-                    self.logger.info(f"Switched to {new_service} service")
+                    self.logger.info("Switched to %s service", new_service)
                 QMessageBox.information(self, "Service Changed", f"Successfully switched to {new_service} service")
             except Exception as e:
                 error_msg = f"Error switching to {new_service} service: {str(e)}"
@@ -192,90 +419,553 @@ class AIGUI(QMainWindow):
                     self.logger.error(error_msg)
                 QMessageBox.critical(self, "Error", error_msg)
                 # Revert radio button selection
-                self.service_button_group.buttons()[0 if self.current_service == "gemini" else 1].setChecked(True)
+                for radio in self.service_button_group.buttons():
+                    if radio.property("service") == self.current_service:
+                        radio.setChecked(True)
+
+    def processor_for(self, service):
+        """Processors (and their pooled clients) are reused after first use"""
+        if service not in self.processors:
+            self.processors[service] = AIServiceProcessor(service=service, lazy=True)
+            self.warm_up_client(self.processors[service])
+        return self.processors[service]
+
+    def set_dispatch_mode(self, mode):
+        """Send requests to every service at once, sharing the per-service processors"""
+        for service in RACE_SERVICES:
+            self.processor_for(service)
+        if self.dispatcher is None:
+            self.dispatcher = MultiProviderDispatcher(services=RACE_SERVICES, processors=self.processors)
+        self.dispatch_mode = mode
+        if LOGGING_ENABLED:
+            self.logger.info("Switched to %s mode", mode)
+        self.statusBar().showMessage(f"{mode.capitalize()} mode: requests go to Gemini and OpenAI", 5000)
 
     def process_code(self):
-        """Process the code with selected AI service"""
+        """Queue the code for processing with the selected AI service"""
+        input_prompt = self.prompt_textbox.toPlainText().strip()
+        input_content = self.code_textbox.toPlainText().strip()
+        
+        if self.file_load_worker is not None:
+            QMessageBox.warning(self, "File Loading", "Please wait until the file has finished loading")
+            return
+        
+        if not input_prompt or not input_content:
+            QMessageBox.warning(self, "Input Required", "Please provide both code and modification prompt")
+            return
+        
+        if self.dispatch_mode is not None:
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            worker = FanOutWorker(
+                request_id,
+                self.dispatcher,
+                self.dispatch_mode,
+                self.request_prompt(input_prompt, input_content),
+                input_content
+            )
+            worker.signals.compared.connect(self.on_request_compared)
+            self.queue_worker(worker)
+            return
+        
+        payload = {
+            "prompt": self.request_prompt(input_prompt, input_content),
+            "content": input_content,
+            "edit_mode": self.edit_mode(),
+            "filename": self.current_file_path,
+        }
+        job_id = None
+        if self.job_queue is not None:
+            try:
+                job_id, created = self.job_queue.submit(self.current_service, payload, priority=JOB_PRIORITY_INTERACTIVE)
+            except sqlite3.Error as e:
+                if LOGGING_ENABLED:
+                    self.logger.warning("Could not record the request in the job queue: %s", e)
+            else:
+                if not created:
+                    self.statusBar().showMessage(f"The same request is already queued (job {job_id})", 5000)
+                    return
+        self.start_edit_request(self.current_service, payload, job_id)
+
+    def edit_mode(self):
+        return EDIT_MODE_DIFF if self.diff_mode_checkbox.isChecked() else EDIT_MODE_FULL
+
+    def on_input_changed(self):
+        """Restart the debounce; the request is only sent once the input has settled"""
+        if self.speculation_checkbox.isChecked():
+            self.speculation_timer.start()
+
+    def on_speculation_toggled(self, checked):
+        if checked:
+            self.speculation_timer.start()
+        else:
+            self.speculation_timer.stop()
+            self.speculator.cancel()
+
+    def open_project(self):
+        """Pick a workspace folder and index it in the background"""
+        folder = QFileDialog.getExistingDirectory(self, "Open Project")
+        if folder:
+            self.start_project_index(folder)
+
+    def start_project_index(self, folder):
+        if self.project_index_worker is not None:
+            return
         try:
-            input_prompt = self.prompt_textbox.toPlainText().strip()
-            input_content = self.code_textbox.toPlainText().strip()
-            
-            if not input_prompt or not input_content:
-                QMessageBox.warning(self, "Input Required", "Please provide both code and modification prompt")
-                return
-            
+            self.project_index = get_project_index(folder)
+        except (sqlite3.Error, OSError) as e:
+            QMessageBox.critical(self, "Error", f"Could not open the project index: {e}")
+            return
+        worker = ProjectIndexWorker(self.project_index)
+        worker.signals.progress.connect(self.on_project_index_progress)
+        worker.signals.finished.connect(self.on_project_indexed)
+        worker.signals.error.connect(self.on_project_index_error)
+        self.project_index_worker = worker
+        self.statusBar().showMessage(f"Indexing {folder}...")
+        QThreadPool.globalInstance().start(worker)
+
+    def on_project_index_progress(self, done, total):
+        self.statusBar().showMessage(f"Indexing project... {done}/{total} changed file(s)")
+
+    def on_project_indexed(self, counts):
+        self.project_index_worker = None
+        self.project_context_checkbox.setEnabled(True)
+        self.project_context_checkbox.setChecked(True)
+        self.statusBar().showMessage(
+            f"Indexed {counts['files']} file(s) in {counts['seconds']:.1f}s ({counts['changed']} changed)", 5000
+        )
+
+    def on_project_index_error(self, message):
+        self.project_index_worker = None
+        if LOGGING_ENABLED:
+            self.logger.error("Project indexing failed: %s", message)
+        self.statusBar().showMessage(f"Project indexing failed: {message}", 10000)
+
+    def request_prompt(self, input_prompt, input_content):
+        """The prompt as sent, with project context attached when project mode is on"""
+        if self.project_index is None or not self.project_context_checkbox.isChecked():
+            return input_prompt
+        try:
+            context = self.project_index.context_for(input_content, input_prompt, self.current_file_path)
+        except sqlite3.Error as e:
             if LOGGING_ENABLED:
-                self.logger.info("Processing code with prompt")
-            
-            # Show processing cursor
-            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
-            
-            # Process the code
-            output_text = self.ai_processor.process_text(input_prompt, input_content)
-            
-            # Update output textbox
+                self.logger.warning("Could not read the project index: %s", e)
+            return input_prompt
+        return attach_context(input_prompt, context)
+
+    def speculate(self):
+        """Send the current input in the background so Process can use the answer"""
+        if not self.speculation_checkbox.isChecked() or self.dispatch_mode is not None:
+            return
+        if self.file_load_worker is not None:
+            return
+        input_prompt = self.prompt_textbox.toPlainText().strip()
+        input_content = self.code_textbox.toPlainText().strip()
+        if len(input_prompt) < self.speculator.min_prompt_chars or not input_content:
+            return
+        input_prompt = self.request_prompt(input_prompt, input_content)
+        self.speculator.speculate(self.ai_processor, input_prompt, input_content, self.edit_mode())
+
+    def validator(self):
+        """Validator for the next request, or None; tests run against the open project"""
+        if not self.validate_checkbox.isChecked():
+            return None
+        project_root = self.project_index.root if self.project_index is not None else None
+        return Validator(test_command=VALIDATION_TEST_COMMAND, project_root=project_root)
+
+    def start_edit_request(self, service, payload, job_id=None):
+        """Queue a single-service request; job_id is the pending job that records it"""
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        if job_id is not None:
+            try:
+                if not self.job_queue.start(job_id):
+                    return
+                self.request_jobs[request_id] = job_id
+            except sqlite3.Error as e:
+                if LOGGING_ENABLED:
+                    self.logger.warning("Could not update job %s: %s", job_id, e)
+        
+        # Patch mode, large files and reruns that reuse blocks (see ProcessWorker.request) do not stream
+        edit_mode = payload["edit_mode"]
+        speculation = self.speculator.claim(service, payload["prompt"], payload["content"], edit_mode)
+        worker = ProcessWorker(
+            request_id,
+            self.processor_for(service),
+            payload["prompt"],
+            payload["content"],
+            stream=edit_mode == EDIT_MODE_FULL and not needs_chunking(payload["content"]),
+            filename=payload["filename"],
+            edit_mode=edit_mode,
+            speculation=speculation,
+            validator=self.validator(),
+            block_cache=get_default_block_cache() if self.incremental_checkbox.isChecked() else None
+        )
+        worker.signals.chunk.connect(self.on_request_chunk)
+        worker.signals.validated.connect(self.on_request_validated)
+        self.queue_worker(worker)
+
+    def queue_worker(self, worker):
+        """Connect a worker's common signals and queue it on the request pool"""
+        worker.signals.progress.connect(self.on_request_progress)
+        worker.signals.finished.connect(self.on_request_finished)
+        worker.signals.error.connect(self.on_request_error)
+        worker.signals.cancelled.connect(self.on_request_cancelled)
+        self.active_workers[worker.request_id] = worker
+        
+        if LOGGING_ENABLED:
+            self.logger.info("Queued request %s for %s", worker.request_id, self.dispatch_mode or self.current_service)
+        
+        self.thread_pool.start(worker)
+        self.update_request_status()
+
+    def cancel_requests(self):
+        """Cancel the in-flight request and everything still queued"""
+        for worker in self.active_workers.values():
+            worker.cancel()
+        if LOGGING_ENABLED:
+            self.logger.info("Cancelling %s request(s)", len(self.active_workers))
+        self.statusBar().showMessage("Cancelling...")
+
+    def update_request_status(self):
+        """Reflect the request queue in the status bar and Cancel button"""
+        pending = len(self.active_workers)
+        self.cancel_button.setEnabled(pending > 0)
+        if pending:
+            if QApplication.overrideCursor() is None:
+                QApplication.setOverrideCursor(Qt.CursorShape.BusyCursor)
+            self.statusBar().showMessage(f"Processing... ({pending} request(s) pending)")
+        else:
+            while QApplication.overrideCursor() is not None:
+                QApplication.restoreOverrideCursor()
+
+    def finish_request(self, request_id):
+        if request_id == self.stream_request_id:
+            self.flush_stream_buffer()
+            self.stream_flush_timer.stop()
+            self.stream_request_id = None
+        self.active_workers.pop(request_id, None)
+        self.update_request_status()
+        self.metrics_panel.refresh()
+
+    def on_request_chunk(self, request_id, text):
+        if request_id != self.stream_request_id:
+            # First chunk of a new response replaces the previous output
+            self.flush_stream_buffer()
+            self.stream_request_id = request_id
+            self.output_textbox.clear()
+            self.stream_flush_timer.start()
+        self.stream_buffer.append(text)
+
+    def flush_stream_buffer(self):
+        """Append buffered chunks to the output pane in a single edit"""
+        if not self.stream_buffer:
+            return
+        text = "".join(self.stream_buffer)
+        self.stream_buffer.clear()
+        cursor = QTextCursor(self.output_textbox.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(text)
+
+    def on_request_progress(self, request_id, message):
+        self.statusBar().showMessage(f"[{request_id}] {message}")
+
+    def on_request_finished(self, request_id, output_text):
+        if request_id != self.stream_request_id:
+            # Nothing was streamed (e.g. an empty response), show the result directly
             self.output_textbox.setPlainText(output_text)
-            
-            if LOGGING_ENABLED:
-                self.logger.info("Code processing completed successfully")
-            
-        except Exception as e:
-            error_msg = f"Error processing code: {str(e)}"
+        else:
+            self.flush_stream_buffer()
+            # Validation may have stripped fences or replaced the streamed answer with a fixed one
+            if self.output_textbox.toPlainText() != output_text:
+                self.output_textbox.setPlainText(output_text)
+        worker = self.active_workers.get(request_id)
+        if worker is not None:
+            self.last_input_content = worker.file_content
+            if hasattr(worker, "processor"):
+                provider, latency = worker.processor.service, time.perf_counter() - worker.queued_at
+            else:
+                # A FanOutWorker (race) has no single processor; the provider that answered first is recorded
+                provider, latency = worker.winner.service, worker.winner.latency
+            self.record_history(worker.prompt_input, worker.file_content, output_text, provider, latency)
+        self.update_job(request_id, "complete", output_text)
+        if LOGGING_ENABLED:
+            self.logger.info("Request %s completed successfully", request_id)
+        self.finish_request(request_id)
+        report, self.last_validation = self.last_validation, None
+        stats = self.ai_processor.cache_stats()
+        if report is not None and not report.ok:
+            self.statusBar().showMessage(f"Request {request_id} completed; output {report.summary()}", 15000)
+        elif stats:
+            self.statusBar().showMessage(
+                f"Request {request_id} completed (cache: {stats['hits']} hits, {stats['misses']} misses)", 5000
+            )
+        else:
+            self.statusBar().showMessage(f"Request {request_id} completed", 5000)
+
+    def on_request_validated(self, request_id, report):
+        if not report.checked:
+            return
+        if LOGGING_ENABLED:
+            self.logger.info("Request %s validation: %s", request_id, report.summary())
+        # Kept until the finished message replaces it; the failing output is still shown for the user to fix
+        self.last_validation = report
+
+    def on_request_compared(self, request_id, results):
+        worker = self.active_workers.get(request_id)
+        if worker is not None:
+            self.last_input_content = worker.file_content
+        self.finish_request(request_id)
+        summary = ", ".join(f"{r.service} {r.latency:.2f}s" if r.ok else f"{r.service} failed" for r in results)
+        if LOGGING_ENABLED:
+            self.logger.info("Request %s compared: %s", request_id, summary)
+        self.statusBar().showMessage(f"Request {request_id} compared: {summary}", 5000)
+        dialog = CompareDialog(results, self)
+        if dialog.exec() and dialog.selected_text is not None:
+            self.output_textbox.setPlainText(dialog.selected_text)
+            if worker is not None:
+                chosen = next(result for result in results if result.ok and result.text == dialog.selected_text)
+                self.record_history(
+                    worker.prompt_input, worker.file_content, dialog.selected_text, chosen.service, chosen.latency
+                )
+
+    def on_request_error(self, request_id, message):
+        error_msg = f"Error processing code: {message}"
+        if LOGGING_ENABLED:
+            self.logger.error(error_msg)
+        self.update_job(request_id, "fail", message)
+        self.finish_request(request_id)
+        self.statusBar().showMessage(f"Request {request_id} failed", 5000)
+        QMessageBox.critical(self, "Error", error_msg)
+
+    def on_request_cancelled(self, request_id):
+        if LOGGING_ENABLED:
+            self.logger.info("Request %s cancelled", request_id)
+        self.update_job(request_id, "cancel")
+        self.finish_request(request_id)
+        self.statusBar().showMessage(f"Request {request_id} cancelled", 5000)
+
+    def closeEvent(self, event):
+        """Cancel outstanding requests so the thread pool can drain on exit"""
+        for worker in self.active_workers.values():
+            worker.cancel()
+        # Their cancelled signals will not be delivered any more; closing is not a crash, so no resume offer
+        for request_id in list(self.request_jobs):
+            self.update_job(request_id, "cancel")
+        if self.file_load_worker is not None:
+            self.file_load_worker.cancel()
+        self.speculator.shutdown()
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown()
+        # Explicit provider caches (Gemini) are billed until they expire
+        get_default_prompt_cache().clear()
+        # Cancelled requests fail on their own; pooled connections are closed now instead of at exit
+        clear_clients()
+        # Let queued history steps reach the database
+        self.history_executor.shutdown(wait=True)
+        if self.history is not None:
+            self.history.close()
+        try:
+            # Keep the session's request metrics for later inspection
+            get_default_metrics().write_json()
+        except OSError as e:
             if LOGGING_ENABLED:
-                self.logger.error(error_msg)
-            QMessageBox.critical(self, "Error", error_msg)
-        finally:
-            # Reset cursor
-            QApplication.restoreOverrideCursor()
+                self.logger.warning("Could not write metrics: %s", e)
+        super().closeEvent(event)
 
     def load_file(self):
         """Load code from a file"""
-        try:
-            file_path, _ = QFileDialog.getOpenFileName(
-                self,
-                "Open File",
-                "",
-                "Python Files (*.py);;Text Files (*.txt);;All Files (*.*)"
-            )
-            if file_path:
-                with open(file_path, 'r') as file:
-                    file_content = file.read()
-                    self.code_textbox.setPlainText(file_content)
-                if LOGGING_ENABLED:
-                    self.logger.info(f"Loaded file: {file_path}")
-        except Exception as e:
-            error_msg = f"Error loading file: {str(e)}"
-            if LOGGING_ENABLED:
-                self.logger.error(error_msg)
-            QMessageBox.critical(self, "Error", error_msg)
+        file_path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Open File",
+            "",
+            "Python Files (*.py);;Text Files (*.txt);;All Files (*.*)"
+        )
+        if file_path:
+            self.start_file_load(file_path)
+
+    def start_file_load(self, file_path):
+        """Read a file in the background and show it progressively"""
+        if self.file_load_worker is not None:
+            self.file_load_worker.cancel()
+        worker = FileLoadWorker(self.next_file_job_id, file_path)
+        self.next_file_job_id += 1
+        worker.signals.info.connect(self.on_file_info)
+        worker.signals.chunk.connect(self.on_file_chunk)
+        worker.signals.progress.connect(self.on_file_progress)
+        worker.signals.finished.connect(self.on_file_loaded)
+        worker.signals.error.connect(self.on_file_load_error)
+        worker.signals.cancelled.connect(self.end_file_load)
+        self.file_load_worker = worker
+        self.file_load_pending = []
+        self.file_load_done = False
+
+        self.code_textbox.clear()
+        self.code_textbox.setReadOnly(True)
+        # Appending chunks would otherwise keep a second copy of the file on the undo stack
+        self.code_textbox.document().setUndoRedoEnabled(False)
+        self.file_progress.setValue(0)
+        self.file_progress.show()
+        self.statusBar().showMessage(f"Loading {os.path.basename(file_path)}...")
+        QThreadPool.globalInstance().start(worker)
+
+    def is_current_load(self, load_id):
+        return self.file_load_worker is not None and self.file_load_worker.load_id == load_id
+
+    def on_file_info(self, load_id, info):
+        if self.is_current_load(load_id):
+            self.file_load_worker.info = info
+
+    def on_file_chunk(self, load_id, text):
+        if not self.is_current_load(load_id):
+            return
+        self.file_load_pending.append([text, 0])
+        self.file_insert_timer.start()
+
+    def insert_file_text(self):
+        """Insert the next slice of a loading file; runs from a zero-interval timer"""
+        if not self.file_load_pending:
+            self.file_insert_timer.stop()
+            if self.file_load_done:
+                self.finish_file_load()
+            return
+        entry = self.file_load_pending[0]
+        text, offset = entry
+        cursor = QTextCursor(self.code_textbox.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(text[offset:offset + FILE_INSERT_CHARS])
+        entry[1] = offset + FILE_INSERT_CHARS
+        if entry[1] >= len(text):
+            self.file_load_pending.pop(0)
+            self.file_load_worker.chunk_consumed()
+
+    def on_file_progress(self, load_id, done, total):
+        if self.is_current_load(load_id) and total:
+            percent = done * 100 // total
+            self.file_progress.setValue(percent)
+            self.statusBar().showMessage(f"Loading {os.path.basename(self.file_load_worker.path)}... {percent}%")
+
+    def on_file_loaded(self, load_id):
+        if not self.is_current_load(load_id):
+            return
+        # The last chunks may still be waiting to be inserted
+        self.file_load_done = True
+        self.file_insert_timer.start()
+
+    def finish_file_load(self):
+        worker = self.file_load_worker
+        self.end_file_load(worker.load_id)
+        self.current_file_path = worker.path
+        self.current_file_info = worker.info
+        if LOGGING_ENABLED:
+            self.logger.info("Loaded file: %s (%s)", worker.path, worker.info)
+        self.statusBar().showMessage(
+            f"Loaded {os.path.basename(worker.path)} ({worker.info.size} bytes, {worker.info.encoding})", 5000
+        )
+
+    def on_file_load_error(self, load_id, message):
+        if not self.is_current_load(load_id):
+            return
+        self.end_file_load(load_id)
+        self.code_textbox.clear()
+        error_msg = f"Error loading file: {message}"
+        if LOGGING_ENABLED:
+            self.logger.error(error_msg)
+        QMessageBox.critical(self, "Error", error_msg)
+
+    def end_file_load(self, load_id):
+        if not self.is_current_load(load_id):
+            return
+        self.file_load_worker = None
+        self.file_load_pending = []
+        self.file_insert_timer.stop()
+        self.code_textbox.document().setUndoRedoEnabled(True)
+        self.code_textbox.setReadOnly(False)
+        self.file_progress.hide()
+        self.statusBar().clearMessage()
 
     def save_file(self):
         """Save modified code to a file"""
-        try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            default_filename = f"modified_code_{timestamp}.py"
-            file_path, _ = QFileDialog.getSaveFileName(
-                self,
-                "Save File",
-                default_filename,
-                "Python Files (*.py);;Text Files (*.txt);;All Files (*.*)"
-            )
-            if file_path:
-                with open(file_path, 'w') as file:
-                    file.write(self.output_textbox.toPlainText())
-                if LOGGING_ENABLED:
-                    self.logger.info(f"Saved file: {file_path}")
-                QMessageBox.information(self, "Success", "File saved successfully!")
-        except Exception as e:
-            error_msg = f"Error saving file: {str(e)}"
-            if LOGGING_ENABLED:
-                self.logger.error(error_msg)
-            QMessageBox.critical(self, "Error", error_msg)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        default_filename = f"modified_code_{timestamp}.py"
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Save File",
+            default_filename,
+            "Python Files (*.py);;Text Files (*.txt);;All Files (*.*)"
+        )
+        if not file_path:
+            return
+        info = self.current_file_info
+        worker = FileSaveWorker(
+            self.next_file_job_id,
+            file_path,
+            self.output_textbox.toPlainText(),
+            encoding=info.encoding if info is not None else "utf-8",
+            newline=info.newline if info is not None else None
+        )
+        self.next_file_job_id += 1
+        worker.signals.progress.connect(self.on_file_save_progress)
+        worker.signals.finished.connect(self.on_file_saved)
+        worker.signals.error.connect(self.on_file_save_error)
+        self.file_save_workers[worker.save_id] = worker
+        self.file_progress.setValue(0)
+        self.file_progress.show()
+        QThreadPool.globalInstance().start(worker)
+
+    def on_file_save_progress(self, save_id, done, total):
+        worker = self.file_save_workers.get(save_id)
+        if worker is not None and total:
+            self.file_progress.setValue(done * 100 // total)
+            self.statusBar().showMessage(f"Saving {os.path.basename(worker.path)}... {done * 100 // total}%")
+
+    def on_file_saved(self, save_id):
+        worker = self.file_save_workers.pop(save_id, None)
+        self.file_progress.hide()
+        if LOGGING_ENABLED:
+            self.logger.info("Saved file: %s", worker.path)
+        if self.project_index is not None:
+            rel_path = self.project_index.relative_path(worker.path)
+            if rel_path is not None and rel_path.endswith(INDEX_EXTENSIONS):
+                try:
+                    self.project_index.refresh([rel_path])
+                except sqlite3.Error as e:
+                    if LOGGING_ENABLED:
+                        self.logger.warning("Could not update the project index: %s", e)
+        self.statusBar().showMessage(f"Saved {os.path.basename(worker.path)}", 5000)
+        QMessageBox.information(self, "Success", "File saved successfully!")
+
+    def on_file_save_error(self, save_id, message):
+        self.file_save_workers.pop(save_id, None)
+        self.file_progress.hide()
+        error_msg = f"Error saving file: {message}"
+        if LOGGING_ENABLED:
+            self.logger.error(error_msg)
+        QMessageBox.critical(self, "Error", error_msg)
+
+    def show_diff(self):
+        """Show the last input and the modified code side by side"""
+        original = self.last_input_content
+        if original is None:
+            original = self.code_textbox.toPlainText()
+        DiffDialog(original, self.output_textbox.toPlainText(), self).exec()
+
+    def show_history(self):
+        """Browse the recorded requests and put an earlier input or output back"""
+        dialog = HistoryDialog(self.history, self)
+        if not dialog.exec() or dialog.restored is None:
+            return
+        input_content, output_text = dialog.restored
+        if input_content is not None:
+            self.code_textbox.setPlainText(input_content)
+            self.last_input_content = input_content
+        if output_text is not None:
+            self.output_textbox.setPlainText(output_text)
+        self.statusBar().showMessage("Restored from history", 5000)
 
     def copy_to_input(self):
         """Copy output code to input textbox"""
-        output_text = self.output_textbox.toPlainText()
-        self.code_textbox.setPlainText(output_text)
+        self.code_textbox.copy_from(self.output_textbox)
         if LOGGING_ENABLED:
             self.logger.info("Copied output to input")
 
@@ -298,7 +988,7 @@ def main():
         
         sys.exit(app.exec())
     except Exception as e:
-        logging.error(f"Application error: {str(e)}")
+        logging.error("Application error: %s", e)
         # Use print for headless environment
         print(f"Application error: {str(e)}")
         if has_display:
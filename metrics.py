@@ -0,0 +1,332 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from config import OUTPUT_DIR
+from token_budget import estimate_tokens
+
+# Percentiles are computed over the most recent spans of each provider
+METRICS_WINDOW = 1000
+METRICS_JSON_PATH = os.path.join(OUTPUT_DIR, "metrics.json")
+# Upper bounds (seconds) of the Prometheus latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _elapsed(start, end):
+    if start is None or end is None:
+        return None
+    return max(0.0, end - start)
+
+
+class RequestSpan:
+    """Timings, retries and sizes of one provider request, from queueing to the last token.
+
+    Timestamps are time.perf_counter() values; the properties turn them into durations.
+    finish() records the span in the metrics registry exactly once.
+    """
+
+    def __init__(self, service, kind="request", queued_at=None, metrics=None):
+        self.service = service
+        self.kind = kind
+        self.queued_at = queued_at if queued_at is not None else time.perf_counter()
+        self.started_at = None
+        self.prompt_built_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        self.connect = None
+        self.attempts = 0
+        self.input_tokens = None
+        self.output_tokens = None
+        # Input tokens the provider served from its prompt prefix cache (part of input_tokens)
+        self.cached_input_tokens = None
+        self.tokens_estimated = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cached = False
+        self.error = None
+        self.timestamp = None
+        self._metrics = metrics
+
+    def start(self):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+
+    def mark_prompt_built(self, prompt):
+        self.prompt_built_at = time.perf_counter()
+        self.bytes_in = len(prompt.encode("utf-8"))
+
+    def mark_attempt(self):
+        self.attempts += 1
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def finish(self, output=None, usage=None, error=None):
+        if self.finished_at is not None:
+            return
+        self.start()
+        self.finished_at = time.perf_counter()
+        self.timestamp = time.time()
+        usage = usage or {}
+        self.cached = self.cached or bool(usage.get("cached"))
+        self.connect = usage.get("connect_seconds", self.connect)
+        self.input_tokens = usage.get("input_tokens")
+        self.output_tokens = usage.get("output_tokens")
+        self.cached_input_tokens = usage.get("cached_input_tokens")
+        if self.input_tokens is None and "budget" in usage and not self.cached:
+            # Provider did not report usage; fall back to the count made when the prompt was budgeted
+            self.input_tokens = usage["budget"]["input_tokens"]
+            self.tokens_estimated = True
+        if output is not None:
+            self.bytes_out = len(output.encode("utf-8"))
+            if self.output_tokens is None and not self.cached:
+                self.output_tokens = estimate_tokens(output)
+                self.tokens_estimated = True
+        if isinstance(error, GeneratorExit):
+            # The consumer stopped reading a stream, e.g. the loser of a race
+            self.error = "RequestCancelled"
+        elif error is not None:
+            self.error = type(error).__name__
+        (self._metrics or get_default_metrics()).record(self)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def cancelled(self):
+        return self.error == "RequestCancelled"
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    @property
+    def queue_wait(self):
+        return _elapsed(self.queued_at, self.started_at)
+
+    @property
+    def prompt_build(self):
+        return _elapsed(self.started_at, self.prompt_built_at)
+
+    @property
+    def time_to_first_token(self):
+        return _elapsed(self.started_at, self.first_token_at)
+
+    @property
+    def total(self):
+        return _elapsed(self.started_at, self.finished_at)
+
+    @property
+    def tokens_per_second(self):
+        """Output tokens over generation time (after the first token when streaming)"""
+        if not self.output_tokens or self.cached:
+            return None
+        generating = _elapsed(self.first_token_at or self.prompt_built_at or self.started_at, self.finished_at)
+        if not generating:
+            return None
+        return self.output_tokens / generating
+
+    def as_dict(self):
+        return {
+            "service": self.service,
+            "kind": self.kind,
+            "timestamp": self.timestamp,
+            "ok": self.ok,
+            "error": self.error,
+            "cancelled": self.cancelled,
+            "cached": self.cached,
+            "queue_wait": self.queue_wait,
+            "prompt_build": self.prompt_build,
+            "connect": self.connect,
+            "time_to_first_token": self.time_to_first_token,
+            "total": self.total,
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+            "tokens_estimated": self.tokens_estimated,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "tokens_per_second": self.tokens_per_second,
+        }
+
+
+class Metrics:
+    """Thread-safe registry of finished request spans.
+
+    Counters cover the whole process lifetime; percentiles use the last
+    `window` spans per provider. Export with to_prometheus() or write_json().
+    """
+
+    COUNTERS = (
+        "requests", "errors", "cancelled", "cache_hits", "retries",
+        "input_tokens", "output_tokens", "cached_input_tokens", "bytes_in", "bytes_out",
+    )
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._totals = {}
+
+    def start_span(self, service, kind="request", queued_at=None):
+        return RequestSpan(service, kind, queued_at, metrics=self)
+
+    def record(self, span):
+        with self._lock:
+            spans = self._spans.setdefault(span.service, deque(maxlen=self.window))
+            spans.append(span)
+            totals = self._totals.setdefault(span.service, self._empty_totals())
+            totals["requests"] += 1
+            totals["errors"] += 0 if span.ok or span.cancelled else 1
+            totals["cancelled"] += 1 if span.cancelled else 0
+            totals["cache_hits"] += 1 if span.cached else 0
+            totals["retries"] += span.retries
+            totals["input_tokens"] += span.input_tokens or 0
+            totals["output_tokens"] += span.output_tokens or 0
+            totals["cached_input_tokens"] += span.cached_input_tokens or 0
+            totals["bytes_in"] += span.bytes_in
+            totals["bytes_out"] += span.bytes_out
+            if span.ok and not span.cached and span.total is not None:
+                totals["latency_sum"] += span.total
+                totals["latency_count"] += 1
+                for index, bound in enumerate(LATENCY_BUCKETS):
+                    if span.total <= bound:
+                        totals["latency_buckets"][index] += 1
+
+    @staticmethod
+    def _empty_totals():
+        totals = {name: 0 for name in Metrics.COUNTERS}
+        totals["latency_sum"] = 0.0
+        totals["latency_count"] = 0
+        totals["latency_buckets"] = [0] * len(LATENCY_BUCKETS)
+        return totals
+
+    def spans(self, service=None):
+        with self._lock:
+            if service is not None:
+                return list(self._spans.get(service, ()))
+            return [span for spans in self._spans.values() for span in spans]
+
+    def summary(self):
+        """Per-provider counters plus p50/p95 latency, time to first token and tokens/sec"""
+        with self._lock:
+            services = {service: (list(spans), dict(self._totals[service])) for service, spans in self._spans.items()}
+        result = {}
+        for service, (spans, totals) in services.items():
+            # Cache hits return instantly and would hide real provider latency
+            live = [span for span in spans if span.ok and not span.cached]
+            latencies = [span.total for span in live if span.total is not None]
+            first_tokens = [span.time_to_first_token for span in live if span.first_token_at is not None]
+            rates = [span.tokens_per_second for span in live if span.tokens_per_second]
+            queue_waits = [span.queue_wait for span in spans if span.queue_wait is not None]
+            result[service] = {
+                "requests": totals["requests"],
+                "errors": totals["errors"],
+                "cancelled": totals["cancelled"],
+                "error_rate": totals["errors"] / totals["requests"] if totals["requests"] else 0.0,
+                "cache_hits": totals["cache_hits"],
+                "retries": totals["retries"],
+                "input_tokens": totals["input_tokens"],
+                "output_tokens": totals["output_tokens"],
+                "cached_input_tokens": totals["cached_input_tokens"],
+                "bytes_in": totals["bytes_in"],
+                "bytes_out": totals["bytes_out"],
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "ttft_p50": percentile(first_tokens, 50),
+                "ttft_p95": percentile(first_tokens, 95),
+                "queue_wait_p95": percentile(queue_waits, 95),
+                "tokens_per_second": percentile(rates, 50),
+            }
+        return result
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            totals = {service: dict(values) for service, values in self._totals.items()}
+        summary = self.summary()
+        lines = []
+        for name in self.COUNTERS:
+            metric = f"promptide_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for service, values in sorted(totals.items()):
+                lines.append(f'{metric}{{service="{service}"}} {values[name]}')
+        lines.append("# TYPE promptide_request_seconds histogram")
+        for service, values in sorted(totals.items()):
+            for bound, count in zip(LATENCY_BUCKETS, values["latency_buckets"]):
+                lines.append(f'promptide_request_seconds_bucket{{service="{service}",le="{bound}"}} {count}')
+            lines.append(f'promptide_request_seconds_bucket{{service="{service}",le="+Inf"}} {values["latency_count"]}')
+            lines.append(f'promptide_request_seconds_sum{{service="{service}"}} {values["latency_sum"]:.6f}')
+            lines.append(f'promptide_request_seconds_count{{service="{service}"}} {values["latency_count"]}')
+        for name in ("ttft_p50", "ttft_p95", "tokens_per_second"):
+            metric = f"promptide_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for service, values in sorted(summary.items()):
+                lines.append(f'{metric}{{service="{service}"}} {values[name]:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def to_json(self, recent=100):
+        return {
+            "generated_at": time.time(),
+            "providers": self.summary(),
+            "recent": [span.as_dict() for span in self.spans()[-recent:]],
+        }
+
+    def write_json(self, path=METRICS_JSON_PATH):
+        """Atomically write to_json() to path"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(self.to_json(), file, indent=2)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return path
+
+    def write(self, path):
+        """Write Prometheus text for .prom/.txt paths, JSON otherwise"""
+        if path.endswith((".prom", ".txt")):
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(self.to_prometheus())
+            return path
+        return self.write_json(path)
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._totals.clear()
+
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def get_default_metrics():
+    """Process-wide registry that every AIServiceProcessor reports to"""
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
+
+
+def start_span(service, kind="request", queued_at=None):
+    return get_default_metrics().start_span(service, kind, queued_at)
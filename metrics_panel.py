@@ -0,0 +1,56 @@
+from PyQt6.QtWidgets import QGroupBox, QVBoxLayout, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView
+from PyQt6.QtCore import Qt
+
+
+class MetricsPanel(QGroupBox):
+    """Per-provider latency and throughput from a metrics.Metrics registry"""
+
+    COLUMNS = [
+        ("Provider", None),
+        ("Requests", "requests"),
+        ("Errors", "errors"),
+        ("Retries", "retries"),
+        ("p50", "latency_p50"),
+        ("p95", "latency_p95"),
+        ("First token p50", "ttft_p50"),
+        ("Tokens/s", "tokens_per_second"),
+        ("Tokens in/out", None),
+    ]
+
+    def __init__(self, metrics, parent=None):
+        super().__init__("Request Stats", parent)
+        self.metrics = metrics
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels([title for title, _ in self.COLUMNS])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setMaximumHeight(110)
+        layout.addWidget(self.table)
+
+    @staticmethod
+    def format_cell(key, value):
+        if key in ("latency_p50", "latency_p95", "ttft_p50"):
+            return f"{value:.2f}s" if value else "-"
+        if key == "tokens_per_second":
+            return f"{value:.0f}" if value else "-"
+        return str(value)
+
+    def refresh(self):
+        summary = self.metrics.summary()
+        self.table.setRowCount(len(summary))
+        for row, (service, stats) in enumerate(sorted(summary.items())):
+            for column, (_, key) in enumerate(self.COLUMNS):
+                if column == 0:
+                    text = service
+                elif key is None:
+                    text = f"{stats['input_tokens']}/{stats['output_tokens']}"
+                    if stats["cached_input_tokens"]:
+                        text += f" ({stats['cached_input_tokens']} cached)"
+                else:
+                    text = self.format_cell(key, stats[key])
+                item = QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                self.table.setItem(row, column, item)
@@ -0,0 +1,157 @@
+import re
+
+EDIT_MODE_FULL = "full"
+EDIT_MODE_DIFF = "diff"
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER_MARKER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+
+SEARCH_REPLACE_INSTRUCTIONS = f"""Do not return the whole file. Return only the edits, as one or more blocks in exactly this format:
+{SEARCH_MARKER}
+(lines copied exactly from the original code)
+{DIVIDER_MARKER}
+(the lines that replace them)
+{REPLACE_MARKER}
+Each SEARCH section must match the original code exactly, including indentation, and must be unique in the file.
+Return nothing except the blocks."""
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+FENCE = re.compile(r"^\s*```[\w+-]*\s*$")
+
+
+class PatchError(Exception):
+    """Raised when a model-produced patch cannot be applied cleanly"""
+
+
+def _strip_fences(text):
+    return "\n".join(line for line in text.split("\n") if not FENCE.match(line))
+
+
+def parse_search_replace(text):
+    """Return the (search, replace) pairs found in text"""
+    blocks = []
+    lines = _strip_fences(text).split("\n")
+    i = 0
+    while i < len(lines):
+        if lines[i].strip() != SEARCH_MARKER:
+            i += 1
+            continue
+        search, replace = [], []
+        i += 1
+        while i < len(lines) and lines[i].strip() != DIVIDER_MARKER:
+            search.append(lines[i])
+            i += 1
+        i += 1
+        while i < len(lines) and lines[i].strip() != REPLACE_MARKER:
+            replace.append(lines[i])
+            i += 1
+        if i >= len(lines):
+            raise PatchError("Unterminated SEARCH/REPLACE block")
+        blocks.append(("\n".join(search), "\n".join(replace)))
+        i += 1
+    return blocks
+
+
+def _find_lines(lines, needle, start_hint=0):
+    """Locate needle (a list of lines) in lines ignoring trailing whitespace; nearest to start_hint wins"""
+    if not needle:
+        return None
+    target = [line.rstrip() for line in needle]
+    matches = [
+        i for i in range(len(lines) - len(needle) + 1)
+        if [line.rstrip() for line in lines[i:i + len(needle)]] == target
+    ]
+    if not matches:
+        return None
+    return min(matches, key=lambda i: abs(i - start_hint))
+
+
+def apply_search_replace(source, blocks):
+    """Apply (search, replace) pairs in order; every search must match exactly once"""
+    result = source
+    for search, replace in blocks:
+        if not search.strip():
+            if result.strip():
+                raise PatchError("Empty SEARCH section for a non-empty file")
+            result = replace
+            continue
+        count = result.count(search)
+        if count == 1:
+            result = result.replace(search, replace, 1)
+            continue
+        if count > 1:
+            raise PatchError(f"SEARCH section matches {count} places: {search.splitlines()[0]!r}")
+        # Fall back to a line match that tolerates trailing whitespace differences
+        lines = result.split("\n")
+        index = _find_lines(lines, search.split("\n"))
+        if index is None:
+            raise PatchError(f"SEARCH section not found: {search.splitlines()[0]!r}")
+        lines[index:index + len(search.split("\n"))] = replace.split("\n")
+        result = "\n".join(lines)
+    return result
+
+
+def parse_unified_diff(text):
+    """Return hunks as (old_start, old_lines, new_lines) from a unified diff"""
+    hunks = []
+    current = None
+    for line in _strip_fences(text).split("\n"):
+        header = HUNK_HEADER.match(line)
+        if header:
+            current = (int(header.group(1)), [], [])
+            hunks.append(current)
+            continue
+        if current is None or line.startswith(("---", "+++")) and not current[1] and not current[2]:
+            continue
+        if line.startswith("\\"):
+            continue
+        tag, body = (line[0], line[1:]) if line else (" ", "")
+        if tag == " ":
+            current[1].append(body)
+            current[2].append(body)
+        elif tag == "-":
+            current[1].append(body)
+        elif tag == "+":
+            current[2].append(body)
+        else:
+            # Models sometimes drop the leading space on context lines
+            current[1].append(line)
+            current[2].append(line)
+    # Trailing blank lines after the last hunk are separators, not context
+    for _, old_lines, new_lines in hunks:
+        while old_lines and new_lines and old_lines[-1] == "" and new_lines[-1] == "":
+            old_lines.pop()
+            new_lines.pop()
+    return hunks
+
+
+def apply_unified_diff(source, diff_text):
+    hunks = parse_unified_diff(diff_text)
+    if not hunks:
+        raise PatchError("No hunks found in diff")
+    lines = source.split("\n")
+    offset = 0
+    for old_start, old_lines, new_lines in hunks:
+        hint = max(old_start - 1 + offset, 0)
+        if old_lines:
+            index = _find_lines(lines, old_lines, hint)
+            if index is None:
+                raise PatchError(f"Hunk at line {old_start} does not match the original code")
+        else:
+            index = min(hint, len(lines))
+        lines[index:index + len(old_lines)] = new_lines
+        offset += len(new_lines) - len(old_lines)
+    return "\n".join(lines)
+
+
+def apply_patch(source, response):
+    """Apply a model response containing SEARCH/REPLACE blocks or a unified diff"""
+    if SEARCH_MARKER in response:
+        blocks = parse_search_replace(response)
+        if not blocks:
+            raise PatchError("No SEARCH/REPLACE blocks found")
+        return apply_search_replace(source, blocks)
+    if re.search(r"^@@ ", response, re.MULTILINE):
+        return apply_unified_diff(source, response)
+    raise PatchError("Response contains no recognisable edits")
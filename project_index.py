@@ -0,0 +1,611 @@
+import argparse
+import ast
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from config import LOGGING_ENABLED, OUTPUT_DIR
+from file_io import read_text
+from token_budget import count_tokens
+
+# One index database per workspace folder, named after a hash of its path
+PROJECT_INDEX_DIR = os.path.join(OUTPUT_DIR, "project_index")
+# Directories never indexed (matched by name at any depth)
+INDEX_EXCLUDE_DIRS = {
+    ".git", ".hg", ".svn", "__pycache__", ".venv", "venv", "env", "node_modules", ".tox", ".nox",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache", "build", "dist", "site-packages",
+}
+INDEX_EXTENSIONS = (".py", ".pyi")
+# Larger files are usually generated; they are listed but not parsed
+INDEX_MAX_FILE_BYTES = 2 * 1024 * 1024
+# Changed files are parsed in worker processes once there are this many
+INDEX_PARALLEL_MIN_FILES = 200
+INDEX_PARSE_CHUNK = 64
+# Prompt space given to definitions from other files
+PROJECT_CONTEXT_MAX_TOKENS = 3000
+# Larger definitions are sent as an outline: signatures and docstrings only
+PROJECT_CONTEXT_SYMBOL_TOKENS = 600
+# A name only mentioned in the prompt is looked up across the project if it is this specific
+PROJECT_CONTEXT_MAX_NAME_MATCHES = 3
+PROJECT_CONTEXT_MAX_CALLERS = 5
+
+PROMPT_IDENTIFIER = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]{2,}\b")
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+def index_db_path(root):
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(PROJECT_INDEX_DIR, f"{digest}.sqlite3")
+
+
+def module_name(rel_path):
+    """Dotted module name of a path relative to the workspace root"""
+    parts = rel_path[:-len(os.path.splitext(rel_path)[1])].split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def resolve_import(module, level, current_module, is_package=False):
+    """Absolute module name of a (possibly relative) import"""
+    if not level:
+        return module or ""
+    base = current_module.split(".") if current_module else []
+    # "from . import x" in pkg/mod.py is relative to pkg; in pkg/__init__.py to pkg itself
+    drop = level - 1 if is_package else level
+    base = base[:len(base) - drop] if drop else base
+    return ".".join(part for part in base + [module or ""] if part)
+
+
+def extract_symbols(tree, current_module="", is_package=False):
+    """(symbols, imports, calls) of a parsed module.
+
+    symbols: (name, qualname, kind, lineno, end_lineno) for top-level functions,
+    classes, methods and module-level assignments.
+    imports: (module, name) pairs, name None for "import module".
+    calls: {name: first line} of called functions and methods.
+    """
+    symbols = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
+            start = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+            symbols.append((node.name, node.name, kind, start, node.end_lineno))
+            if kind == "class":
+                for item in node.body:
+                    if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        item_start = item.decorator_list[0].lineno if item.decorator_list else item.lineno
+                        symbols.append((item.name, f"{node.name}.{item.name}", "method", item_start, item.end_lineno))
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    symbols.append((target.id, target.id, "variable", node.lineno, node.end_lineno))
+
+    imports = []
+    calls = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend((alias.name, None) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = resolve_import(node.module, node.level, current_module, is_package)
+            imports.extend((module, alias.name) for alias in node.names)
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+            if name is not None and (name not in calls or node.lineno < calls[name]):
+                calls[name] = node.lineno
+    return symbols, imports, calls
+
+
+def _parse_file(task):
+    """Hash and parse one file; runs in worker processes.
+
+    Returns (rel_path, hash, parsed) where parsed is None when the file could
+    not be parsed and "unchanged" when its hash matches the indexed one.
+    """
+    root, rel_path, old_hash = task
+    try:
+        with open(os.path.join(root, rel_path), "rb") as file:
+            data = file.read()
+    except OSError:
+        return rel_path, None, None
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    if digest == old_hash:
+        return rel_path, digest, "unchanged"
+    if len(data) > INDEX_MAX_FILE_BYTES:
+        return rel_path, digest, None
+    try:
+        # Parsing the bytes lets Python apply the file's coding cookie or BOM
+        tree = ast.parse(data)
+    except (SyntaxError, ValueError):
+        return rel_path, digest, None
+    return rel_path, digest, extract_symbols(tree, module_name(rel_path), rel_path.endswith("__init__.py"))
+
+
+class Symbol:
+    """A definition found in the index"""
+
+    def __init__(self, path, module, name, qualname, kind, lineno, end_lineno):
+        self.path = path
+        self.module = module
+        self.name = name
+        self.qualname = qualname
+        self.kind = kind
+        self.lineno = lineno
+        self.end_lineno = end_lineno
+
+    def __repr__(self):
+        return f"Symbol({self.module}.{self.qualname}, {self.kind}, {self.path}:{self.lineno})"
+
+
+class ProjectIndex:
+    """Incremental on-disk index of the Python symbols of a workspace folder.
+
+    update() walks the folder and re-parses only files whose size or mtime
+    changed (and whose content hash differs), in worker processes when there
+    are many. Lookups go through sqlite indexes, so they stay fast on large
+    repositories. context_for() picks the definitions a piece of code uses
+    and renders them for the prompt.
+    """
+
+    def __init__(self, root, db_path=None):
+        self.root = os.path.abspath(root)
+        self.db_path = db_path or index_db_path(self.root)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, module TEXT NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, hash TEXT, parsed INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS files_module ON files (module);"
+            "CREATE TABLE IF NOT EXISTS symbols ("
+            "file_id INTEGER NOT NULL, name TEXT NOT NULL, qualname TEXT NOT NULL, kind TEXT NOT NULL, "
+            "lineno INTEGER NOT NULL, end_lineno INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);"
+            "CREATE INDEX IF NOT EXISTS symbols_file ON symbols (file_id);"
+            "CREATE TABLE IF NOT EXISTS imports (file_id INTEGER NOT NULL, module TEXT NOT NULL, name TEXT);"
+            "CREATE INDEX IF NOT EXISTS imports_file ON imports (file_id);"
+            "CREATE TABLE IF NOT EXISTS calls (file_id INTEGER NOT NULL, name TEXT NOT NULL, lineno INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS calls_name ON calls (name);"
+            "CREATE INDEX IF NOT EXISTS calls_file ON calls (file_id);"
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _walk(self):
+        """Yield (rel_path, stat) of every indexable file, using scandir to avoid extra stat calls"""
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                entries = os.scandir(os.path.join(self.root, rel_dir))
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in INDEX_EXCLUDE_DIRS and not entry.name.endswith(".egg-info"):
+                                stack.append(rel_path)
+                        elif entry.name.endswith(INDEX_EXTENSIONS) and entry.is_file():
+                            yield rel_path, entry.stat()
+                    except OSError:
+                        continue
+
+    def update(self, progress=None, parallel=None):
+        """Bring the index up to date with the folder; returns counts of what changed.
+
+        progress(done, total) is called as changed files are parsed.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            stored = {
+                row[0]: row[1:]
+                for row in self._conn.execute("SELECT path, mtime_ns, size, hash FROM files")
+            }
+        seen = {}
+        changed = []
+        for rel_path, stat in self._walk():
+            seen[rel_path] = stat
+            old = stored.get(rel_path)
+            if old is None or old[0] != stat.st_mtime_ns or old[1] != stat.st_size:
+                changed.append((self.root, rel_path, old[2] if old is not None else None))
+        deleted = [path for path in stored if path not in seen]
+
+        parsed = self._parse_all(changed, progress, parallel)
+        self._store(parsed, seen, deleted)
+        counts = {
+            "files": len(seen),
+            "changed": sum(1 for _, _, result in parsed if result != "unchanged"),
+            "deleted": len(deleted),
+            "seconds": time.perf_counter() - started,
+        }
+        if LOGGING_ENABLED:
+            logger.info(
+                "Indexed %s: %s file(s), %s changed, %s deleted in %.2fs",
+                self.root, counts["files"], counts["changed"], counts["deleted"], counts["seconds"]
+            )
+        return counts
+
+    def _parse_all(self, tasks, progress=None, parallel=None):
+        parallel = len(tasks) >= INDEX_PARALLEL_MIN_FILES if parallel is None else parallel
+        results = []
+        if parallel:
+            # Parsing is CPU-bound, so threads would just queue on the GIL. Spawned rather than
+            # forked workers, since the GUI calls this from a thread of a multi-threaded process
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as executor:
+                for result in executor.map(_parse_file, tasks, chunksize=INDEX_PARSE_CHUNK):
+                    results.append(result)
+                    if progress and len(results) % INDEX_PARSE_CHUNK == 0:
+                        progress(len(results), len(tasks))
+        else:
+            results = [_parse_file(task) for task in tasks]
+        if progress:
+            progress(len(results), len(tasks))
+        return results
+
+    def _store(self, parsed, stats, deleted):
+        """Write parse results and drop deleted files in one transaction"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for path in deleted:
+                    self._delete_file(path)
+                for rel_path, digest, result in parsed:
+                    stat = stats.get(rel_path)
+                    if stat is None or digest is None:
+                        self._delete_file(rel_path)
+                        continue
+                    if result == "unchanged":
+                        self._conn.execute(
+                            "UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?",
+                            (stat.st_mtime_ns, stat.st_size, rel_path)
+                        )
+                        continue
+                    self._delete_file(rel_path)
+                    file_id = self._conn.execute(
+                        "INSERT INTO files (path, module, mtime_ns, size, hash, parsed) VALUES (?, ?, ?, ?, ?, ?)",
+                        (rel_path, module_name(rel_path), stat.st_mtime_ns, stat.st_size, digest, result is not None)
+                    ).lastrowid
+                    if result is None:
+                        continue
+                    symbols, imports, calls = result
+                    self._conn.executemany(
+                        "INSERT INTO symbols (file_id, name, qualname, kind, lineno, end_lineno) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(file_id,) + symbol for symbol in symbols]
+                    )
+                    self._conn.executemany(
+                        "INSERT INTO imports (file_id, module, name) VALUES (?, ?, ?)",
+                        [(file_id, module, name) for module, name in imports]
+                    )
+                    self._conn.executemany(
+                        "INSERT INTO calls (file_id, name, lineno) VALUES (?, ?, ?)",
+                        [(file_id, name, lineno) for name, lineno in calls.items()]
+                    )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _delete_file(self, rel_path):
+        row = self._conn.execute("SELECT id FROM files WHERE path = ?", (rel_path,)).fetchone()
+        if row is None:
+            return
+        for table in ("symbols", "imports", "calls"):
+            self._conn.execute(f"DELETE FROM {table} WHERE file_id = ?", row)
+        self._conn.execute("DELETE FROM files WHERE id = ?", row)
+
+    def refresh(self, rel_paths):
+        """Re-index just these files if they changed on disk since the last update"""
+        with self._lock:
+            stored = {}
+            for rel_path in set(rel_paths):
+                row = self._conn.execute("SELECT mtime_ns, size, hash FROM files WHERE path = ?", (rel_path,)).fetchone()
+                stored[rel_path] = row
+        stats = {}
+        tasks = []
+        deleted = []
+        for rel_path, row in stored.items():
+            try:
+                stat = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                deleted.append(rel_path)
+                continue
+            stats[rel_path] = stat
+            if row is None or row[0] != stat.st_mtime_ns or row[1] != stat.st_size:
+                tasks.append((self.root, rel_path, row[2] if row is not None else None))
+        if tasks or deleted:
+            self._store(self._parse_all(tasks, parallel=False), stats, deleted)
+
+    def stats(self):
+        with self._lock:
+            files, parsed = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(parsed), 0) FROM files").fetchone()
+            symbols = self._conn.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+        return {"files": files, "parsed": parsed, "symbols": symbols}
+
+    def module_file_ids(self, module):
+        """Ids of the files of module; a suffix match covers src/ layouts and the like"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM files WHERE module = ?", (module,)).fetchall()
+            if not rows:
+                rows = self._conn.execute("SELECT id FROM files WHERE module LIKE ?", ("%." + module,)).fetchall()
+        return [row[0] for row in rows]
+
+    def find(self, name, module=None, limit=None, _followed=()):
+        """Symbols called name, optionally only those defined in module"""
+        query = (
+            "SELECT files.path, files.module, symbols.name, qualname, kind, lineno, end_lineno "
+            "FROM symbols JOIN files ON files.id = symbols.file_id WHERE symbols.name = ?"
+        )
+        params = [name]
+        if module is not None:
+            # Look the module's files up first, so a common name does not mean scanning all its definitions
+            file_ids = self.module_file_ids(module)
+            if not file_ids:
+                return []
+            query += f" AND symbols.file_id IN ({', '.join('?' * len(file_ids))})"
+            params.extend(file_ids)
+        query += " ORDER BY files.path, lineno"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            symbols = [Symbol(*row) for row in self._conn.execute(query, params)]
+        if symbols or module is None:
+            return symbols
+        # Re-exported, e.g. by a package's __init__: follow the module's own import of the name
+        with self._lock:
+            sources = {
+                row[0] for row in self._conn.execute(
+                    f"SELECT module FROM imports WHERE name = ? AND file_id IN ({', '.join('?' * len(file_ids))})",
+                    [name] + file_ids
+                )
+            }
+        followed = set(_followed) | {module}
+        return [
+            symbol for source in sorted(sources - followed)
+            for symbol in self.find(name, source, limit, followed)
+        ]
+
+    def callers(self, name, exclude_path=None, limit=PROJECT_CONTEXT_MAX_CALLERS):
+        """(path, line) of files that call name"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT files.path, calls.lineno FROM calls JOIN files ON files.id = calls.file_id "
+                "WHERE calls.name = ? AND files.path IS NOT ? ORDER BY files.path LIMIT ?",
+                (name, exclude_path, limit)
+            ).fetchall()
+
+    def relative_path(self, filename):
+        """filename relative to the root in index form, or None if it is outside the workspace"""
+        if not filename:
+            return None
+        rel_path = os.path.relpath(os.path.abspath(filename), self.root)
+        if rel_path.startswith(".."):
+            return None
+        return rel_path.replace(os.sep, "/")
+
+    def relevant_symbols(self, code, prompt="", filename=None):
+        """Definitions from other files that code uses or prompt names, best first, as (score, Symbol)"""
+        current = self.relative_path(filename)
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            tree = ast.Module(body=[], type_ignores=[])
+        current_module = module_name(current) if current else ""
+        is_package = bool(current and current.endswith("__init__.py"))
+        defined = {symbol[0] for symbol in extract_symbols(tree)[0]}
+        mentioned = set(PROMPT_IDENTIFIER.findall(prompt))
+
+        used = set()
+        # local name -> (module, name) for "from module import name [as local]"
+        from_imports = {}
+        # local name -> module for "import module [as local]"
+        module_imports = {}
+        attributes = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                used.add(node.id)
+            elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+                attributes.add((node.value.id, node.attr))
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    # "import a.b" binds a; "import a.b as c" binds c to a.b
+                    local = alias.asname or alias.name.split(".")[0]
+                    module_imports[local] = alias.name if alias.asname else local
+            elif isinstance(node, ast.ImportFrom):
+                module = resolve_import(node.module, node.level, current_module, is_package)
+                for alias in node.names:
+                    from_imports[alias.asname or alias.name] = (module, alias.name)
+
+        candidates = {}
+
+        def add(symbols, score):
+            for symbol in symbols:
+                if symbol.path == current:
+                    continue
+                key = (symbol.path, symbol.qualname)
+                if key not in candidates or candidates[key][0] < score:
+                    candidates[key] = (score, symbol)
+
+        for local, (module, name) in from_imports.items():
+            if local not in defined:
+                add(self.find(name, module), (3 if local in used else 1) + (local in mentioned))
+        for local, attr in attributes:
+            if local in module_imports:
+                add(self.find(attr, module_imports[local]), 3 + (attr in mentioned))
+        for name in mentioned - defined - set(from_imports):
+            matches = [
+                s for s in self.find(name, limit=PROJECT_CONTEXT_MAX_NAME_MATCHES + 1)
+                if s.kind != "variable" or name.isupper()
+            ]
+            if 0 < len(matches) <= PROJECT_CONTEXT_MAX_NAME_MATCHES:
+                add(matches, 2)
+
+        # Methods are covered by their class when both are picked
+        picked_classes = {(s.path, s.qualname) for _, s in candidates.values() if s.kind == "class"}
+        ranked = [
+            (score, symbol) for score, symbol in candidates.values()
+            if not (symbol.kind == "method" and (symbol.path, symbol.qualname.split(".")[0]) in picked_classes)
+        ]
+        ranked.sort(key=lambda item: (-item[0], item[1].path, item[1].lineno))
+        return ranked
+
+    def context_for(self, code, prompt="", filename=None, max_tokens=PROJECT_CONTEXT_MAX_TOKENS, model=None):
+        """Source of the definitions code depends on, within max_tokens; empty if there are none"""
+        ranked = self.relevant_symbols(code, prompt, filename)
+        # Files edited since the last update are re-read, so line numbers are current
+        stale = {symbol.path for _, symbol in ranked}
+        if stale:
+            self.refresh(stale)
+            ranked = self.relevant_symbols(code, prompt, filename)
+        sources = {}
+        sections = []
+        used_tokens = 0
+        for _, symbol in ranked:
+            if symbol.path not in sources:
+                try:
+                    sources[symbol.path] = read_text(os.path.join(self.root, symbol.path))[0].split("\n")
+                except OSError:
+                    sources[symbol.path] = None
+            lines = sources[symbol.path]
+            if lines is None:
+                continue
+            text = "\n".join(lines[symbol.lineno - 1:symbol.end_lineno])
+            if count_tokens(text, model) > PROJECT_CONTEXT_SYMBOL_TOKENS:
+                text = outline(text)
+            section = f"# {symbol.path}:{symbol.lineno} ({symbol.module})\n{_dedent(text)}"
+            tokens = count_tokens(section, model)
+            if used_tokens + tokens > max_tokens:
+                continue
+            sections.append(section)
+            used_tokens += tokens
+
+        # Who calls the functions the prompt is about, so changed signatures can be kept compatible
+        current = self.relative_path(filename)
+        mentioned = set(PROMPT_IDENTIFIER.findall(prompt))
+        try:
+            defined = {symbol[0] for symbol in extract_symbols(ast.parse(code))[0] if symbol[2] != "variable"}
+        except (SyntaxError, ValueError):
+            defined = set()
+        for name in sorted(defined & mentioned):
+            sites = self.callers(name, exclude_path=current)
+            if sites:
+                line = f"# {name} is called from: " + ", ".join(f"{path}:{lineno}" for path, lineno in sites)
+                tokens = count_tokens(line, model)
+                if used_tokens + tokens <= max_tokens:
+                    sections.append(line)
+                    used_tokens += tokens
+        return "\n\n".join(sections)
+
+
+def _dedent(text):
+    lines = text.split("\n")
+    indent = min((len(line) - len(line.lstrip()) for line in lines if line.strip()), default=0)
+    return "\n".join(line[indent:] for line in lines)
+
+
+def outline(source):
+    """Signatures and docstrings of a definition, with bodies replaced by ..."""
+    text = _dedent(source)
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return text.split("\n", 1)[0] + "\n    ..."
+    lines = text.split("\n")
+    result = []
+
+    def emit(node, depth):
+        body_start = node.body[0].lineno
+        first = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+        result.extend(lines[first - 1:body_start - 1] if body_start > node.lineno else [lines[node.lineno - 1]])
+        docstring = ast.get_docstring(node, clean=False)
+        indent = " " * (node.col_offset + 4)
+        if docstring is not None:
+            doc = node.body[0]
+            # Methods keep one-line docstrings only
+            if depth == 0 or doc.lineno == doc.end_lineno:
+                result.extend(lines[doc.lineno - 1:doc.end_lineno])
+        if isinstance(node, ast.ClassDef):
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    emit(item, depth + 1)
+                elif isinstance(item, (ast.Assign, ast.AnnAssign)):
+                    result.extend(lines[item.lineno - 1:item.end_lineno])
+        else:
+            result.append(indent + "...")
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            emit(node, 0)
+        else:
+            result.extend(lines[node.lineno - 1:node.end_lineno])
+    return "\n".join(result)
+
+
+def attach_context(prompt_input, context):
+    """The prompt with project definitions appended, for reference only"""
+    if not context:
+        return prompt_input
+    return (
+        f"{prompt_input}\n\n"
+        "For reference, these definitions from other files of the project are used by the code. "
+        "Do not include them in your answer.\n"
+        f"{context}"
+    )
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_project_index(root):
+    """Shared ProjectIndex per workspace folder"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = ProjectIndex(root)
+        return _indexes[root]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the symbol index of a workspace folder")
+    parser.add_argument("root", help="Workspace folder")
+    parser.add_argument("--find", metavar="NAME", help="Show where NAME is defined")
+    parser.add_argument("--context", metavar="FILE", help="Print the project context that would be sent for FILE")
+    parser.add_argument("--prompt", default="", help="Prompt used with --context")
+    args = parser.parse_args(argv)
+
+    index = ProjectIndex(args.root)
+    counts = index.update()
+    stats = index.stats()
+    print(
+        f"{stats['files']} file(s), {stats['symbols']} symbol(s); "
+        f"{counts['changed']} changed, {counts['deleted']} deleted in {counts['seconds']:.2f}s"
+    )
+    if args.find:
+        for symbol in index.find(args.find):
+            print(f"{symbol.path}:{symbol.lineno} {symbol.kind} {symbol.module}.{symbol.qualname}")
+    if args.context:
+        code, _ = read_text(args.context)
+        print(index.context_for(code, args.prompt, args.context))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
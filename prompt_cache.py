@@ -0,0 +1,240 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import LOGGING_ENABLED
+
+# Provider-side caching of the stable prompt prefix (instructions and code)
+PROMPT_CACHE_ENABLED = True
+# Lifetime asked for explicit caches (Gemini); their storage is billed for as long as they live
+PROMPT_CACHE_TTL_SECONDS = 10 * 60
+# An explicit cache is only created for a prefix sent this many times within the TTL
+PROMPT_CACHE_MIN_USES = 2
+# Handles closer than this to expiry are not used, the request could arrive after it
+PROMPT_CACHE_EXPIRY_MARGIN = 30
+# Prefixes tracked at once; explicit caches of evicted ones are deleted
+PROMPT_CACHE_MAX_ENTRIES = 64
+# After a failed cache creation no new cache is tried for that model for this long
+PROMPT_CACHE_FAILURE_BACKOFF = 10 * 60
+# (model name prefix, smallest prefix in tokens the provider will cache explicitly); first match wins
+PROMPT_CACHE_MIN_TOKENS = [
+    ("gemini-2.5-flash", 1024),
+    ("gemini-2.5-pro", 4096),
+    ("gemini-2", 4096),
+    ("gemini-1.5", 32768),
+]
+DEFAULT_PROMPT_CACHE_MIN_TOKENS = 32768
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+def min_cache_tokens(model):
+    name = (model or "").lower()
+    for prefix, tokens in PROMPT_CACHE_MIN_TOKENS:
+        if name.startswith(prefix) or f"/{prefix}" in name:
+            return tokens
+    return DEFAULT_PROMPT_CACHE_MIN_TOKENS
+
+
+class CachedPrefix:
+    """A prompt prefix and, for providers with explicit caching, its cache handle.
+
+    Providers send text apart from the rest of the prompt; with a handle
+    they send only the rest and point the request at the cache.
+    """
+
+    def __init__(self, key, provider_name, model, text, tokens):
+        self.key = key
+        self.provider_name = provider_name
+        self.model = model
+        self.text = text
+        self.tokens = tokens
+        self.handle = None
+        # The Provider that created the handle and can delete it
+        self.owner = None
+        self.expires_at = None
+        self.uses = 0
+        self.first_used = None
+        self.last_used = None
+        self.lock = threading.Lock()
+
+    def live(self, now=None, margin=PROMPT_CACHE_EXPIRY_MARGIN):
+        """The handle exists and will outlive a request sent now"""
+        now = now if now is not None else time.monotonic()
+        return self.handle is not None and self.expires_at - margin > now
+
+
+class PromptCache:
+    """Bookkeeping for provider-side prompt prefix caches.
+
+    Every prefix is tracked so repeated use is noticed. Providers that cache
+    prefixes on their own (OpenAI, most OpenAI-compatible servers) only need
+    the prefix sent first and unchanged. For providers with explicit caches
+    (Gemini), a cache is created once a large enough prefix is reused within
+    the TTL, used until shortly before it expires and deleted when the prefix
+    is evicted or on clear().
+    """
+
+    def __init__(self, ttl=PROMPT_CACHE_TTL_SECONDS, min_uses=PROMPT_CACHE_MIN_USES,
+                 max_entries=PROMPT_CACHE_MAX_ENTRIES, failure_backoff=PROMPT_CACHE_FAILURE_BACKOFF):
+        self.ttl = ttl
+        self.min_uses = min_uses
+        self.max_entries = max_entries
+        self.failure_backoff = failure_backoff
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # model -> time after which creating a cache for it is tried again
+        self._failed = {}
+        self.requests = 0
+        self.hits = 0
+        self.cached_input_tokens = 0
+        self.created = 0
+        self.expired = 0
+        self.invalidated = 0
+
+    @staticmethod
+    def make_key(provider_name, model, text):
+        return hashlib.sha256(f"{provider_name}\0{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def prefix_for(self, provider, text, tokens):
+        """The CachedPrefix to send text with, creating a provider cache when it pays off"""
+        key = self.make_key(provider.name, provider.model_name, text)
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = CachedPrefix(key, provider.name, provider.model_name, text, tokens)
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[1])
+            else:
+                self._entries.move_to_end(key)
+            if entry.last_used is None or now - entry.last_used > self.ttl:
+                # Reuse only counts within the TTL; older uses would not have hit a cache
+                entry.uses = 0
+                entry.first_used = now
+            entry.uses += 1
+            entry.last_used = now
+        for old in evicted:
+            self._delete(old)
+        if provider.explicit_prefix_cache:
+            self._ensure_handle(entry, provider, now)
+        return entry
+
+    def _ensure_handle(self, entry, provider, now):
+        if entry.live(now):
+            return
+        if entry.handle is not None:
+            with entry.lock:
+                if entry.handle is not None and not entry.live(now):
+                    # Left to expire at the provider
+                    entry.handle, entry.owner, entry.expires_at = None, None, None
+                    with self._lock:
+                        self.expired += 1
+        if entry.uses < self.min_uses or entry.tokens < min_cache_tokens(entry.model):
+            return
+        if self._failed.get(entry.model, 0) > now:
+            return
+        # One creation per prefix; concurrent requests for it wait and then use the new handle
+        with entry.lock:
+            if entry.live():
+                return
+            started = time.monotonic()
+            try:
+                handle = provider.create_prefix_cache(entry.text, self.ttl)
+            except Exception as e:
+                self._failed[entry.model] = time.monotonic() + self.failure_backoff
+                if LOGGING_ENABLED:
+                    logger.warning("Could not create a %s prompt cache for %s: %s", entry.provider_name, entry.model, e)
+                return
+            # Counted from before the request, so local expiry comes no later than the provider's
+            entry.expires_at = started + self.ttl
+            entry.handle, entry.owner = handle, provider
+            with self._lock:
+                self.created += 1
+            if LOGGING_ENABLED:
+                logger.info(
+                    "Created %s prompt cache for %s tokens in %.2fs, expires in %ss",
+                    entry.provider_name, entry.tokens, time.monotonic() - started, self.ttl
+                )
+
+    def invalidate(self, entry):
+        """Stop using the entry's handle after the provider rejected it.
+
+        No new caches are made for the model for a while, so a request is not
+        sent to a cache that fails again.
+        """
+        if entry.handle is None:
+            return
+        with self._lock:
+            self.invalidated += 1
+            self._failed[entry.model] = time.monotonic() + self.failure_backoff
+        if LOGGING_ENABLED:
+            logger.info("Dropped %s prompt cache for %s", entry.provider_name, entry.model)
+        self._delete(entry)
+
+    def _delete(self, entry):
+        with entry.lock:
+            handle, owner = entry.handle, entry.owner
+            entry.handle, entry.owner, entry.expires_at = None, None, None
+        if handle is None:
+            return
+        try:
+            owner.delete_prefix_cache(handle)
+        except Exception as e:
+            # It still expires at the end of its TTL
+            if LOGGING_ENABLED:
+                logger.warning("Could not delete %s prompt cache: %s", entry.provider_name, e)
+
+    def record(self, entry, usage):
+        """Count the cached input tokens the provider reported for a request sent with entry"""
+        cached = (usage or {}).get("cached_input_tokens") or 0
+        with self._lock:
+            self.requests += 1
+            if cached:
+                self.hits += 1
+                self.cached_input_tokens += cached
+
+    def live_handles(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for entry in self._entries.values() if entry.live(now, margin=0))
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "cached_input_tokens": self.cached_input_tokens,
+            "created": self.created,
+            "live": self.live_handles(),
+            "expired": self.expired,
+            "invalidated": self.invalidated,
+            "tracked": len(self._entries),
+        }
+
+    def clear(self):
+        """Forget every prefix and delete the explicit caches that are still alive"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        now = time.monotonic()
+        for entry in entries:
+            if entry.live(now, margin=0):
+                self._delete(entry)
+            entry.handle = entry.owner = None
+
+
+_default_prompt_cache = None
+_default_prompt_cache_lock = threading.Lock()
+
+
+def get_default_prompt_cache():
+    """Process-wide prompt cache bookkeeping shared by every AIServiceProcessor"""
+    global _default_prompt_cache
+    with _default_prompt_cache_lock:
+        if _default_prompt_cache is None:
+            _default_prompt_cache = PromptCache()
+        return _default_prompt_cache
@@ -0,0 +1,400 @@
+import asyncio
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from config import GEMINI_CONFIG, GEMINI_SAFETY_SETTINGS, OPENAI_CONFIG, REQUEST_TIMEOUT
+from client_registry import gemini_generation_config, get_gemini_model, get_openai_client
+
+SYSTEM_PROMPT = "You are a helpful code assistant. Provide code updates as plain text without markdown formatting."
+
+# Any OpenAI-compatible server (llama.cpp, vLLM, Ollama, fake_server.py)
+LOCAL_PROVIDER_URL = os.environ.get("PROMPTIDE_LOCAL_URL", "http://127.0.0.1:8080/v1")
+LOCAL_PROVIDER_MODEL = os.environ.get("PROMPTIDE_LOCAL_MODEL", "local-model")
+LOCAL_PROVIDER_API_KEY = os.environ.get("PROMPTIDE_LOCAL_API_KEY", "")
+# Send OpenAI a prompt_cache_key per prefix, so requests sharing it are routed to the same cache
+OPENAI_PROMPT_CACHE_KEY = True
+
+_providers = {}
+_STREAM_DONE = object()
+
+
+def register_provider(name, display_name=None):
+    """Class decorator that makes a Provider available under name"""
+    def decorator(provider_class):
+        provider_class.name = name
+        provider_class.display_name = display_name or name.capitalize()
+        _providers[name] = provider_class
+        return provider_class
+    return decorator
+
+
+def available_providers():
+    """Registered provider names, in registration order"""
+    return list(_providers)
+
+
+def get_provider_class(name):
+    try:
+        return _providers[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported AI service '{name}'. Choose one of: {', '.join(_providers)}")
+
+
+def create_provider(name, **options):
+    return get_provider_class(name)(**options)
+
+
+async def iterate_in_thread(make_iterator):
+    """Drive a blocking iterator on a worker thread and yield its items asynchronously"""
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stop = threading.Event()
+
+    def pump():
+        iterator = make_iterator()
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(items.put_nowait, item)
+            loop.call_soon_threadsafe(items.put_nowait, _STREAM_DONE)
+        except BaseException as e:
+            loop.call_soon_threadsafe(items.put_nowait, e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if callable(close):
+                close()
+
+    # run_in_executor, unlike asyncio.to_thread, does not carry context variables (the logging request id) over
+    loop.run_in_executor(None, contextvars.copy_context().run, pump)
+    try:
+        while True:
+            item = await items.get()
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # The pump notices on its next item; a blocked read is not interrupted
+        stop.set()
+
+
+def chat_messages(prompt, prefix=None):
+    """System and user messages; a cacheable prefix is sent as a message of its own ahead of the rest"""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if prefix is not None and prompt.startswith(prefix.text):
+        messages.append({"role": "user", "content": prefix.text})
+        prompt = prompt[len(prefix.text):]
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+class Provider:
+    """A model backend. Subclasses implement setup, generate and stream.
+
+    generate/stream receive the complete user prompt and fill the optional usage
+    dict with input_tokens/output_tokens (and cached_input_tokens when the provider
+    reports them). max_tokens, when given, overrides the configured output token
+    limit for that request. prefix, when given, is a prompt_cache.CachedPrefix the
+    prompt starts with; it is sent so the provider can cache it, or, if it has a
+    handle, replaced by a reference to the cache. The async variants default to
+    running the blocking versions on a thread; backends with native async clients
+    can override them.
+    """
+
+    name = None
+    display_name = None
+    # Prefixes are cached through create_prefix_cache handles instead of by the provider on its own
+    explicit_prefix_cache = False
+
+    def setup(self):
+        """Create clients; called once before the first request"""
+
+    def create_prefix_cache(self, prefix, ttl):
+        """Cache prefix at the provider for ttl seconds; returns the handle requests refer to"""
+        raise NotImplementedError
+
+    def delete_prefix_cache(self, handle):
+        """Delete a cache made by create_prefix_cache before it expires"""
+
+    def cache_config(self):
+        """Everything besides the prompt that changes the response, for cache keys"""
+        raise NotImplementedError
+
+    @property
+    def model_name(self):
+        """Model identifier, used to pick a tokenizer and token limits"""
+        return None
+
+    @property
+    def max_output_tokens(self):
+        """The configured output limit, or None"""
+        return None
+
+    def generate(self, prompt, usage=None, max_tokens=None, prefix=None):
+        raise NotImplementedError
+
+    def stream(self, prompt, usage=None, max_tokens=None, prefix=None):
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, usage=None, max_tokens=None, prefix=None):
+        return await asyncio.to_thread(self.generate, prompt, usage, max_tokens, prefix)
+
+    async def astream(self, prompt, usage=None, max_tokens=None, prefix=None):
+        async for text in iterate_in_thread(lambda: self.stream(prompt, usage, max_tokens, prefix)):
+            yield text
+
+
+@register_provider("gemini", "Gemini")
+class GeminiProvider(Provider):
+    # Gemini only caches through CachedContent, which needs a model with an explicit version, e.g. gemini-1.5-flash-002
+    explicit_prefix_cache = True
+
+    def __init__(self, config=None):
+        self.config = config or GEMINI_CONFIG
+        self.model = None
+
+    def setup(self):
+        self.model = get_gemini_model(self.config)
+
+    def create_prefix_cache(self, prefix, ttl):
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=self.config["model"],
+            contents=[prefix],
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+
+    def delete_prefix_cache(self, handle):
+        handle.delete()
+
+    def _model_and_contents(self, prompt, prefix):
+        """With a cache handle, a model bound to the cache and only the rest of the prompt"""
+        handle = prefix.handle if prefix is not None else None
+        if handle is None or not prompt.startswith(prefix.text):
+            return self.model, [prompt]
+        import google.generativeai as genai
+        model = genai.GenerativeModel.from_cached_content(
+            handle,
+            generation_config=gemini_generation_config(self.config),
+            safety_settings=GEMINI_SAFETY_SETTINGS
+        )
+        return model, [prompt[len(prefix.text):]]
+
+    def cache_config(self):
+        return {"generation": self.config, "safety": GEMINI_SAFETY_SETTINGS}
+
+    @property
+    def model_name(self):
+        return self.config.get("model")
+
+    @property
+    def max_output_tokens(self):
+        return self.config.get("max_output_tokens")
+
+    @staticmethod
+    def _generation_config(max_tokens):
+        # Merged by the SDK over the model's own generation config
+        return {"max_output_tokens": max_tokens} if max_tokens else None
+
+    @staticmethod
+    def _record_usage(response, usage):
+        metadata = getattr(response, "usage_metadata", None)
+        if usage is not None and metadata is not None:
+            # prompt_token_count includes the cached tokens
+            usage["input_tokens"] = getattr(metadata, "prompt_token_count", None)
+            usage["output_tokens"] = getattr(metadata, "candidates_token_count", None)
+            usage["cached_input_tokens"] = getattr(metadata, "cached_content_token_count", None)
+
+    def generate(self, prompt, usage=None, max_tokens=None, prefix=None):
+        model, contents = self._model_and_contents(prompt, prefix)
+        response = model.generate_content(contents, generation_config=self._generation_config(max_tokens))
+        self._record_usage(response, usage)
+        return response.text
+
+    def stream(self, prompt, usage=None, max_tokens=None, prefix=None):
+        model, contents = self._model_and_contents(prompt, prefix)
+        response = model.generate_content(
+            contents, stream=True, generation_config=self._generation_config(max_tokens)
+        )
+        for chunk in response:
+            # Every chunk carries the running totals, so the last one wins
+            self._record_usage(chunk, usage)
+            if chunk.text:
+                yield chunk.text
+
+
+@register_provider("openai", "OpenAI")
+class OpenAIProvider(Provider):
+    def __init__(self, config=None):
+        self.config = config or OPENAI_CONFIG
+        self.client = None
+
+    def setup(self):
+        self.client = get_openai_client()
+
+    def cache_config(self):
+        return self.config
+
+    @property
+    def model_name(self):
+        return self.config.get("model")
+
+    @property
+    def max_output_tokens(self):
+        return self.config.get("max_tokens")
+
+    def _request_kwargs(self, prompt, max_tokens=None, prefix=None):
+        kwargs = {
+            "model": self.config["model"],
+            # Prompts of 1024+ tokens are cached automatically; the prefix only has to come first and stay the same
+            "messages": chat_messages(prompt, prefix),
+            "temperature": self.config["temperature"],
+            "max_tokens": max_tokens or self.config["max_tokens"],
+            "top_p": self.config["top_p"],
+            "frequency_penalty": self.config["frequency_penalty"],
+            "presence_penalty": self.config["presence_penalty"],
+        }
+        if prefix is not None and OPENAI_PROMPT_CACHE_KEY:
+            # extra_body, as older SDK versions do not know the parameter
+            kwargs["extra_body"] = {"prompt_cache_key": prefix.key[:32]}
+        return kwargs
+
+    @staticmethod
+    def _record_usage(response, usage):
+        metadata = getattr(response, "usage", None)
+        if usage is not None and metadata is not None:
+            usage["input_tokens"] = getattr(metadata, "prompt_tokens", None)
+            usage["output_tokens"] = getattr(metadata, "completion_tokens", None)
+            details = getattr(metadata, "prompt_tokens_details", None)
+            if details is not None:
+                usage["cached_input_tokens"] = getattr(details, "cached_tokens", None)
+
+    def generate(self, prompt, usage=None, max_tokens=None, prefix=None):
+        response = self.client.chat.completions.create(**self._request_kwargs(prompt, max_tokens, prefix))
+        self._record_usage(response, usage)
+        return response.choices[0].message.content
+
+    def stream(self, prompt, usage=None, max_tokens=None, prefix=None):
+        stream = self.client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._request_kwargs(prompt, max_tokens, prefix)
+        )
+        try:
+            for chunk in stream:
+                # Usage arrives on a final chunk with no choices
+                self._record_usage(chunk, usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the stream releases the HTTP connection when the consumer stops early
+            stream.close()
+
+
+class ProviderHTTPError(Exception):
+    """HTTP error from an OpenAI-compatible endpoint; carries status and headers for retry decisions"""
+
+    def __init__(self, status_code, message, headers=None):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@register_provider("local", "Local")
+class LocalOpenAIProvider(Provider):
+    """OpenAI-compatible HTTP endpoint, spoken with the standard library only"""
+
+    def __init__(self, base_url=None, model=None, api_key=None, config=None, timeout=REQUEST_TIMEOUT):
+        self.base_url = (base_url or LOCAL_PROVIDER_URL).rstrip("/")
+        self.model = model or LOCAL_PROVIDER_MODEL
+        self.api_key = api_key if api_key is not None else LOCAL_PROVIDER_API_KEY
+        self.config = config or OPENAI_CONFIG
+        self.timeout = timeout
+
+    def cache_config(self):
+        # Under "generation" like Gemini, so the response cache sees the temperature
+        return {"base_url": self.base_url, "model": self.model, "generation": self._sampling()}
+
+    @property
+    def model_name(self):
+        return self.model
+
+    @property
+    def max_output_tokens(self):
+        return self.config.get("max_tokens")
+
+    def _sampling(self):
+        return {key: self.config[key] for key in ("temperature", "max_tokens", "top_p") if key in self.config}
+
+    def _open(self, prompt, stream, usage=None, max_tokens=None, prefix=None):
+        body = {
+            "model": self.model,
+            # llama.cpp and vLLM reuse the KV cache of a prefix they have seen
+            "messages": chat_messages(prompt, prefix),
+            "stream": stream,
+        }
+        body.update(self._sampling())
+        if max_tokens:
+            body["max_tokens"] = max_tokens
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(
+            f"{self.base_url}/chat/completions",
+            data=json.dumps(body).encode("utf-8"),
+            headers=headers,
+            method="POST"
+        )
+        started = time.perf_counter()
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            message = e.read().decode("utf-8", "replace")[:500]
+            headers = {key.lower(): value for key, value in e.headers.items()}
+            raise ProviderHTTPError(e.code, message, headers) from e
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"Cannot reach {self.base_url}: {e.reason}") from e
+        if usage is not None:
+            # Until the response headers arrive: connection setup plus server queueing
+            usage["connect_seconds"] = time.perf_counter() - started
+        return response
+
+    @staticmethod
+    def _record_usage(payload, usage):
+        metadata = payload.get("usage")
+        if usage is not None and metadata:
+            usage["input_tokens"] = metadata.get("prompt_tokens")
+            usage["output_tokens"] = metadata.get("completion_tokens")
+            details = metadata.get("prompt_tokens_details") or {}
+            if "cached_tokens" in details:
+                usage["cached_input_tokens"] = details["cached_tokens"]
+
+    def generate(self, prompt, usage=None, max_tokens=None, prefix=None):
+        with self._open(prompt, stream=False, usage=usage, max_tokens=max_tokens, prefix=prefix) as response:
+            payload = json.loads(response.read())
+        self._record_usage(payload, usage)
+        return payload["choices"][0]["message"]["content"]
+
+    def stream(self, prompt, usage=None, max_tokens=None, prefix=None):
+        with self._open(prompt, stream=True, usage=usage, max_tokens=max_tokens, prefix=prefix) as response:
+            for raw_line in response:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                payload = json.loads(data)
+                self._record_usage(payload, usage)
+                choices = payload.get("choices") or []
+                if choices and choices[0].get("delta", {}).get("content"):
+                    yield choices[0]["delta"]["content"]
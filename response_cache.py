@@ -0,0 +1,265 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import LOGGING_ENABLED, OUTPUT_DIR
+
+CACHE_ENABLED = True
+CACHE_DB_PATH = os.path.join(OUTPUT_DIR, "response_cache.sqlite3")
+CACHE_MEMORY_ENTRIES = 128
+CACHE_MAX_ENTRIES = 5000
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+# Requests sampled above this temperature are not deterministic enough to reuse
+CACHE_MAX_TEMPERATURE = 0.3
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+_held_writes = contextvars.ContextVar("held_cache_writes", default=None)
+
+
+def make_cache_key(service, config, prompt_input, file_content, extra=None):
+    """Hash everything that influences the response into a stable key"""
+    payload = json.dumps(
+        {
+            "service": service,
+            "config": config,
+            "prompt": prompt_input,
+            "code": file_content,
+            "extra": extra,
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class HeldWrites:
+    """Response cache writes kept back until the answer they are part of is accepted, e.g. validated"""
+
+    def __init__(self):
+        self._writes = []
+        self._lock = threading.Lock()
+
+    def add(self, cache, key, value):
+        with self._lock:
+            self._writes.append((cache, key, value))
+
+    def adopt(self, other):
+        """Take over the writes held for another request, e.g. a speculation whose answer is used"""
+        if other is None or other is self:
+            return
+        with other._lock:
+            writes, other._writes = other._writes, []
+        with self._lock:
+            self._writes.extend(writes)
+
+    def commit(self):
+        with self._lock:
+            writes, self._writes = self._writes, []
+        for cache, key, value in writes:
+            cache.write(key, value)
+
+    def discard(self):
+        with self._lock:
+            self._writes = []
+
+
+@contextlib.contextmanager
+def hold_cache_writes():
+    """Within the block (and threads started with its context), ResponseCache.put only records the write.
+
+    Yields the HeldWrites; call commit() to write them. Anything not committed is dropped.
+    """
+    held = HeldWrites()
+    token = _held_writes.set(held)
+    try:
+        yield held
+    finally:
+        _held_writes.reset(token)
+
+
+class ResponseCache:
+    """Two-level response cache: an in-memory LRU in front of a sqlite store"""
+
+    def __init__(
+        self,
+        db_path=CACHE_DB_PATH,
+        memory_entries=CACHE_MEMORY_ENTRIES,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        ttl=CACHE_TTL_SECONDS,
+        max_temperature=CACHE_MAX_TEMPERATURE
+    ):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._open_db()
+
+    def _open_db(self):
+        if not self.db_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, "
+                "accessed REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            # The cache is an optimisation; fall back to memory only
+            if LOGGING_ENABLED:
+                logger.warning("Response cache disk store unavailable (%s): %s", self.db_path, e)
+            self._conn = None
+
+    def is_cacheable(self, config):
+        """Only near-deterministic requests are worth caching"""
+        return config.get("temperature", 0) <= self.max_temperature
+
+    def note_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            row = None
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT value, created FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None and self._expired(row[1], now):
+                        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self._conn.commit()
+                        row = None
+                    elif row is not None:
+                        self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                except sqlite3.Error as e:
+                    if LOGGING_ENABLED:
+                        logger.warning("Response cache read failed: %s", e)
+                    row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+    def put(self, key, value):
+        """Store value, or hold it back inside hold_cache_writes()"""
+        held = _held_writes.get()
+        if held is not None:
+            held.add(self, key, value)
+            return
+        self.write(key, value)
+
+    def write(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, now, now, len(value.encode("utf-8")))
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                if LOGGING_ENABLED:
+                    logger.warning("Response cache write failed: %s", e)
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        """Drop expired rows, then least recently used rows until within bounds"""
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            excess = max(count - self.max_entries, 1)
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT ?", (excess,)
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(row[0],) for row in rows])
+            count -= len(rows)
+            total -= sum(row[1] for row in rows)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Process-wide cache shared by every AIServiceProcessor"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
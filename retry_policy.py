@@ -0,0 +1,279 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from config import LOGGING_ENABLED, MAX_RETRIES
+
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "RateLimitError",
+    "InternalServerError",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "TooManyRequests",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "RemoteProtocolError",
+}
+
+# Client-side limits per provider; None disables that dimension
+PROVIDER_RATE_LIMITS = {
+    "gemini": {"requests_per_minute": 60, "tokens_per_minute": 1000000},
+    "openai": {"requests_per_minute": 500, "tokens_per_minute": 200000},
+}
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+
+def _status_code(error):
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def parse_retry_after(error):
+    """Return the delay in seconds requested by the provider, if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """Return True if the error is transient and the request may be retried"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring Retry-After hints"""
+
+    def __init__(
+        self,
+        max_retries=MAX_RETRIES,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+        classify=classify_error,
+        sleep=time.sleep,
+        rng=None
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    def should_retry(self, error, attempt):
+        """attempt is the number of retries already made"""
+        return attempt < self.max_retries and self.classify(error)
+
+    def delay_for(self, attempt, error=None):
+        retry_after = parse_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return self.rng.uniform(0, ceiling)
+
+    def wait(self, attempt, error=None, cancel_event=None):
+        delay = self.delay_for(attempt, error)
+        if LOGGING_ENABLED:
+            logger.info("Retrying request (%s/%s) in %.2fs", attempt + 1, self.max_retries, delay)
+        if cancel_event is not None:
+            cancel_event.wait(delay)
+        else:
+            self.sleep(delay)
+
+    def call(self, fn, cancel_event=None):
+        """Call fn until it succeeds, a fatal error occurs or retries run out"""
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                self.wait(attempt, e, cancel_event)
+                attempt += 1
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.capacity)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount=1):
+        """Take amount tokens if available; otherwise return the seconds to wait"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount=1, cancel_event=None):
+        while True:
+            delay = self.try_acquire(amount)
+            if delay <= 0:
+                return True
+            if cancel_event is not None:
+                if cancel_event.wait(delay):
+                    return False
+            else:
+                self.sleep(delay)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one provider"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, clock=time.monotonic, sleep=time.sleep):
+        self.request_bucket = TokenBucket(requests_per_minute, clock=clock, sleep=sleep) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute, clock=clock, sleep=sleep) if tokens_per_minute else None
+
+    def acquire(self, tokens=0, cancel_event=None):
+        """Block until the request fits both budgets; False if cancelled while waiting"""
+        if self.request_bucket is not None and not self.request_bucket.acquire(1, cancel_event):
+            return False
+        if self.token_bucket is not None and tokens and not self.token_bucket.acquire(tokens, cancel_event):
+            return False
+        return True
+
+
+class CircuitBreaker:
+    """Stop calling a provider after repeated failures, probing again after a cool-down"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # Token of the call let through to probe a half-open circuit
+        self._probe = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError while the circuit is open.
+
+        Returns a probe token when this call is the one let through to test the
+        provider again, else None; pass it to end_probe() once the call is over.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"{self.name} is unavailable after {self.failures} consecutive failures")
+                # Let a single probe request through
+                self.state = self.HALF_OPEN
+                self._probe = object()
+                return self._probe
+            elif self.state == self.HALF_OPEN:
+                raise CircuitOpenError(f"{self.name} is being probed after repeated failures")
+        return None
+
+    def end_probe(self, probe):
+        """Free the probe slot if the probe ended without an outcome (cancelled, closed, ...).
+
+        The circuit goes back to open with the old opened_at, so the next call
+        is let through as a new probe.
+        """
+        if probe is None:
+            return
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probe is probe:
+                self.state = self.OPEN
+            if self._probe is probe:
+                self._probe = None
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN and LOGGING_ENABLED:
+                    logger.warning("Circuit breaker for %s opened after %s failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+_rate_limiters = {}
+_circuit_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(service):
+    """Process-wide rate limiter for a provider"""
+    with _registry_lock:
+        if service not in _rate_limiters:
+            _rate_limiters[service] = RateLimiter(**PROVIDER_RATE_LIMITS.get(service, {}))
+        return _rate_limiters[service]
+
+
+def get_circuit_breaker(service):
+    """Process-wide circuit breaker for a provider"""
+    with _registry_lock:
+        if service not in _circuit_breakers:
+            _circuit_breakers[service] = CircuitBreaker(service)
+        return _circuit_breakers[service]
@@ -0,0 +1,32 @@
+# Runs a command under CPU and memory limits: python sandbox_exec.py CPU_SECONDS MEMORY_BYTES -- COMMAND...
+# Kept free of project imports, so it starts fast with the stripped environment validation.py
+# gives it. The limits are set in this process and inherited by the command through exec.
+import os
+import sys
+
+
+def main(argv):
+    cpu_seconds, memory_bytes, separator, *command = argv
+    if separator != "--" or not command:
+        print("usage: sandbox_exec.py CPU_SECONDS MEMORY_BYTES -- COMMAND...", file=sys.stderr)
+        return 2
+    try:
+        import resource
+    except ImportError:
+        # Windows: no rlimits; the caller's timeout still applies
+        resource = None
+    if resource is not None:
+        if int(cpu_seconds):
+            resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds) + 1))
+        if int(memory_bytes):
+            resource.setrlimit(resource.RLIMIT_AS, (int(memory_bytes), int(memory_bytes)))
+        # No core dumps of crashed test runs
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if os.name == "nt":
+        import subprocess
+        return subprocess.call(command)
+    os.execvp(command[0], command)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
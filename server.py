@@ -0,0 +1,654 @@
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from ai_service import AIServiceProcessor, RequestCancelled, create_output_directories
+from chunking import needs_chunking
+from config import LOGGING_ENABLED
+from incremental import INCREMENTAL_ENABLED, get_default_block_cache
+from logging_setup import configure_logging, request_context
+from metrics import get_default_metrics
+from patching import EDIT_MODE_DIFF, EDIT_MODE_FULL
+from providers import available_providers
+from response_cache import hold_cache_writes
+from retry_policy import CircuitOpenError
+from validation import VALIDATION_ENABLED, Validator, validated
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# Provider requests running at once over all clients (the size of the worker thread pool)
+SERVER_MAX_CONCURRENCY = 16
+# Requests one client can have running at once; the rest wait their turn
+SERVER_CLIENT_CONCURRENCY = 4
+# Requests one client can have waiting; past this it gets 429
+SERVER_CLIENT_MAX_QUEUED = 32
+SERVER_MAX_BODY_BYTES = 16 * 1024 * 1024
+SERVER_MAX_HEADER_BYTES = 64 * 1024
+# Client states kept; idle ones are forgotten beyond this
+SERVER_MAX_CLIENTS = 1024
+# Seconds a keep-alive connection may sit idle between requests
+SERVER_IDLE_TIMEOUT = 120
+# How often a waiting request checks whether its client has gone away
+SERVER_DISCONNECT_POLL = 0.25
+# Clients must send "Authorization: Bearer <token>" when set (or with --token)
+SERVER_TOKEN = None
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests",
+    431: "Request Header Fields Too Large", 499: "Client Closed Request", 500: "Internal Server Error",
+    501: "Not Implemented", 502: "Bad Gateway", 503: "Service Unavailable",
+}
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """An error answered with status and a JSON {"error": message} body"""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before its answer was ready"""
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body=b""):
+        self.method = method
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = url.query
+        self.version = version
+        # Header names lower-cased
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self):
+        try:
+            payload = json.loads(self.body.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, ValueError) as e:
+            raise HTTPError(400, f"Body is not valid JSON: {e}")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return payload
+
+
+async def read_request(reader):
+    """The next Request on the connection, or None once the client has closed it"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HTTPError(400, "Incomplete request")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "Request headers are too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "Chunked request bodies are not supported, send Content-Length")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > SERVER_MAX_BODY_BYTES:
+        raise HTTPError(413, f"Request body is larger than {SERVER_MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, target, version, headers, body)
+
+
+def response_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_body(writer, status, body, content_type, keep_alive, headers=None):
+    head = {"Content-Type": content_type, "Content-Length": str(len(body)),
+            "Connection": "keep-alive" if keep_alive else "close"}
+    head.update(headers or {})
+    writer.write(response_head(status, head) + body)
+    await writer.drain()
+
+
+async def send_json(writer, status, payload, keep_alive, headers=None):
+    body = json.dumps(payload).encode("utf-8")
+    await send_body(writer, status, body, "application/json", keep_alive, headers)
+
+
+class EventStream:
+    """Server-sent events over a chunked HTTP/1.1 response; the connection stays usable afterwards"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    async def open(self, headers=None):
+        head = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "Transfer-Encoding": "chunked",
+                "Connection": "keep-alive"}
+        head.update(headers or {})
+        self.writer.write(response_head(200, head))
+        await self.writer.drain()
+
+    async def send(self, event, payload):
+        data = f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+        self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        try:
+            await self.writer.drain()
+        except ConnectionError as e:
+            raise ClientDisconnected(str(e))
+
+    async def close(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+class ClientState:
+    """Concurrency slots and counters for one client (X-Client-Id header, else its address)"""
+
+    def __init__(self, client_id, concurrency, max_queued):
+        self.client_id = client_id
+        self.slots = asyncio.Semaphore(concurrency)
+        self.max_queued = max_queued
+        self.waiting = 0
+        self.active = 0
+        self.requests = 0
+        self.rejected = 0
+        self.last_seen = time.time()
+
+    async def acquire(self):
+        self.last_seen = time.time()
+        if self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise HTTPError(429, f"Client {self.client_id} has {self.waiting} requests waiting", {"Retry-After": "1"})
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.requests += 1
+
+    def release(self):
+        self.active -= 1
+        self.slots.release()
+
+    def as_dict(self):
+        return {"active": self.active, "waiting": self.waiting, "requests": self.requests, "rejected": self.rejected,
+                "last_seen": self.last_seen}
+
+
+class Flight:
+    """One provider request that every client asking the same thing waits on"""
+
+    def __init__(self, task, cancel_event):
+        self.task = task
+        self.cancel_event = cancel_event
+        self.waiters = 0
+
+
+class PromptServer:
+    """Local HTTP/JSON front end for AIServiceProcessor, for editor plugins and scripts.
+
+    Endpoints:
+        POST   /v1/process          {"prompt", "code", "service", "filename", "edit_mode", "stream",
+                                     "use_cache", "validate", "incremental"} -> JSON, or server-sent
+                                     events (start, chunk, done, error) with "stream": true or
+                                     Accept: text/event-stream
+        DELETE /v1/requests/<id>    cancel a request by its X-Request-Id
+        GET    /v1/providers, /v1/stats, /metrics (Prometheus text), /health
+
+    One AIServiceProcessor per provider serves every client, so the response
+    cache, prompt cache, block cache and provider connection pools are
+    shared. Identical requests in flight at the same time are sent once.
+    Each client gets client_concurrency slots; a request whose client
+    disconnects is cancelled once no other client waits on it.
+    """
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, max_concurrency=SERVER_MAX_CONCURRENCY,
+                 client_concurrency=SERVER_CLIENT_CONCURRENCY, client_max_queued=SERVER_CLIENT_MAX_QUEUED,
+                 token=SERVER_TOKEN, default_service="gemini", processors=None):
+        self.host = host
+        self.port = port
+        self.max_concurrency = max_concurrency
+        self.client_concurrency = client_concurrency
+        self.client_max_queued = client_max_queued
+        self.token = token
+        self.default_service = default_service
+        # service -> AIServiceProcessor; pass processors to serve pre-configured ones (e.g. in tests)
+        self.processors = dict(processors or {})
+        self._processor_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="server")
+        self.clients = {}
+        self._flights = {}
+        # request id -> (client id, cancel event)
+        self._requests = {}
+        self._ids = itertools.count(1)
+        self._server = None
+        self.started_at = None
+        self.connections = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # Provider calls run on the loop's default executor, so it bounds them over all clients
+        loop.set_default_executor(self.executor)
+        self._server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, limit=SERVER_MAX_HEADER_BYTES
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.started_at = time.time()
+        if LOGGING_ENABLED:
+            logger.info("Serving on http://%s:%s", self.host, self.port)
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for _, cancel_event in self._requests.values():
+            cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def processor_for(self, service):
+        with self._processor_lock:
+            if service not in self.processors:
+                self.processors[service] = AIServiceProcessor(service=service, lazy=True)
+            return self.processors[service]
+
+    def client_for(self, request, writer):
+        client_id = request.headers.get("x-client-id", "").strip()[:64]
+        if not client_id:
+            peer = writer.get_extra_info("peername")
+            client_id = peer[0] if peer else "unknown"
+        if client_id not in self.clients:
+            if len(self.clients) >= SERVER_MAX_CLIENTS:
+                idle = [key for key, client in self.clients.items() if not client.active and not client.waiting]
+                for key in sorted(idle, key=lambda key: self.clients[key].last_seen)[:len(idle) // 2 + 1]:
+                    del self.clients[key]
+            self.clients[client_id] = ClientState(client_id, self.client_concurrency, self.client_max_queued)
+        return self.clients[client_id]
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), SERVER_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": str(e)}, False, e.headers)
+                    break
+                if request is None:
+                    break
+                self.requests += 1
+                if not await self.dispatch(request, reader, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ClientDisconnected):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def dispatch(self, request, reader, writer):
+        """Answer one request; returns whether the connection can take another"""
+        keep_alive = request.keep_alive
+        try:
+            if self.token is not None:
+                supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+                if not hmac.compare_digest(supplied.encode("utf-8"), self.token.encode("utf-8")):
+                    raise HTTPError(401, "Missing or wrong bearer token")
+            route = (request.method, request.path.rstrip("/") or "/")
+            if route == ("GET", "/health"):
+                await send_json(writer, 200, {"status": "ok"}, keep_alive)
+            elif route == ("GET", "/v1/providers"):
+                await send_json(writer, 200, {"providers": available_providers(), "default": self.default_service},
+                                keep_alive)
+            elif route == ("GET", "/v1/stats"):
+                await send_json(writer, 200, self.stats(), keep_alive)
+            elif route == ("GET", "/metrics"):
+                body = get_default_metrics().to_prometheus().encode("utf-8")
+                await send_body(writer, 200, body, "text/plain; version=0.0.4", keep_alive)
+            elif route == ("POST", "/v1/process"):
+                return await self.handle_process(request, reader, writer)
+            elif request.method == "DELETE" and request.path.startswith("/v1/requests/"):
+                await self.handle_cancel(request, writer)
+            elif route[1] in ("/health", "/v1/providers", "/v1/stats", "/metrics", "/v1/process"):
+                raise HTTPError(405, f"{request.method} is not allowed on {request.path}")
+            else:
+                raise HTTPError(404, f"No such endpoint: {request.path}")
+        except HTTPError as e:
+            await send_json(writer, e.status, {"error": str(e)}, keep_alive, e.headers)
+        return keep_alive
+
+    async def handle_cancel(self, request, writer):
+        request_id = request.path[len("/v1/requests/"):]
+        entry = self._requests.get(request_id)
+        client = self.client_for(request, writer)
+        if entry is None or entry[0] != client.client_id:
+            raise HTTPError(404, f"No running request {request_id} for this client")
+        entry[1].set()
+        await send_json(writer, 200, {"id": request_id, "cancelled": True}, request.keep_alive)
+
+    def parse_job(self, payload):
+        """Checked request options from a /v1/process body"""
+        prompt = payload.get("prompt")
+        code = payload.get("code")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise HTTPError(400, "\"prompt\" is required")
+        if not isinstance(code, str) or not code.strip():
+            raise HTTPError(400, "\"code\" is required")
+        service = str(payload.get("service") or self.default_service).lower()
+        if service not in available_providers():
+            raise HTTPError(400, f"Unknown service {service!r}, expected one of {available_providers()}")
+        edit_mode = payload.get("edit_mode") or EDIT_MODE_FULL
+        if edit_mode not in (EDIT_MODE_FULL, EDIT_MODE_DIFF):
+            raise HTTPError(400, f"\"edit_mode\" must be {EDIT_MODE_FULL!r} or {EDIT_MODE_DIFF!r}")
+        return {
+            "prompt": prompt.strip(),
+            "code": code.strip(),
+            "service": service,
+            "filename": payload.get("filename") or None,
+            "edit_mode": edit_mode,
+            "use_cache": bool(payload.get("use_cache", True)),
+            "validate": bool(payload.get("validate", VALIDATION_ENABLED)),
+            "incremental": bool(payload.get("incremental", INCREMENTAL_ENABLED)),
+        }
+
+    async def handle_process(self, request, reader, writer):
+        payload = request.json()
+        job = self.parse_job(payload)
+        stream = bool(payload.get("stream")) or "text/event-stream" in request.headers.get("accept", "")
+        client = self.client_for(request, writer)
+        request_id = request.headers.get("x-request-id", "").strip()[:64] or f"srv-{next(self._ids)}"
+        if request_id in self._requests:
+            raise HTTPError(400, f"Request id {request_id} is already in use")
+        cancel_event = threading.Event()
+        self._requests[request_id] = (client.client_id, cancel_event)
+        headers = {"X-Request-Id": request_id}
+        started = time.perf_counter()
+        try:
+            await client.acquire()
+            try:
+                with request_context(f"server-{request_id}"):
+                    if LOGGING_ENABLED:
+                        logger.info(
+                            "Request %s from %s: %s, %s chars", request_id, client.client_id, job["service"],
+                            len(job["code"])
+                        )
+                    if stream:
+                        await self.stream_process(job, request_id, reader, writer, cancel_event, headers, started)
+                        return request.keep_alive
+                    result = await self.run_coalesced(job, reader, cancel_event)
+            finally:
+                client.release()
+        except (ClientDisconnected, ConnectionError):
+            self.cancelled += 1
+            if LOGGING_ENABLED:
+                logger.info("Client of request %s went away, cancelled it", request_id)
+            return False
+        except RequestCancelled as e:
+            self.cancelled += 1
+            raise HTTPError(499, str(e), headers)
+        except CircuitOpenError as e:
+            raise HTTPError(503, str(e), dict(headers, **{"Retry-After": "5"}))
+        except HTTPError:
+            raise
+        except Exception as e:
+            raise HTTPError(502, str(e), headers)
+        finally:
+            self._requests.pop(request_id, None)
+        result = dict(result, id=request_id, latency=time.perf_counter() - started)
+        await send_json(writer, 200, result, request.keep_alive, headers)
+        return request.keep_alive
+
+    @staticmethod
+    def flight_key(job):
+        return hashlib.sha256(json.dumps(job, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def run_coalesced(self, job, reader, cancel_event):
+        """The result for job, sharing a provider request with identical ones already running"""
+        key = self.flight_key(job)
+        flight = self._flights.get(key)
+        coalesced = flight is not None
+        if flight is None:
+            shared_cancel = threading.Event()
+            loop = asyncio.get_running_loop()
+            task = loop.run_in_executor(None, contextvars.copy_context().run, self.process, job, shared_cancel)
+            flight = Flight(task, shared_cancel)
+            self._flights[key] = flight
+            task.add_done_callback(lambda _: self._land(key, flight))
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            while True:
+                done, _ = await asyncio.wait({flight.task}, timeout=SERVER_DISCONNECT_POLL)
+                if done:
+                    break
+                # A closed connection is only noticed as EOF on the reader
+                if reader.at_eof():
+                    raise ClientDisconnected("connection closed")
+                if cancel_event.is_set():
+                    raise RequestCancelled("Request was cancelled")
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.cancel_event.set()
+        return dict(flight.task.result(), coalesced=coalesced)
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Marks the error as seen when every waiter has already left
+            flight.task.exception()
+
+    def process(self, job, cancel_event, on_chunk=None):
+        """Run job on a worker thread; on_chunk(text) receives streamed output when given"""
+        processor = self.processor_for(job["service"])
+        processor.ensure_client()
+        block_cache = get_default_block_cache() if job["incremental"] else None
+        usage = {}
+
+        def request(prompt, code):
+            if job["edit_mode"] == EDIT_MODE_DIFF:
+                return processor.process_text_diff(prompt, code, cancel_event=cancel_event, use_cache=job["use_cache"])
+            if needs_chunking(code):
+                return processor.process_text_chunked(
+                    prompt, code, filename=job["filename"], cancel_event=cancel_event, use_cache=job["use_cache"]
+                )
+            return processor.process_text(prompt, code, cancel_event=cancel_event, use_cache=job["use_cache"], usage=usage)
+
+        # Answers only go into the response cache once they pass validation
+        with hold_cache_writes() as held:
+            plan = None
+            if block_cache is not None and job["use_cache"]:
+                plan = processor.incremental_plan(block_cache, job["prompt"], job["code"])
+            if plan is not None:
+                output = processor.process_text_incremental(
+                    job["prompt"], job["code"], plan, filename=job["filename"], cancel_event=cancel_event
+                )
+            elif on_chunk is not None and job["edit_mode"] == EDIT_MODE_FULL and not needs_chunking(job["code"]):
+                chunks = []
+                for text in processor.stream_text(
+                    job["prompt"], job["code"], cancel_event=cancel_event, use_cache=job["use_cache"], usage=usage
+                ):
+                    chunks.append(text)
+                    on_chunk(text)
+                output = "".join(chunks)
+            else:
+                output = request(job["prompt"], job["code"])
+
+            report = None
+            if job["validate"]:
+                output, report = validated(
+                    request, job["prompt"], job["code"], output, Validator(test_command=None), job["filename"]
+                )
+            if report is None or report.ok:
+                held.commit()
+        if block_cache is not None and (report is None or report.ok):
+            processor.remember_blocks(block_cache, job["prompt"], job["code"], output)
+        return {
+            "service": job["service"],
+            "output": output,
+            "usage": usage,
+            "blocks_reused": len(plan.blocks) - plan.changed_blocks if plan is not None else 0,
+            "validation": report.as_dict() if report is not None else None,
+        }
+
+    async def stream_process(self, job, request_id, reader, writer, cancel_event, headers, started):
+        """Answer with server-sent events: start, chunk (as the provider streams), then done or error"""
+        events = EventStream(writer)
+        await events.open(headers)
+        await events.send("start", {"id": request_id, "service": job["service"]})
+        streamed = []
+        loop = asyncio.get_running_loop()
+        chunk_queue = asyncio.Queue()
+        done = object()
+
+        def run():
+            try:
+                return self.process(
+                    job, cancel_event, lambda text: loop.call_soon_threadsafe(chunk_queue.put_nowait, text)
+                )
+            finally:
+                loop.call_soon_threadsafe(chunk_queue.put_nowait, done)
+
+        # run_in_executor does not carry the logging request id over by itself
+        task = loop.run_in_executor(None, contextvars.copy_context().run, run)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(chunk_queue.get(), SERVER_DISCONNECT_POLL)
+                except asyncio.TimeoutError:
+                    if reader.at_eof():
+                        raise ClientDisconnected("connection closed")
+                    continue
+                if item is done:
+                    break
+                streamed.append(item)
+                await events.send("chunk", {"text": item})
+            try:
+                result = await task
+            except Exception as e:
+                status = 499 if isinstance(e, RequestCancelled) else 503 if isinstance(e, CircuitOpenError) else 502
+                await events.send("error", {"id": request_id, "status": status, "error": str(e)})
+                await events.close()
+                return
+            if not streamed:
+                # Not streamed (chunked, incremental or patch mode): the whole answer in one chunk
+                await events.send("chunk", {"text": result["output"]})
+            await events.send("done", dict(result, id=request_id, latency=time.perf_counter() - started,
+                                           coalesced=False))
+            await events.close()
+        except BaseException:
+            cancel_event.set()
+            raise
+
+    def stats(self):
+        return {
+            "uptime": time.time() - self.started_at if self.started_at else 0.0,
+            "connections": self.connections,
+            "requests": self.requests,
+            "in_flight": len(self._requests),
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "clients": {client_id: client.as_dict() for client_id, client in self.clients.items()},
+            "providers": get_default_metrics().summary(),
+            "response_cache": next((p.cache_stats() for p in self.processors.values() if p.cache is not None), {}),
+            "prompt_cache": next((p.prompt_cache_stats() for p in self.processors.values()), {}),
+            "block_cache": get_default_block_cache().stats(),
+        }
+
+
+async def serve(server):
+    await server.start()
+    print(f"promptIDE server listening on {server.url}", flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve AIServiceProcessor over HTTP/JSON for editors and scripts")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="0 picks a free port")
+    parser.add_argument("--service", choices=available_providers(), default="gemini",
+                        help="Provider for requests that do not name one")
+    parser.add_argument("--concurrency", type=int, default=SERVER_MAX_CONCURRENCY,
+                        help="Provider requests running at once over all clients")
+    parser.add_argument("--client-concurrency", type=int, default=SERVER_CLIENT_CONCURRENCY,
+                        help="Requests one client can have running at once")
+    parser.add_argument("--client-max-queued", type=int, default=SERVER_CLIENT_MAX_QUEUED,
+                        help="Requests one client can have waiting before it gets 429")
+    parser.add_argument("--token", default=SERVER_TOKEN, help="Require 'Authorization: Bearer <token>'")
+    args = parser.parse_args(argv)
+    if args.host not in ("127.0.0.1", "localhost", "::1") and not args.token:
+        print("Refusing to listen on a non-loopback address without --token", file=sys.stderr)
+        return 2
+
+    configure_logging()
+    create_output_directories()
+    server = PromptServer(
+        host=args.host,
+        port=args.port,
+        max_concurrency=args.concurrency,
+        client_concurrency=args.client_concurrency,
+        client_max_queued=args.client_max_queued,
+        token=args.token,
+        default_service=args.service
+    )
+    try:
+        asyncio.run(serve(server))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        get_default_metrics().write_json()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from ai_service import RequestCancelled
+from chunking import needs_chunking
+from config import LOGGING_ENABLED
+from logging_setup import request_context
+from patching import EDIT_MODE_DIFF, EDIT_MODE_FULL
+from response_cache import hold_cache_writes
+
+# Opt-in: speculative requests are billed even when their answer is never used
+SPECULATION_ENABLED = False
+# The prompt must be unchanged this long before a speculative request is sent
+SPECULATION_DEBOUNCE_MS = 1200
+# Shorter prompts are most likely still being typed
+SPECULATION_MIN_PROMPT_CHARS = 12
+# Larger requests (input plus output limit) only get the client set up and the prompt tokenized
+SPECULATION_MAX_REQUEST_TOKENS = 16000
+# Tokens spent on speculations that were never used, per rolling window; past it, speculation only warms up
+SPECULATION_MAX_WASTED_TOKENS = 50000
+SPECULATION_WASTE_WINDOW_SECONDS = 60 * 60
+# How often a waiting request checks whether it was cancelled
+SPECULATION_POLL_SECONDS = 0.1
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+class Speculation:
+    """One background request made before the user asked for it"""
+
+    def __init__(self, key, processor, prompt_input, file_content, edit_mode):
+        self.key = key
+        self.processor = processor
+        self.prompt_input = prompt_input
+        self.file_content = file_content
+        self.edit_mode = edit_mode
+        self.cancel_event = threading.Event()
+        self.usage = {}
+        self.span = processor.start_span("speculative")
+        self.future = None
+        self.claimed = False
+        # Response cache writes of the answer; the request that claims it commits them once it is validated
+        self.held = None
+
+    def run(self):
+        self.processor.ensure_client()
+        with hold_cache_writes() as self.held:
+            if self.edit_mode == EDIT_MODE_DIFF:
+                return self.processor.process_text_diff(
+                    self.prompt_input, self.file_content, cancel_event=self.cancel_event, span=self.span
+                )
+            return self.processor.process_text(
+                self.prompt_input, self.file_content, cancel_event=self.cancel_event, usage=self.usage, span=self.span
+            )
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def done(self):
+        return self.future.done()
+
+    @property
+    def tokens_spent(self):
+        """Tokens billed for this speculation so far; nothing if it never reached the provider"""
+        if not self.span.attempts or self.span.cached:
+            return 0
+        budget = self.usage.get("budget", {})
+        input_tokens = self.span.input_tokens or budget.get("input_tokens", 0)
+        # A request cancelled mid-flight still runs to completion at the provider
+        output_tokens = self.span.output_tokens or budget.get("max_output_tokens", 0)
+        return input_tokens + output_tokens
+
+    def wait(self, cancel_event=None):
+        """Block until the speculation finishes; returns its result, or None if there is none to use.
+
+        Setting cancel_event cancels the speculation and raises RequestCancelled.
+        """
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                self.cancel()
+                raise RequestCancelled(f"Request to {self.processor.service} was cancelled")
+            if not wait([self.future], timeout=SPECULATION_POLL_SECONDS).done:
+                continue
+            try:
+                return self.future.result()
+            except Exception as e:
+                if LOGGING_ENABLED:
+                    logger.info("Speculative %s request failed, sending it again: %s", self.processor.service, e)
+                return None
+
+
+class Speculator:
+    """Sends a request for the current prompt in the background so Process can reuse it.
+
+    At most one speculation is current; a newer input cancels the old one.
+    Speculations run one at a time on their own thread, so they never hold up
+    requests the user made, and a cancelled one that has not started costs
+    nothing. Tokens spent on speculations that are replaced instead of claimed
+    count as waste; once SPECULATION_MAX_WASTED_TOKENS is reached in the
+    window, or for requests over SPECULATION_MAX_REQUEST_TOKENS, only the
+    client is set up and the prompt tokenized.
+    """
+
+    def __init__(self, max_wasted_tokens=SPECULATION_MAX_WASTED_TOKENS, waste_window=SPECULATION_WASTE_WINDOW_SECONDS,
+                 max_request_tokens=SPECULATION_MAX_REQUEST_TOKENS, min_prompt_chars=SPECULATION_MIN_PROMPT_CHARS):
+        self.max_wasted_tokens = max_wasted_tokens
+        self.waste_window = waste_window
+        self.max_request_tokens = max_request_tokens
+        self.min_prompt_chars = min_prompt_chars
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        self._current = None
+        # (time, tokens) of speculations that were thrown away
+        self._waste = deque()
+        self.started = 0
+        self.claimed = 0
+        self.warmed = 0
+
+    @staticmethod
+    def make_key(service, prompt_input, file_content, edit_mode=EDIT_MODE_FULL):
+        return service, prompt_input, file_content, edit_mode
+
+    def wasted_tokens(self, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            while self._waste and now - self._waste[0][0] > self.waste_window:
+                self._waste.popleft()
+            return sum(tokens for _, tokens in self._waste)
+
+    def _discard(self, speculation):
+        """Cancel a speculation nobody will claim and book what it cost"""
+        speculation.cancel()
+
+        def book(_future):
+            tokens = speculation.tokens_spent
+            if tokens:
+                with self._lock:
+                    self._waste.append((time.monotonic(), tokens))
+                if LOGGING_ENABLED:
+                    logger.info("Discarded speculative %s request (%s tokens)", speculation.processor.service, tokens)
+
+        speculation.future.add_done_callback(book)
+
+    def speculate(self, processor, prompt_input, file_content, edit_mode=EDIT_MODE_FULL):
+        """Make a speculation for this input the current one, unless it already is; returns it or None"""
+        if len(prompt_input) < self.min_prompt_chars or not file_content:
+            return None
+        key = self.make_key(processor.service, prompt_input, file_content, edit_mode)
+        with self._lock:
+            current = self._current
+            if current is not None and current.key == key and not current.cancel_event.is_set():
+                return current
+            speculation = Speculation(key, processor, prompt_input, file_content, edit_mode)
+            self._current = speculation
+        if current is not None:
+            self._discard(current)
+        speculation.future = self._executor.submit(self._run, speculation)
+        return speculation
+
+    def _run(self, speculation):
+        """Send the speculative request, or only warm up when it is too large or over the waste cap"""
+        processor = speculation.processor
+        if speculation.cancel_event.is_set():
+            return None
+        with request_context(f"spec-{id(speculation):x}"):
+            # Also fills the processor's prepared-prompt memo, which the real request reuses
+            plan = processor.warm_prompt(speculation.prompt_input, speculation.file_content, speculation.edit_mode)
+            cost = plan.input_tokens + plan.max_output_tokens
+            if needs_chunking(speculation.file_content) or cost > self.max_request_tokens or \
+                    self.wasted_tokens() + cost > self.max_wasted_tokens:
+                processor.ensure_client()
+                with self._lock:
+                    self.warmed += 1
+                return None
+            with self._lock:
+                self.started += 1
+            if LOGGING_ENABLED:
+                logger.info("Speculative %s request for %s tokens", processor.service, cost)
+            return speculation.run()
+
+    def claim(self, service, prompt_input, file_content, edit_mode=EDIT_MODE_FULL):
+        """Take the speculation made for exactly this input, if any; any other one is discarded"""
+        key = self.make_key(service, prompt_input, file_content, edit_mode)
+        with self._lock:
+            current, self._current = self._current, None
+        if current is None:
+            return None
+        if current.key != key or current.cancel_event.is_set():
+            self._discard(current)
+            return None
+        current.claimed = True
+        with self._lock:
+            self.claimed += 1
+        return current
+
+    def cancel(self):
+        """Discard the current speculation, e.g. when the input changes"""
+        with self._lock:
+            current, self._current = self._current, None
+        if current is not None:
+            self._discard(current)
+
+    def stats(self):
+        return {
+            "started": self.started,
+            "claimed": self.claimed,
+            "warmed": self.warmed,
+            "wasted_tokens": self.wasted_tokens(),
+        }
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,69 @@
+import ast
+import os
+
+import pytest
+
+from ai_service import AIServiceProcessor
+from chunking import CHUNK_MAX_CHARS, keep_spacing, split_source, stitch
+from fake_server import FakeModelServer
+from providers import LocalOpenAIProvider
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def big_class_source():
+    methods = "".join(
+        f"    def method_{i}(self, value):\n"
+        f"        # step {i}\n"
+        f"        if value:\n"
+        f"            return value + {i}\n"
+        f"        \n"
+        f"        return {i}\n\n"
+        for i in range(150)
+    )
+    return f"import os\n\n\nclass Big:\n    \"\"\"Docstring\"\"\"\n\n{methods}\ndef after():\n    return Big()\n"
+
+
+@pytest.fixture(scope="module")
+def processor():
+    with FakeModelServer(latency=0, tokens_per_second=10 ** 7) as fake:
+        yield AIServiceProcessor(service="local", provider=LocalOpenAIProvider(base_url=fake.url), cache=False,
+                                 prompt_cache=False)
+
+
+def test_split_covers_the_file():
+    source = big_class_source()
+    chunks = split_source(source, "big.py")
+    assert len(chunks) > 2
+    assert all(len(chunk.text) <= CHUNK_MAX_CHARS for chunk in chunks)
+    assert "".join(chunk.text for chunk in chunks) == source
+
+
+def test_method_chunks_are_sent_dedented():
+    method_chunks = [chunk for chunk in split_source(big_class_source(), "big.py") if chunk.indent]
+    assert method_chunks
+    for chunk in method_chunks:
+        assert chunk.indent == "    "
+        assert chunk.code.startswith("def method_")
+
+
+def test_restore_puts_back_indentation_and_spacing():
+    chunks = split_source(big_class_source(), "big.py")
+    assert stitch(chunk.restore(chunk.code.strip()) for chunk in chunks) == big_class_source()
+
+
+def test_keep_spacing():
+    assert keep_spacing("\n\n    x = 1\n\n", "    x = 2") == "\n\n    x = 2\n\n"
+    assert keep_spacing("\n\n", "x") == "x"
+
+
+@pytest.mark.parametrize("filename", ["big.py", "main.py", "ai_service.py"])
+def test_round_trip_through_fake_server(processor, filename):
+    if filename == "big.py":
+        source = big_class_source()
+    else:
+        with open(os.path.join(REPO_ROOT, filename), encoding="utf-8") as file:
+            source = file.read()
+    stitched = processor.process_text_chunked("Change nothing", source, filename=filename, use_cache=False)
+    ast.parse(stitched)
+    assert stitched == source
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from ai_service import AIServiceProcessor, RequestCancelled
+from fake_server import FakeModelServer
+from providers import LocalOpenAIProvider
+from retry_policy import CircuitBreaker, RateLimiter
+
+CODE = "".join(f"def f{i}(x):\n    return x + {i}\n\n" for i in range(200))
+
+
+@pytest.fixture
+def server():
+    with FakeModelServer(latency=0.01, tokens_per_second=20000, stream_batch_tokens=8) as fake:
+        yield fake
+
+
+def half_open_processor(server):
+    """A processor whose circuit is open with the cool-down over, so its next call is the probe"""
+    processor = AIServiceProcessor(service="local", provider=LocalOpenAIProvider(base_url=server.url), cache=False,
+                                   prompt_cache=False)
+    processor.circuit_breaker = CircuitBreaker("local", failure_threshold=1, reset_timeout=0)
+    processor.circuit_breaker.record_failure()
+    assert processor.circuit_breaker.state == CircuitBreaker.OPEN
+    return processor
+
+
+def assert_next_call_allowed(processor):
+    assert processor.process_text("next", CODE, use_cache=False) == CODE.strip()
+    assert processor.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_closed_stream_frees_probe(server):
+    processor = half_open_processor(server)
+    stream = processor.stream_text("probe", CODE, use_cache=False)
+    next(stream)
+    assert processor.circuit_breaker.state == CircuitBreaker.HALF_OPEN
+    stream.close()
+    assert processor.circuit_breaker.state == CircuitBreaker.OPEN
+    assert_next_call_allowed(processor)
+
+
+def test_cancelled_stream_frees_probe(server):
+    processor = half_open_processor(server)
+    cancel_event = threading.Event()
+    stream = processor.stream_text("probe", CODE, cancel_event=cancel_event, use_cache=False)
+    next(stream)
+    cancel_event.set()
+    with pytest.raises(RequestCancelled):
+        list(stream)
+    assert_next_call_allowed(processor)
+
+
+def test_cancel_while_rate_limited_frees_probe(server):
+    processor = half_open_processor(server)
+    processor.rate_limiter = RateLimiter(requests_per_minute=1)
+    processor.rate_limiter.acquire()
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+    with pytest.raises(RequestCancelled):
+        processor.process_text("probe", CODE, cancel_event=cancel_event, use_cache=False)
+    processor.rate_limiter = RateLimiter()
+    assert_next_call_allowed(processor)
+
+
+def test_stale_probe_token_is_ignored():
+    breaker = CircuitBreaker("x", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    probe = breaker.before_call()
+    breaker.record_success()
+    breaker.end_probe(probe)
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,24 @@
+import pytest
+
+from client_registry import clear_clients, get_client, get_openai_client
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    clear_clients()
+    yield
+    clear_clients()
+
+
+def test_same_config_shares_one_client():
+    assert get_client("test", object, {"a": 1}) is get_client("test", object, {"a": 1})
+    assert get_client("test", object, {"a": 1}) is not get_client("test", object, {"a": 2})
+
+
+def test_openai_clients_are_not_shared_across_api_keys():
+    pytest.importorskip("openai")
+    first = get_openai_client(api_key="key-1", base_url="http://127.0.0.1:1/v1")
+    second = get_openai_client(api_key="key-2", base_url="http://127.0.0.1:1/v1")
+    assert first is not second
+    assert second.api_key == "key-2"
+    assert get_openai_client(api_key="key-1", base_url="http://127.0.0.1:1/v1") is first
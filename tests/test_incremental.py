@@ -0,0 +1,80 @@
+import ast
+
+import pytest
+
+from ai_service import AIServiceProcessor
+from fake_server import FakeModelServer
+from incremental import HEADER, BlockCache, align_outputs, split_blocks
+from providers import LocalOpenAIProvider
+
+
+def module_source(count=60, changed=None):
+    functions = "".join(
+        f"# function {i}\ndef f{i}(x):\n    return x + {100 if i == changed else i}\n\n\n" for i in range(count)
+    )
+    return f"import os\n\n\n{functions}class Holder:\n    value = 1\n"
+
+
+def test_blocks_join_back_into_the_source():
+    source = module_source()
+    blocks = split_blocks(source)
+    assert "".join(block.text for block in blocks) == source
+    assert blocks[0].key == HEADER
+    # Blank lines and comments above a def belong to it
+    assert blocks[0].text == "import os\n"
+    assert blocks[1].key == "f0" and blocks[1].text.startswith("\n\n# function 0\n")
+    assert split_blocks("def broken(:\n") is None
+
+
+def test_repeated_names_are_numbered():
+    keys = [block.key for block in split_blocks("def f():\n    pass\n\n\ndef f():\n    pass\n")]
+    assert keys == ["f", "f#2"]
+
+
+def test_align_outputs_matches_blocks_by_name():
+    source = "def a():\n    return 1\n\n\ndef b():\n    return 2\n"
+    output = "def a():\n    return 10\n\n\ndef helper():\n    pass\n\n\ndef b():\n    return 2\n"
+    parts = align_outputs(split_blocks(source), output)
+    assert parts[0] == "def a():\n    return 10\n\n\ndef helper():\n    pass\n"
+    assert parts[1] == "\n\ndef b():\n    return 2\n"
+
+
+def test_align_outputs_with_a_removed_block():
+    source = "def a():\n    return 1\n\n\ndef b():\n    return 2\n"
+    assert align_outputs(split_blocks(source), "def b():\n    return 2\n") == ["", "def b():\n    return 2\n"]
+    assert align_outputs(split_blocks(source), "x = (") is None
+
+
+def test_plan_merges_remembered_blocks_with_new_answers():
+    cache = BlockCache(min_chars=0)
+    source = module_source()
+    cache.record("scope", source, source.replace("return x", "return -x"))
+    edited = module_source(changed=7)
+    plan = cache.plan("scope", edited)
+    assert plan.changed_blocks == 1
+    region_text = plan.region_text(plan.regions[0])
+    merged = plan.merge([region_text.replace("return x", "return -x")])
+    assert merged == edited.replace("return x", "return -x")
+
+
+@pytest.fixture
+def processor():
+    with FakeModelServer(latency=0, tokens_per_second=10 ** 7) as fake:
+        yield AIServiceProcessor(service="local", provider=LocalOpenAIProvider(base_url=fake.url), cache=False,
+                                 prompt_cache=False), fake
+
+
+def test_incremental_round_trip_through_fake_server(processor):
+    processor, fake = processor
+    cache = BlockCache()
+    source = module_source()
+    first = processor.process_text("Change nothing", source, use_cache=False)
+    assert processor.remember_blocks(cache, "Change nothing", source, first)
+    edited = module_source(changed=30)
+    plan = processor.incremental_plan(cache, "Change nothing", edited)
+    assert plan is not None and plan.changed_blocks == 1
+    sent_before = fake.requests
+    merged = processor.process_text_incremental("Change nothing", edited, plan, use_cache=False)
+    assert fake.requests == sent_before + 1
+    ast.parse(merged)
+    assert merged.strip() == edited.strip()
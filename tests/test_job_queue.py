@@ -0,0 +1,40 @@
+import pytest
+
+from job_queue import DONE, PENDING, RUNNING, JobQueue, JobRunner
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.sqlite3"))
+    yield queue
+    queue.close()
+
+
+def test_duplicate_stays_in_its_first_batch(job_queue):
+    job_id, created = job_queue.submit("local", {"path": "a.py"}, kind="file", batch_id="first")
+    again, created_again = job_queue.submit("local", {"path": "a.py"}, kind="file", priority=5, batch_id="second")
+    assert created and not created_again and again == job_id
+    assert job_queue.get(job_id).batch_id == "first"
+    assert job_queue.get(job_id).priority == 5
+    assert [job.id for job in job_queue.jobs(batch_id="first")] == [job_id]
+    assert [job.id for job in job_queue.jobs(batch_id="second")] == [job_id]
+    assert dict(job_queue.batches()) == {"first": {PENDING: 1}, "second": {PENDING: 1}}
+
+
+def test_running_duplicate_joins_the_new_batch(job_queue):
+    job_id, _ = job_queue.submit("local", {"path": "a.py"}, kind="file", batch_id="first")
+    assert job_queue.claim("local", "first").id == job_id
+    job_queue.submit("local", {"path": "a.py"}, kind="file", batch_id="second")
+    assert job_queue.counts("second") == {RUNNING: 1}
+    job_queue.complete(job_id, "{}")
+    assert job_queue.counts("first") == job_queue.counts("second") == {DONE: 1}
+
+
+def test_runner_of_the_second_batch_runs_a_shared_job_once(job_queue):
+    job_queue.submit("local", {"path": "a.py"}, kind="file", batch_id="first")
+    job_queue.submit("local", {"path": "b.py"}, kind="file", batch_id="second")
+    job_queue.submit("local", {"path": "a.py"}, kind="file", batch_id="second")
+    handled = []
+    JobRunner(job_queue, lambda job, cancel_event: handled.append(job.payload["path"]) or "ok", "second").run()
+    assert sorted(handled) == ["a.py", "b.py"]
+    assert job_queue.counts("first") == {DONE: 1}
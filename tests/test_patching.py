@@ -0,0 +1,58 @@
+import pytest
+
+from ai_service import AIServiceProcessor
+from fake_server import FakeModelServer
+from patching import DIVIDER_MARKER, REPLACE_MARKER, SEARCH_MARKER, PatchError, apply_patch, parse_search_replace
+from providers import LocalOpenAIProvider
+
+SOURCE = "import os\n\n\ndef first():\n    return 1\n\n\ndef second():\n    return 2\n"
+
+
+def block(search, replace):
+    return f"{SEARCH_MARKER}\n{search}\n{DIVIDER_MARKER}\n{replace}\n{REPLACE_MARKER}"
+
+
+def test_search_replace_blocks_apply_in_order():
+    response = "\n".join([block("    return 1", "    return 10"), block("def second():", "def renamed():")])
+    assert apply_patch(SOURCE, response) == SOURCE.replace("return 1", "return 10").replace("second", "renamed")
+
+
+def test_search_replace_inside_fences():
+    response = "Here you go:\n```\n" + block("    return 2", "    return 20") + "\n```\n"
+    assert parse_search_replace(response) == [("    return 2", "    return 20")]
+    assert apply_patch(SOURCE, response) == SOURCE.replace("return 2", "return 20")
+
+
+def test_search_replace_tolerates_trailing_whitespace():
+    assert apply_patch(SOURCE, block("def first():  ", "def first(x):")) == SOURCE.replace("first()", "first(x)")
+
+
+def test_ambiguous_or_missing_search_is_rejected():
+    with pytest.raises(PatchError):
+        apply_patch(SOURCE, block("    return", "    return 0"))
+    with pytest.raises(PatchError):
+        apply_patch(SOURCE, block("def third():", "def fourth():"))
+
+
+def test_unified_diff():
+    diff = "--- a.py\n+++ a.py\n@@ -8,2 +8,3 @@\n def second():\n-    return 2\n+    value = 2\n+    return value\n"
+    assert apply_patch(SOURCE, diff) == SOURCE.replace("    return 2\n", "    value = 2\n    return value\n")
+
+
+def test_unified_diff_with_wrong_line_numbers():
+    diff = "@@ -1,2 +1,2 @@\n def first():\n-    return 1\n+    return 11\n"
+    assert apply_patch(SOURCE, diff) == SOURCE.replace("return 1\n", "return 11\n")
+
+
+def test_no_edits_is_an_error():
+    with pytest.raises(PatchError):
+        apply_patch(SOURCE, SOURCE)
+
+
+def test_diff_mode_falls_back_to_the_whole_file():
+    # The fake model echoes the code instead of edits, so the full-file request is made
+    with FakeModelServer(latency=0) as fake:
+        processor = AIServiceProcessor(service="local", provider=LocalOpenAIProvider(base_url=fake.url), cache=False,
+                                       prompt_cache=False)
+        assert processor.process_text_diff("Change nothing", SOURCE, use_cache=False) == SOURCE.strip()
+        assert fake.requests == 2
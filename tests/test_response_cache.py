@@ -0,0 +1,47 @@
+import pytest
+
+from ai_service import AIServiceProcessor
+from fake_server import FakeModelServer
+from providers import LocalOpenAIProvider
+from response_cache import ResponseCache, hold_cache_writes
+
+CODE = "def f(x):\n    return x\n"
+
+
+@pytest.fixture
+def server():
+    with FakeModelServer(latency=0) as fake:
+        yield fake
+
+
+def local_processor(server, temperature):
+    provider = LocalOpenAIProvider(base_url=server.url, config={"temperature": temperature, "max_tokens": 1024})
+    return AIServiceProcessor(service="local", provider=provider, cache=ResponseCache(db_path=None),
+                              prompt_cache=False)
+
+
+def test_deterministic_requests_are_cached(server):
+    processor = local_processor(server, 0)
+    assert processor.process_text("Keep it", CODE) == CODE.strip()
+    assert processor.process_text("Keep it", CODE) == CODE.strip()
+    assert server.requests == 1
+    assert processor.cache.stats()["hits"] == 1
+
+
+def test_sampled_requests_bypass_the_cache(server):
+    processor = local_processor(server, 0.7)
+    processor.process_text("Keep it", CODE)
+    processor.process_text("Keep it", CODE)
+    assert server.requests == 2
+    assert processor.cache.stats()["bypassed"] == 2
+
+
+def test_held_writes_are_dropped_unless_committed(server):
+    processor = local_processor(server, 0)
+    with hold_cache_writes():
+        processor.process_text("Keep it", CODE)
+    assert processor.cache.stats()["memory_entries"] == 0
+    with hold_cache_writes() as held:
+        processor.process_text("Keep it", CODE)
+        held.commit()
+    assert processor.cache.stats()["memory_entries"] == 1
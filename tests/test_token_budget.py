@@ -0,0 +1,15 @@
+from token_budget import MIN_OUTPUT_TOKENS, model_limits, output_budget
+
+
+def test_output_budget_grows_with_the_code():
+    assert output_budget(10, "gpt-4o") == MIN_OUTPUT_TOKENS
+    assert output_budget(4000, "gpt-4o") > 4000
+
+
+def test_output_budget_is_capped_at_the_model_limit():
+    assert output_budget(10 ** 6, "gpt-4o") == model_limits("gpt-4o")[1]
+
+
+def test_configured_limit_is_the_floor():
+    assert output_budget(10, "gpt-4o", configured=4096) == 4096
+    assert output_budget(20000, "gpt-4o", configured=4096) == model_limits("gpt-4o")[1]
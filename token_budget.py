@@ -0,0 +1,315 @@
+import ast
+import importlib.util
+import io
+import math
+import re
+import tokenize
+from functools import lru_cache
+
+# "compact" shrinks over-budget code before sending; "warn" only logs
+TOKEN_BUDGET_MODE = "compact"
+# Whitespace collapsing and comment/docstring stripping change the returned code too, so they are opt-in
+TOKEN_BUDGET_LOSSY = False
+# Expected output size relative to the code sent, per edit mode, plus a fixed allowance
+OUTPUT_TOKEN_RATIO = {"full": 1.25, "diff": 0.5}
+OUTPUT_TOKEN_MARGIN = 256
+MIN_OUTPUT_TOKENS = 512
+# Function bodies are rarely more than this share of a file; past it, eliding cannot get under budget
+ELISION_MAX_SAVING = 0.8
+# (model name prefix, context window, max output tokens); first match wins
+MODEL_LIMITS = [
+    ("gemini-1.5", 1048576, 8192),
+    ("gemini-2", 1048576, 8192),
+    ("gemini", 30720, 2048),
+    ("gpt-4.1", 1047576, 32768),
+    ("gpt-4o", 128000, 16384),
+    ("gpt-4-turbo", 128000, 4096),
+    ("gpt-4", 8192, 4096),
+    ("gpt-3.5-turbo", 16385, 4096),
+    ("o1", 200000, 100000),
+    ("o3", 200000, 100000),
+]
+DEFAULT_MODEL_LIMITS = (32768, 4096)
+# tiktoken is optional; without it token counts are estimated
+TIKTOKEN_AVAILABLE = importlib.util.find_spec("tiktoken") is not None
+
+ELISION_MARKER = "# promptide-elided"
+ELISION_NOTE = (
+    f"Lines of the form '{ELISION_MARKER} <number>' stand for unchanged code that was left out. "
+    "Copy each of them unchanged, with its indentation, to the same place in your answer."
+)
+ELISION_LINE = re.compile(r"^[ \t]*" + re.escape(ELISION_MARKER) + r" (\d+)[ \t]*$")
+# Up to 4 word characters, one punctuation character or a newline with its indentation is about one token
+TOKEN_PIECES = re.compile(r"\w{1,4}|[^\w\s]|\n[ \t]*")
+# Longer texts are estimated from this many evenly spaced samples instead of scanned whole
+ESTIMATE_SAMPLES = 32
+ESTIMATE_SAMPLE_CHARS = 4096
+
+
+def estimate_tokens(text):
+    """Tokenizer-free estimate for source code; errs on the high side"""
+    if len(text) <= ESTIMATE_SAMPLES * ESTIMATE_SAMPLE_CHARS:
+        return len(TOKEN_PIECES.findall(text))
+    step = len(text) // ESTIMATE_SAMPLES
+    sampled = sum(
+        len(TOKEN_PIECES.findall(text[start:start + ESTIMATE_SAMPLE_CHARS]))
+        for start in range(0, step * ESTIMATE_SAMPLES, step)
+    )
+    return math.ceil(sampled * len(text) / (ESTIMATE_SAMPLES * ESTIMATE_SAMPLE_CHARS))
+
+
+@lru_cache(maxsize=8)
+def _tiktoken_encoding(model):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # KeyError for non-OpenAI model names; the BPE files are also downloaded on first use, which fails offline
+        return None
+
+
+def count_tokens(text, model=None):
+    """Input tokens of text for a model; exact with tiktoken for OpenAI models, estimated otherwise"""
+    if TIKTOKEN_AVAILABLE and model:
+        encoding = _tiktoken_encoding(model)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def model_limits(model):
+    """(context window, max output tokens) for a model name"""
+    name = (model or "").lower()
+    for prefix, context_window, max_output in MODEL_LIMITS:
+        if name.startswith(prefix) or f"/{prefix}" in name:
+            return context_window, max_output
+    return DEFAULT_MODEL_LIMITS
+
+
+def output_budget(code_tokens, model, edit_mode="full", configured=None):
+    """max_output_tokens sized from the code being edited, within the model's limit.
+
+    Never below the configured limit: a prompt may ask for much more code than it sends.
+    """
+    _, max_output = model_limits(model)
+    wanted = math.ceil(code_tokens * OUTPUT_TOKEN_RATIO.get(edit_mode, 1.0)) + OUTPUT_TOKEN_MARGIN
+    return max(configured or 0, min(max_output, max(MIN_OUTPUT_TOKENS, wanted)))
+
+
+class BudgetPlan:
+    """Token accounting for one request"""
+
+    def __init__(self, model, input_tokens, code_tokens, max_output_tokens, edit_mode="full", compaction=None):
+        self.model = model
+        self.input_tokens = input_tokens
+        self.code_tokens = code_tokens
+        self.max_output_tokens = max_output_tokens
+        self.edit_mode = edit_mode
+        self.context_window, self.model_max_output = model_limits(model)
+        self.compaction = compaction or []
+
+    @property
+    def over_budget(self):
+        return self.input_tokens + self.max_output_tokens > self.context_window
+
+    @property
+    def output_may_truncate(self):
+        """The whole file is expected back but may not fit the model's output limit"""
+        expected = math.ceil(self.code_tokens * OUTPUT_TOKEN_RATIO.get(self.edit_mode, 1.0))
+        return expected > self.max_output_tokens
+
+    def as_dict(self):
+        return {
+            "model": self.model,
+            "input_tokens": self.input_tokens,
+            "max_output_tokens": self.max_output_tokens,
+            "context_window": self.context_window,
+            "over_budget": self.over_budget,
+            "output_may_truncate": self.output_may_truncate,
+            "compaction": list(self.compaction),
+        }
+
+
+def collapse_whitespace(code):
+    """Drop trailing whitespace and squeeze runs of blank lines to one"""
+    lines = [line.rstrip() for line in code.split("\n")]
+    result = []
+    for line in lines:
+        if line or (result and result[-1]):
+            result.append(line)
+    return "\n".join(result)
+
+
+def strip_comments_and_docstrings(code):
+    """Remove comments and docstrings from Python code; other text is returned unchanged"""
+    try:
+        tree = ast.parse(code)
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+    except (SyntaxError, tokenize.TokenError, ValueError):
+        return code
+    # Removed lines become None and are dropped at the end, so line numbers stay valid
+    lines = code.split("\n")
+    for token in tokens:
+        if token.type == tokenize.COMMENT:
+            row, col = token.start
+            lines[row - 1] = lines[row - 1][:col].rstrip() or None
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+                lines[first.lineno - 1:first.end_lineno] = [None] * (first.end_lineno - first.lineno + 1)
+                if len(node.body) == 1:
+                    # The docstring was the whole body
+                    lines[first.lineno - 1] = " " * first.col_offset + "pass"
+    return "\n".join(line for line in lines if line is not None)
+
+
+def _elision_candidates(tree):
+    """Top-level functions and methods, not nested functions"""
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            yield node
+        elif isinstance(node, ast.ClassDef):
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    yield item
+
+
+def elide_functions(code, keep_text, tokens_to_save, model=None):
+    """Replace bodies of functions not mentioned in keep_text with numbered marker lines.
+
+    Largest bodies go first until about tokens_to_save tokens are saved.
+    Returns (code, elided) where elided maps marker numbers to the original
+    lines, for restore_elided().
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code, {}
+    lines = code.split("\n")
+    candidates = []
+    for node in _elision_candidates(tree):
+        first = node.body[0]
+        if node.name in keep_text or first.lineno <= node.lineno:
+            continue
+        # Keep the signature (and decorators); the body starts on its own line
+        start, end = first.lineno - 1, node.end_lineno
+        body = "\n".join(lines[start:end])
+        candidates.append((count_tokens(body, model), start, end, first.col_offset))
+
+    chosen = []
+    saved = 0
+    for tokens, start, end, col in sorted(candidates, reverse=True):
+        if saved >= tokens_to_save:
+            break
+        chosen.append((start, end, col))
+        saved += tokens
+
+    elided = {}
+    for number, (start, end, col) in enumerate(sorted(chosen, reverse=True), start=1):
+        elided[number] = lines[start:end]
+        lines[start:end] = [" " * col + f"{ELISION_MARKER} {number}"]
+    return "\n".join(lines), elided
+
+
+def restore_elided(text, elided):
+    """Put elided code back in place of its marker lines"""
+    if not elided:
+        return text
+    lines = []
+    for line in text.split("\n"):
+        match = ELISION_LINE.match(line)
+        if match and int(match.group(1)) in elided:
+            lines.extend(elided[int(match.group(1))])
+        else:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def restore_elided_stream(chunks, elided):
+    """restore_elided for streamed output; holds back at most one partial line"""
+    if not elided:
+        yield from chunks
+        return
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        complete, newline, pending = pending.rpartition("\n")
+        if newline:
+            yield restore_elided(complete, elided) + "\n"
+    if pending:
+        yield restore_elided(pending, elided)
+
+
+class PreparedPrompt:
+    """The prompt actually sent, its budget and how to undo any elision in the answer.
+
+    prefix is the start of prompt that stays the same across prompts for the
+    same code (set by the caller, see AIServiceProcessor._prepare_prompt).
+    """
+
+    def __init__(self, prompt, plan, elided=None, prefix="", prefix_tokens=0):
+        self.prompt = prompt
+        self.plan = plan
+        self.elided = elided or {}
+        self.prefix = prefix
+        self.prefix_tokens = prefix_tokens
+
+    def restore(self, text):
+        return restore_elided(text, self.elided)
+
+    def restore_stream(self, chunks):
+        return restore_elided_stream(chunks, self.elided)
+
+
+def prepare_prompt(prompt_input, file_content, render, model=None, edit_mode="full", mode=None, lossy=None,
+                   max_output_tokens=None):
+    """Render the prompt and, if it is over the model's budget, compact the code.
+
+    render(prompt_input, code, note) builds the prompt text. max_output_tokens
+    is the configured output limit, the least the plan asks for. Compaction tries,
+    in order: eliding bodies of functions the prompt does not mention (undone
+    by PreparedPrompt.restore), then, if lossy, collapsing whitespace and
+    stripping comments and docstrings.
+    """
+    mode = mode or TOKEN_BUDGET_MODE
+    lossy = TOKEN_BUDGET_LOSSY if lossy is None else lossy
+
+    def plan_for(code, note="", steps=()):
+        prompt = render(prompt_input, code, note)
+        code_tokens = count_tokens(code, model)
+        # Counted apart so the code is only tokenized once
+        template_tokens = count_tokens(render(prompt_input, "", note), model)
+        plan = BudgetPlan(
+            model,
+            code_tokens + template_tokens,
+            code_tokens,
+            output_budget(code_tokens, model, edit_mode, max_output_tokens),
+            edit_mode,
+            list(steps)
+        )
+        return prompt, plan
+
+    prompt, plan = plan_for(file_content)
+    if not plan.over_budget or mode != "compact":
+        return PreparedPrompt(prompt, plan)
+
+    code = file_content
+    steps = []
+    elided = {}
+    excess = plan.input_tokens + plan.max_output_tokens - plan.context_window
+    if excess <= plan.code_tokens * ELISION_MAX_SAVING:
+        # Elided bodies also shrink the expected output, so each saved token counts about twice
+        code, elided = elide_functions(code, prompt_input, math.ceil(excess / 2), model)
+    if elided:
+        steps.append(f"elided {len(elided)} function bodies")
+        prompt, plan = plan_for(code, ELISION_NOTE, steps)
+    if plan.over_budget and lossy:
+        for name, transform in (("collapsed whitespace", collapse_whitespace),
+                                ("stripped comments and docstrings", strip_comments_and_docstrings)):
+            code = transform(code)
+            steps.append(name)
+            prompt, plan = plan_for(code, ELISION_NOTE if elided else "", steps)
+            if not plan.over_budget:
+                break
+    return PreparedPrompt(prompt, plan, elided)
@@ -0,0 +1,391 @@
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from config import LOGGING_ENABLED
+from patching import FENCE
+
+# Check model output before it is shown or written
+VALIDATION_ENABLED = True
+# Failed output is sent back with the errors this many times before it is returned as it is
+VALIDATION_MAX_REPROMPTS = 1
+# "auto" uses ruff or pyflakes when installed; None turns linting off
+VALIDATION_LINT = "auto"
+# Test command run against the candidate in a copy of the project, e.g. "python -m pytest -x -q"; None to skip
+VALIDATION_TEST_COMMAND = None
+VALIDATION_LINT_TIMEOUT = 30
+VALIDATION_TEST_TIMEOUT = 300
+VALIDATION_MEMORY_BYTES = 2 * 1024 * 1024 * 1024
+# Lint and test subprocesses running at once, over all threads (batch runs validate in parallel)
+VALIDATION_MAX_PROCESSES = max(2, os.cpu_count() or 1)
+# Only these environment variables reach lint and test processes; API keys stay out
+VALIDATION_ENV_KEEP = ("PATH", "HOME", "LANG", "LC_ALL", "TMPDIR", "TEMP", "TMP", "SYSTEMROOT", "VIRTUAL_ENV")
+# ruff rules for errors that break the code at runtime (syntax errors, undefined names)
+RUFF_FATAL_RULES = "E9,F63,F7,F82"
+PYFLAKES_FATAL = ("undefined name", "syntax error", "invalid syntax")
+# Errors quoted back to the model are cut to this many characters
+VALIDATION_ERROR_CHARS = 4000
+# Inputs whose own errors are remembered per Validator, so a reprompt does not check the input again
+VALIDATION_BASELINES = 32
+
+SANDBOX_EXEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_exec.py")
+
+_process_slots = threading.BoundedSemaphore(VALIDATION_MAX_PROCESSES)
+
+if LOGGING_ENABLED:
+    logger = logging.getLogger(__name__)
+
+
+def strip_fences(text):
+    """Remove markdown code fences the model wrapped the code in.
+
+    A fence pair around the whole answer is removed. If there is prose
+    around fenced code, the largest fenced block is kept.
+    """
+    lines = text.split("\n")
+    fences = [i for i, line in enumerate(lines) if FENCE.match(line)]
+    if not fences:
+        return text
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    if content[0] == fences[0] and content[-1] == fences[-1] and len(fences) >= 2:
+        return "\n".join(lines[fences[0] + 1:fences[-1]])
+    blocks = [(fences[i], fences[i + 1]) for i in range(0, len(fences) - 1, 2)]
+    if not blocks:
+        return "\n".join(line for line in lines if not FENCE.match(line))
+    start, end = max(blocks, key=lambda block: block[1] - block[0])
+    return "\n".join(lines[start + 1:end])
+
+
+def is_python(filename=None, original=None):
+    """Whether output for this input should be held to Python's rules"""
+    if filename:
+        return filename.endswith((".py", ".pyw", ".pyi"))
+    if original is None:
+        return False
+    try:
+        compile(original, "<input>", "exec", dont_inherit=True)
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+
+def _sandbox_env():
+    env = {key: os.environ[key] for key in VALIDATION_ENV_KEEP if key in os.environ}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def run_sandboxed(command, cwd, timeout, cpu_seconds=None):
+    """Run command in its own process group with a stripped environment and resource limits.
+
+    Returns (returncode, output, timed_out). At most VALIDATION_MAX_PROCESSES
+    run at once; the rest wait for a slot.
+    """
+    cpu_seconds = cpu_seconds if cpu_seconds is not None else int(timeout) + 1
+    wrapped = [sys.executable, "-I", SANDBOX_EXEC, str(cpu_seconds), str(VALIDATION_MEMORY_BYTES), "--"] + command
+    with _process_slots:
+        process = subprocess.Popen(
+            wrapped,
+            cwd=cwd,
+            env=_sandbox_env(),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            # A new group, so a timeout also kills whatever the tests started
+            start_new_session=os.name != "nt"
+        )
+        try:
+            output, _ = process.communicate(timeout=timeout)
+            return process.returncode, output, False
+        except subprocess.TimeoutExpired:
+            if os.name != "nt":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            output, _ = process.communicate()
+            return process.returncode, output, True
+
+
+def lint_command(lint=VALIDATION_LINT):
+    """(command without the file argument, fatal filter) for the configured linter, or None"""
+    if lint == "auto":
+        lint = "ruff" if shutil.which("ruff") else "pyflakes" if importlib.util.find_spec("pyflakes") else None
+    if lint == "ruff":
+        command = [shutil.which("ruff") or "ruff", "check", "--no-cache", "--output-format", "concise",
+                   "--select", RUFF_FATAL_RULES]
+        return command, lambda line: True
+    if lint == "pyflakes":
+        return [sys.executable, "-m", "pyflakes"], lambda line: any(text in line for text in PYFLAKES_FATAL)
+    return None
+
+
+def overlay_project(root, rel_path, code):
+    """A temporary view of root with rel_path replaced by code.
+
+    Everything else is symlinked, so even a large project is set up in a few
+    file operations. Returns the directory; remove it with shutil.rmtree.
+    """
+    overlay = tempfile.mkdtemp(prefix="promptide-validate-")
+    source_dir, target_dir = root, overlay
+    parts = rel_path.split("/")
+    for depth, part in enumerate(parts):
+        for entry in os.listdir(source_dir):
+            if entry != part and entry != "__pycache__":
+                os.symlink(os.path.join(source_dir, entry), os.path.join(target_dir, entry))
+        source_dir = os.path.join(source_dir, part)
+        target_dir = os.path.join(target_dir, part)
+        if depth < len(parts) - 1:
+            os.mkdir(target_dir)
+    with open(target_dir, "w", encoding="utf-8") as file:
+        file.write(code)
+    return overlay
+
+
+class ValidationReport:
+    """Outcome of validating one model answer"""
+
+    def __init__(self, code, checked=True):
+        self.code = code
+        self.checked = checked
+        self.errors = []
+        self.warnings = []
+        self.stages = {}
+        self.reprompts = 0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def summary(self):
+        if not self.checked:
+            return "not checked"
+        if self.ok:
+            stages = ", ".join(self.stages)
+            return f"passed {stages}" + (f" after {self.reprompts} retry(s)" if self.reprompts else "")
+        return "failed: " + "; ".join(error.split("\n", 1)[0] for error in self.errors)
+
+    def as_dict(self):
+        return {
+            "ok": self.ok,
+            "checked": self.checked,
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "stages": self.stages,
+            "reprompts": self.reprompts,
+        }
+
+
+def _error_key(error):
+    """An error without its line and column, to match it with the same error elsewhere in the file"""
+    return re.sub(r"(line |:)\d+(:\d+)?", r"\1#", error.split("\n", 1)[0])
+
+
+def _failed_tests(output):
+    """Test ids pytest reported as failed or erroring"""
+    return {line.split(" - ", 1)[0] for line in output.splitlines() if line.startswith(("FAILED ", "ERROR "))}
+
+
+class Validator:
+    """Checks model output: fences, syntax, lint and (optionally) the project's tests.
+
+    Syntax is checked in-process with compile(), which does not run the code.
+    Lint and tests run as sandboxed subprocesses (see run_sandboxed) with
+    timeouts. Tests need project_root and the file's path inside it.
+
+    Only errors the answer brought in count: when the original input has
+    the same error, or the same tests already fail, they become warnings.
+    The input is only checked once the answer fails a stage.
+    """
+
+    def __init__(self, lint=VALIDATION_LINT, test_command=VALIDATION_TEST_COMMAND, project_root=None,
+                 lint_timeout=VALIDATION_LINT_TIMEOUT, test_timeout=VALIDATION_TEST_TIMEOUT):
+        self.lint = lint
+        self.test_command = shlex.split(test_command) if isinstance(test_command, str) else test_command
+        self.project_root = project_root and os.path.abspath(project_root)
+        self.lint_timeout = lint_timeout
+        self.test_timeout = test_timeout
+        self._baselines = {}
+        self._baselines_lock = threading.Lock()
+
+    def validate(self, output, filename=None, original=None):
+        code = strip_fences(output)
+        if not is_python(filename, original):
+            return ValidationReport(code, checked=False)
+        report = ValidationReport(code)
+        label = os.path.basename(filename) if filename else "<output>"
+        baseline = self._baseline(filename, original)
+
+        started = time.perf_counter()
+        errors = self._syntax_errors(code, label)
+        report.stages["syntax"] = time.perf_counter() - started
+        if errors:
+            self._add_errors(report, errors, baseline, "syntax", lambda: self._syntax_errors(original, label))
+            # Nothing further can be checked in code that does not compile
+            return report
+
+        linter = lint_command(self.lint) if self.lint else None
+        if linter is not None:
+            started = time.perf_counter()
+            errors, warnings = self._lint(linter, code, label)
+            report.stages["lint"] = time.perf_counter() - started
+            report.warnings.extend(warnings)
+            if errors:
+                self._add_errors(report, errors, baseline, "lint", lambda: self._lint(linter, original, label)[0])
+
+        rel_path = self._project_path(filename)
+        if report.ok and self.test_command and rel_path is not None:
+            self._test(report, rel_path, baseline)
+        return report
+
+    def _baseline(self, filename, original):
+        """Memo of the original input's errors per stage, filled in as stages need them; None without an input"""
+        if original is None:
+            return None
+        key = hashlib.sha256(f"{filename}\0{original}".encode("utf-8")).hexdigest()
+        with self._baselines_lock:
+            if key not in self._baselines:
+                if len(self._baselines) >= VALIDATION_BASELINES:
+                    self._baselines.pop(next(iter(self._baselines)))
+                self._baselines[key] = {"original": original}
+            return self._baselines[key]
+
+    @staticmethod
+    def _baseline_stage(baseline, stage, check):
+        if stage not in baseline:
+            baseline[stage] = check()
+        return baseline[stage]
+
+    def _add_errors(self, report, errors, baseline, stage, check):
+        """Errors go to the report; those the input already had become warnings"""
+        existing = Counter(_error_key(error) for error in self._baseline_stage(baseline, stage, check)) \
+            if baseline is not None else Counter()
+        for error in errors:
+            key = _error_key(error)
+            if existing[key]:
+                existing[key] -= 1
+                report.warnings.append(f"already in the input: {error}")
+            else:
+                report.errors.append(error)
+
+    @staticmethod
+    def _syntax_errors(code, label):
+        try:
+            compile(code, label, "exec", dont_inherit=True)
+        except (SyntaxError, ValueError) as e:
+            line = f"line {e.lineno}: " if getattr(e, "lineno", None) else ""
+            return [f"syntax error, {line}{getattr(e, 'msg', str(e))}"]
+        return []
+
+    def _lint(self, linter, code, label):
+        """(errors, warnings) the linter finds in code"""
+        command, fatal = linter
+        name = label if label.endswith(".py") else "output.py"
+        with tempfile.TemporaryDirectory(prefix="promptide-lint-") as directory:
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as file:
+                file.write(code)
+            returncode, output, timed_out = run_sandboxed(command + [name], directory, self.lint_timeout)
+        if timed_out:
+            return [], [f"lint timed out after {self.lint_timeout}s"]
+        errors, warnings = [], []
+        for line in output.splitlines():
+            line = line.strip()
+            # Only findings ("name:line:col: message"), not summaries
+            if line.startswith(name + ":"):
+                line = label + line[len(name):]
+                (errors if fatal(line) else warnings).append(line)
+        return errors, warnings
+
+    def _project_path(self, filename):
+        if not filename or not self.project_root:
+            return None
+        rel_path = os.path.relpath(os.path.abspath(filename), self.project_root)
+        if rel_path.startswith(".."):
+            return None
+        return rel_path.replace(os.sep, "/")
+
+    def _run_tests(self, rel_path, code):
+        """(returncode, output, timed_out) of the test command with code in place of rel_path"""
+        overlay = overlay_project(self.project_root, rel_path, code)
+        try:
+            return run_sandboxed(self.test_command, overlay, self.test_timeout)
+        finally:
+            shutil.rmtree(overlay, ignore_errors=True)
+
+    def _test(self, report, rel_path, baseline):
+        started = time.perf_counter()
+        try:
+            returncode, output, timed_out = self._run_tests(rel_path, report.code)
+        except OSError as e:
+            report.warnings.append(f"tests not run, could not set up the project copy: {e}")
+            return
+        report.stages["tests"] = time.perf_counter() - started
+        if timed_out:
+            report.errors.append(f"tests timed out after {self.test_timeout}s")
+            return
+        if returncode == 0:
+            return
+        # The end of a test run's output has the failures and the summary
+        error = f"tests failed (exit code {returncode}):\n{output[-VALIDATION_ERROR_CHARS:]}"
+        if baseline is not None:
+            try:
+                before = self._baseline_stage(baseline, "tests",
+                                              lambda: self._run_tests(rel_path, baseline["original"]))
+            except OSError:
+                before = None
+            if before is not None and not before[2] and before[0] != 0:
+                failed, failed_before = _failed_tests(output), _failed_tests(before[1])
+                new = failed - failed_before
+                # Without test ids to compare, the run failing the same way counts as the same failure
+                if not new and (failed or returncode == before[0]):
+                    report.warnings.append(f"tests already failed before the change (exit code {before[0]})")
+                    return
+                if new:
+                    error = f"tests failed (exit code {returncode}), newly failing:\n" + \
+                        "\n".join(sorted(new))[:VALIDATION_ERROR_CHARS]
+        report.errors.append(error)
+
+
+def fix_prompt(prompt_input, report):
+    """Prompt asking the model to repair its previous answer"""
+    errors = "\n".join(report.errors)[:VALIDATION_ERROR_CHARS]
+    return (
+        f"{prompt_input}\n\n"
+        "The code below already has these changes applied, but it fails validation:\n"
+        f"{errors}\n"
+        "Fix these problems without undoing the requested changes."
+    )
+
+
+def validated(run, prompt_input, file_content, output, validator, filename=None, max_reprompts=VALIDATION_MAX_REPROMPTS,
+              progress=None):
+    """Validate output and, while it fails, ask again with the errors; returns (code, report).
+
+    run(prompt, content) makes a model request. The last answer is returned
+    even if it still fails, with the errors in the report.
+    """
+    report = validator.validate(output, filename, file_content)
+    reprompts = 0
+    while report.checked and not report.ok and reprompts < max_reprompts:
+        reprompts += 1
+        if LOGGING_ENABLED:
+            logger.info("Output for %s failed validation, asking again: %s", filename or "<input>", report.summary())
+        if progress:
+            progress(f"Output failed validation ({report.summary()}), asking for a fix...")
+        output = run(fix_prompt(prompt_input, report), report.code)
+        report = validator.validate(output, filename, file_content)
+    report.reprompts = reprompts
+    if LOGGING_ENABLED and report.checked and not report.ok:
+        logger.warning("Output for %s still fails validation: %s", filename or "<input>", report.summary())
+    return report.code, report
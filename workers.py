@@ -0,0 +1,349 @@
+import threading
+import time
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+from ai_service import RequestCancelled
+from file_io import iter_text_chunks, write_text_atomic
+from logging_setup import request_context
+from patching import EDIT_MODE_DIFF, EDIT_MODE_FULL
+from response_cache import hold_cache_writes
+from validation import validated
+
+
+class WorkerSignals(QObject):
+    """Signals emitted by a ProcessWorker, delivered on the GUI thread"""
+    progress = pyqtSignal(int, str)
+    chunk = pyqtSignal(int, str)
+    finished = pyqtSignal(int, str)
+    error = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+    compared = pyqtSignal(int, object)
+    validated = pyqtSignal(int, object)
+
+
+class WarmUpSignals(QObject):
+    finished = pyqtSignal(str)
+    error = pyqtSignal(str, str)
+
+
+class IndexSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+
+class ProjectIndexWorker(QRunnable):
+    """Bring a ProjectIndex up to date on a pool thread"""
+
+    def __init__(self, project_index):
+        super().__init__()
+        self.project_index = project_index
+        self.signals = IndexSignals()
+
+    def run(self):
+        try:
+            counts = self.project_index.update(progress=self.signals.progress.emit)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.finished.emit(counts)
+
+
+# Decoded chunks the GUI has not inserted yet; the loader waits rather than run ahead
+FILE_LOAD_MAX_PENDING_CHUNKS = 4
+
+
+class FileSignals(QObject):
+    # Text chunks travel as Python objects to avoid a QString round-trip per chunk
+    info = pyqtSignal(int, object)
+    chunk = pyqtSignal(int, object)
+    progress = pyqtSignal(int, int, int)
+    finished = pyqtSignal(int)
+    error = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+
+
+class FileLoadWorker(QRunnable):
+    """Decode a file on a pool thread and hand it to the GUI in chunks"""
+
+    def __init__(self, load_id, path):
+        super().__init__()
+        self.load_id = load_id
+        self.path = path
+        self.info = None
+        self.cancel_event = threading.Event()
+        self.pending_chunks = threading.Semaphore(FILE_LOAD_MAX_PENDING_CHUNKS)
+        self.signals = FileSignals()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def chunk_consumed(self):
+        """Called by the GUI once a chunk is in the editor"""
+        self.pending_chunks.release()
+
+    def run(self):
+        try:
+            chunks = iter_text_chunks(self.path, cancel_event=self.cancel_event)
+            info = next(chunks)
+            self.signals.info.emit(self.load_id, info)
+            for text, bytes_read in chunks:
+                while not self.pending_chunks.acquire(timeout=0.1):
+                    if self.cancel_event.is_set():
+                        break
+                if self.cancel_event.is_set():
+                    break
+                self.signals.chunk.emit(self.load_id, text)
+                self.signals.progress.emit(self.load_id, bytes_read, info.size)
+        except Exception as e:
+            self.signals.error.emit(self.load_id, str(e))
+            return
+        if self.cancel_event.is_set():
+            self.signals.cancelled.emit(self.load_id)
+        else:
+            self.signals.finished.emit(self.load_id)
+
+
+class FileSaveWorker(QRunnable):
+    """Write text atomically on a pool thread"""
+
+    def __init__(self, save_id, path, text, encoding="utf-8", newline=None):
+        super().__init__()
+        self.save_id = save_id
+        self.path = path
+        self.text = text
+        self.encoding = encoding
+        self.newline = newline
+        self.signals = FileSignals()
+
+    def run(self):
+        try:
+            write_text_atomic(
+                self.path,
+                self.text,
+                encoding=self.encoding,
+                newline=self.newline,
+                progress=lambda done, total: self.signals.progress.emit(self.save_id, done, total)
+            )
+        except Exception as e:
+            self.signals.error.emit(self.save_id, str(e))
+        else:
+            self.signals.finished.emit(self.save_id)
+
+
+class ClientWarmUpWorker(QRunnable):
+    """Import and configure a provider SDK off the GUI thread"""
+
+    def __init__(self, processor):
+        super().__init__()
+        self.processor = processor
+        self.signals = WarmUpSignals()
+
+    def run(self):
+        try:
+            self.processor.ensure_client()
+        except Exception as e:
+            self.signals.error.emit(self.processor.service, str(e))
+        else:
+            self.signals.finished.emit(self.processor.service)
+
+
+class ProcessWorker(QRunnable):
+    """Run one AIServiceProcessor request on a QThreadPool thread"""
+
+    def __init__(self, request_id, processor, prompt_input, file_content, stream=False, filename=None,
+                 edit_mode=EDIT_MODE_FULL, speculation=None, validator=None, block_cache=None):
+        super().__init__()
+        self.request_id = request_id
+        self.processor = processor
+        self.prompt_input = prompt_input
+        self.file_content = file_content
+        self.stream = stream
+        self.filename = filename
+        self.edit_mode = edit_mode
+        # A speculation.Speculation already sent for this exact input; its answer is used if it succeeds
+        self.speculation = speculation
+        # A validation.Validator; failed output is sent back once with the errors
+        self.validator = validator
+        # An incremental.BlockCache; when set, only the blocks changed since the last answer are sent
+        self.block_cache = block_cache
+        self.cancel_event = threading.Event()
+        # Time spent waiting in the thread pool shows up as the span's queue wait
+        self.queued_at = time.perf_counter()
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        """Ask the worker to stop; a queued worker will not start the request at all"""
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def run(self):
+        with request_context(f"gui-{self.request_id}"):
+            self._run()
+
+    def _run(self):
+        if self.is_cancelled():
+            self.signals.cancelled.emit(self.request_id)
+            return
+
+        report = None
+        # Answers only go into the response cache once they pass validation
+        with hold_cache_writes() as held:
+            try:
+                output_text = self.request()
+                if self.speculation is not None:
+                    held.adopt(self.speculation.held)
+                if self.validator is not None:
+                    output_text, report = validated(
+                        self.request_fix,
+                        self.prompt_input,
+                        self.file_content,
+                        output_text,
+                        self.validator,
+                        self.filename,
+                        progress=lambda message: self.signals.progress.emit(self.request_id, message)
+                    )
+                    self.signals.validated.emit(self.request_id, report)
+            except RequestCancelled:
+                self.signals.cancelled.emit(self.request_id)
+                return
+            except Exception as e:
+                if self.is_cancelled():
+                    self.signals.cancelled.emit(self.request_id)
+                else:
+                    self.signals.error.emit(self.request_id, str(e))
+                return
+            if report is None or report.ok:
+                held.commit()
+
+        # The provider call itself cannot be interrupted, so a result that arrives
+        # after Cancel was pressed is dropped instead of being shown.
+        if self.is_cancelled():
+            self.signals.cancelled.emit(self.request_id)
+            return
+        if self.block_cache is not None and (report is None or report.ok):
+            self.processor.remember_blocks(self.block_cache, self.prompt_input, self.file_content, output_text)
+        self.signals.finished.emit(self.request_id, output_text)
+
+    def request(self):
+        if self.speculation is not None:
+            self.signals.progress.emit(self.request_id, "Using the request sent while you were typing...")
+            output_text = self.speculation.wait(self.cancel_event)
+            if output_text is not None:
+                return output_text
+
+        span = self.processor.start_span("stream" if self.stream else "request", self.queued_at)
+        if self.block_cache is not None:
+            plan = self.processor.incremental_plan(self.block_cache, self.prompt_input, self.file_content)
+            if plan is not None:
+                self.signals.progress.emit(
+                    self.request_id,
+                    f"Sending {plan.changed_blocks} changed block(s) of {len(plan.blocks)} to {self.processor.service}..."
+                )
+                return self.processor.process_text_incremental(
+                    self.prompt_input,
+                    self.file_content,
+                    plan,
+                    filename=self.filename,
+                    cancel_event=self.cancel_event,
+                    progress=self.report_region_progress,
+                    span=span
+                )
+        self.signals.progress.emit(self.request_id, f"Sending request to {self.processor.service}...")
+        if self.stream:
+            return self.run_streaming(span)
+        if self.edit_mode == EDIT_MODE_DIFF:
+            return self.processor.process_text_diff(
+                self.prompt_input,
+                self.file_content,
+                cancel_event=self.cancel_event,
+                span=span
+            )
+        return self.processor.process_text_chunked(
+            self.prompt_input,
+            self.file_content,
+            filename=self.filename,
+            cancel_event=self.cancel_event,
+            progress=self.report_chunk_progress,
+            span=span
+        )
+
+    def request_fix(self, prompt_input, file_content):
+        """Follow-up request with the validation errors; not streamed"""
+        if self.edit_mode == EDIT_MODE_DIFF:
+            return self.processor.process_text_diff(prompt_input, file_content, cancel_event=self.cancel_event)
+        return self.processor.process_text_chunked(
+            prompt_input,
+            file_content,
+            filename=self.filename,
+            cancel_event=self.cancel_event,
+            progress=self.report_chunk_progress
+        )
+
+    def report_chunk_progress(self, done, total):
+        self.signals.progress.emit(self.request_id, f"Processed chunk {done}/{total}")
+
+    def report_region_progress(self, done, total):
+        self.signals.progress.emit(self.request_id, f"Processed changed region {done}/{total}")
+
+    def run_streaming(self, span=None):
+        """Forward streamed chunks as they arrive and return the full text"""
+        chunks = []
+        for text in self.processor.stream_text(
+            self.prompt_input,
+            self.file_content,
+            cancel_event=self.cancel_event,
+            span=span
+        ):
+            chunks.append(text)
+            self.signals.chunk.emit(self.request_id, text)
+        return "".join(chunks)
+
+
+class FanOutWorker(QRunnable):
+    """Run a request against several providers through a MultiProviderDispatcher"""
+
+    RACE = "race"
+    COMPARE = "compare"
+
+    def __init__(self, request_id, dispatcher, mode, prompt_input, file_content):
+        super().__init__()
+        self.request_id = request_id
+        self.dispatcher = dispatcher
+        self.mode = mode
+        self.prompt_input = prompt_input
+        self.file_content = file_content
+        # The ProviderResult that won the race, set before finished is emitted
+        self.winner = None
+        self.cancel_event = threading.Event()
+        self.queued_at = time.perf_counter()
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        with request_context(f"gui-{self.request_id}"):
+            self._run()
+
+    def _run(self):
+        if self.cancel_event.is_set():
+            self.signals.cancelled.emit(self.request_id)
+            return
+
+        services = ", ".join(self.dispatcher.services)
+        self.signals.progress.emit(self.request_id, f"Sending request to {services} ({self.mode})...")
+        try:
+            if self.mode == self.RACE:
+                result = self.dispatcher.race(self.prompt_input, self.file_content, cancel_event=self.cancel_event)
+                self.winner = result
+                self.signals.progress.emit(self.request_id, f"{result.service} answered first in {result.latency:.2f}s")
+                self.signals.finished.emit(self.request_id, result.text)
+            else:
+                results = self.dispatcher.compare(self.prompt_input, self.file_content, cancel_event=self.cancel_event)
+                self.signals.compared.emit(self.request_id, results)
+        except RequestCancelled:
+            self.signals.cancelled.emit(self.request_id)
+        except Exception as e:
+            self.signals.error.emit(self.request_id, str(e))